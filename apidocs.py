@@ -0,0 +1,134 @@
+# API documentation: the OpenAPI spec at /apispec.json and Swagger UI at /docs/.
+#
+# The spec is served from memory with an ETag: read from API_SPEC_FILE when
+# that names one generated at build time with
+#
+#     python -m apidocs apispec.json
+#
+# or else built once, on its first request, instead of being rebuilt from
+# every route on every request.
+#
+# API_DOCS=on (default) serves Swagger UI through flasgger. API_DOCS=off
+# never imports flasgger (nor jsonschema, PyYAML and mistune behind it),
+# which keeps worker boot lean; /docs/ is then not served, and the spec
+# only when API_SPEC_FILE is set.
+
+import hashlib
+import os
+import sys
+import threading
+
+from flask import request
+
+from compression import etag_variants
+
+
+API_DOCS = os.environ.get('API_DOCS', 'on')
+API_SPEC_FILE = os.environ.get('API_SPEC_FILE')
+SPEC_ENDPOINT = 'apispec'
+SPEC_ROUTE = '/apispec.json'
+
+SWAGGER_CONFIG = {
+    "headers": [],
+    "specs": [
+        {
+            "endpoint": SPEC_ENDPOINT,
+            "route": SPEC_ROUTE,
+            "rule_filter": lambda rule: True,
+            "model_filter": lambda tag: True,
+        }
+    ],
+    "static_url_path": "/flasgger_static",
+    "swagger_ui": True,
+    "specs_route": "/docs/"
+}
+
+
+def swag_from(specs):
+    """Attach a route's OpenAPI dict, where flasgger looks for it.
+
+    Same as flasgger.swag_from for dict specs without validation, but does
+    not import flasgger.
+    """
+    def decorator(function):
+        function.specs_dict = specs
+        return function
+    return decorator
+
+
+class CachedSpec:
+    """The serialized spec, built by `build` on first use, with its ETag."""
+
+    def __init__(self, build):
+        self._build = build
+        self._lock = threading.Lock()
+        self._body = None
+        self.etag = None
+
+    def body(self):
+        if self._body is None:
+            with self._lock:
+                if self._body is None:
+                    body = self._build()
+                    self.etag = hashlib.sha256(body).hexdigest()[:32]
+                    self._body = body
+        return self._body
+
+    def response(self, app):
+        body = self.body()
+        # Also matches the ETag of a compressed variant (see compression.py)
+        if any(etag in request.if_none_match for etag in etag_variants(self.etag)):
+            response = app.response_class(status=304)
+        else:
+            response = app.response_class(body, mimetype='application/json')
+        response.set_etag(self.etag)
+        response.headers['Cache-Control'] = 'public, max-age=300'
+        return response
+
+
+def _spec_file_reader(path):
+    def read():
+        with open(path, 'rb') as spec_file:
+            return spec_file.read()
+    return read
+
+
+def init_app(app):
+    """Register the docs routes for API_DOCS; returns the CachedSpec or None."""
+    if API_DOCS == 'on':
+        from flasgger import Swagger
+
+        swagger = Swagger(app, config=SWAGGER_CONFIG)
+        spec = CachedSpec(_spec_file_reader(API_SPEC_FILE) if API_SPEC_FILE else
+                          lambda: app.json.dumps(swagger.get_apispecs(SPEC_ENDPOINT)).encode())
+        # flasgger's own view rebuilds the spec on every request
+        app.view_functions[f'flasgger.{SPEC_ENDPOINT}'] = lambda: spec.response(app)
+        return spec
+
+    if API_DOCS != 'off':
+        raise ValueError("API_DOCS must be on or off")
+    if not API_SPEC_FILE:
+        return None
+    spec = CachedSpec(_spec_file_reader(API_SPEC_FILE))
+    app.add_url_rule(SPEC_ROUTE, SPEC_ENDPOINT, lambda: spec.response(app))
+    return spec
+
+
+def main(argv=None):
+    # Write the spec for API_SPEC_FILE (stdout without an argument)
+    argv = sys.argv[1:] if argv is None else argv
+    os.environ['API_DOCS'] = 'on'
+    os.environ.pop('API_SPEC_FILE', None)
+    import models
+
+    with models.app.test_request_context():
+        body = models.api_spec.body()
+    if argv:
+        with open(argv[0], 'wb') as spec_file:
+            spec_file.write(body)
+    else:
+        sys.stdout.buffer.write(body)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,220 @@
+# Async entry point: `uvicorn asgi:app` (dependencies in requirements-asgi.txt).
+#
+# /get_books is served by a native async handler that runs the count and page
+# queries concurrently over an async psycopg pool, so a worker is never blocked
+# on the database. Every other route, including /docs/ and /apispec.json, is
+# the unchanged Flask app, so the response contract and Swagger docs are shared.
+import asyncio
+import contextlib
+import os
+import time
+
+from a2wsgi import WSGIMiddleware
+from flask import jsonify
+from psycopg.conninfo import make_conninfo
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+from werkzeug.datastructures import MultiDict
+from werkzeug.http import parse_etags
+
+import catalog
+import compression
+import metrics
+import models
+from db import db_config, pool
+
+
+def _conninfo(config):
+    # psycopg2 accepts "database"; libpq only knows "dbname". psycopg returns
+    # bytes instead of str unless the client encoding is a real one.
+    config = dict(config, client_encoding='utf8')
+    if 'database' in config:
+        config['dbname'] = config.pop('database')
+    return make_conninfo(**{key: value for key, value in config.items() if value is not None})
+
+
+async def _configure(connection):
+    connection.prepared_max = models.prepared_statements.max_per_connection
+
+
+async_pool = AsyncConnectionPool(
+    _conninfo(db_config),
+    min_size=int(os.environ.get('DB_POOL_MIN_SIZE', 1)),
+    max_size=int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+    timeout=float(os.environ.get('DB_POOL_TIMEOUT', 5)),
+    max_lifetime=float(os.environ.get('DB_POOL_MAX_LIFETIME', 1800)),
+    # psycopg prepares statements itself; prepare each shape on first use,
+    # like models.prepared_statements does for psycopg2
+    kwargs={
+        'row_factory': dict_row,
+        # Same limit as the psycopg2 pool (DB_CONNECT_TIMEOUT)
+        'connect_timeout': pool.connect_timeout,
+        'prepare_threshold': 0 if models.prepared_statements.enabled else None,
+    },
+    configure=_configure,
+    open=False,
+)
+
+
+async def _fetch(phase, query, params, fetch_all):
+    async with contextlib.AsyncExitStack() as stack:
+        with metrics.phase('connect'):
+            connection = await stack.enter_async_context(async_pool.connection())
+        with metrics.phase(phase), models.slow_queries.watch(phase, query, params):
+            cursor = await connection.execute(query, params)
+            return await cursor.fetchall() if fetch_all else await cursor.fetchone()
+
+
+def _get_books_from_memory(*args):
+    # The worker thread runs in a copy of the request's context, so the
+    # stale snapshot flag is handed back with the result
+    return models.get_books_from_memory(*args), models._stale_read.get()
+
+
+async def get_books_from_db(page=1, per_page=25, book_ids=None, languages=None, mime_types=None,
+                            topics=None, authors=None, titles=None, after=None, count='exact',
+                            search='substring', sort='downloads', fields=None, lookahead=False):
+    # Same arguments and result as models.get_books_from_db, but the count
+    # and page statements run at the same time on two pooled connections
+    # (unless BOOKS_COUNT_EXECUTION=window folds the count into the page).
+    filters = {
+        'book_ids': book_ids,
+        'languages': languages,
+        'mime_types': mime_types,
+        'topics': topics,
+        'authors': authors,
+        'titles': titles
+    }
+    result, stale = await run_in_threadpool(_get_books_from_memory, filters, page, per_page,
+                                            after, count, search, sort, lookahead)
+    if stale:
+        models._stale_read.set(True)
+    if result is not None:
+        return result
+
+    plan = models.plan_books_query(filters, page, per_page, after, count, search, sort, fields,
+                                   lookahead)
+
+    if plan['count_query']:
+        count_row, rows = await asyncio.gather(
+            _fetch('count', *plan['count_query'], fetch_all=False),
+            _fetch('page', *plan['page_query'], fetch_all=True),
+        )
+        total_count = models.finish_count(plan, count_row)
+    else:
+        rows = await _fetch('page', *plan['page_query'], fetch_all=True)
+        total_count = plan['total_count']
+        if plan['window_count']:
+            total_count = models.finish_window_count(plan, rows)
+            if total_count is None:
+                count_row = await _fetch('count', *plan['fallback_count_query'], fetch_all=False)
+                total_count = models.finish_count(plan, count_row)
+
+    return total_count, models.page_rows(plan, rows)
+
+
+def _json_body(data):
+    # Byte-for-byte what the Flask app would send, so cached bodies and ETags
+    # are interchangeable between the two entry points
+    with models.app.app_context():
+        return jsonify(data).get_data()
+
+
+def _json_response(data, status_code=200, headers=None):
+    return Response(_json_body(data), status_code=status_code, headers=headers,
+                    media_type='application/json')
+
+
+async def get_books(request):
+    # Same Server-Timing header and /metrics histograms as the Flask view
+    token = metrics.start()
+    started = time.perf_counter()
+    labels = {'shape': 'invalid', 'cache': 'none'}
+    try:
+        response = await _get_books(request, labels)
+    finally:
+        phases = metrics.finish(token)
+    phases['total'] = time.perf_counter() - started
+    models.observe_books_request(labels, phases)
+    if models.SERVER_TIMING:
+        response.headers['Server-Timing'] = metrics.server_timing(phases)
+    return response
+
+
+def _compressed_response(request, body, etag):
+    # A cached /get_books CompressedBody in the client's encoding; the
+    # compressed variant is made once and kept with the cached body
+    headers = models.cache_headers(etag)
+    with metrics.phase('compress'):
+        encoding = models.compressor.select(len(body), request.headers.get('accept-encoding'))
+        content = body.get(models.compressor, encoding)
+    if encoding is not None:
+        headers['Content-Encoding'] = encoding
+        headers['ETag'] = f'"{etag}-{encoding}"'
+    return Response(content, headers=headers, media_type='application/json')
+
+
+async def _get_books(request, labels):
+    args = MultiDict(list(request.query_params.multi_items()))
+    params, error = models.parse_books_args(args)
+    if error:
+        return _json_response({'error': error}, status_code=400)
+    labels['shape'] = models.filter_shape(params)
+    models._stale_read.set(False)
+
+    try:
+        body = None
+        with metrics.phase('cache'):
+            catalog_version = await run_in_threadpool(catalog.current_version)
+            cache_key = models.books_cache_key(params, catalog_version)
+            if cache_key is not None:
+                etag = models.books_etag(cache_key)
+                if models.not_modified(parse_etags(request.headers.get('if-none-match')), etag):
+                    labels['cache'] = 'not_modified'
+                    return Response(status_code=304, headers=models.cache_headers(etag))
+                body = models.response_cache.get(cache_key)
+                labels['cache'] = 'miss' if body is None else 'hit'
+        if body is not None:
+            return _compressed_response(request, body, etag)
+
+        total_count, books = await get_books_from_db(**models.books_query_kwargs(params))
+        if models._stale_read.get():
+            labels['cache'] = 'stale'
+            cache_key = None
+
+        with metrics.phase('format'):
+            data = models.books_response_data(params, total_count, books)
+        with metrics.phase('encode'):
+            body = _json_body(data)
+        if cache_key is not None:
+            body = compression.CompressedBody(body)
+            models.response_cache.set(cache_key, body)
+            return _compressed_response(request, body, etag)
+        return Response(body, media_type='application/json')
+
+    except Exception as e:
+        print(f"Error in get_books: {str(e)}")
+        labels['cache'] = 'error'
+        return _json_response(models.empty_books_response_data(params['per_page']))
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    await async_pool.open(wait=False)
+    try:
+        yield
+    finally:
+        await async_pool.close()
+
+
+app = Starlette(
+    routes=[
+        Route('/get_books', get_books),
+        Mount('/', app=WSGIMiddleware(models.app)),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,295 @@
+"""Replay a mix of /get_books filter shapes and report latency per shape.
+
+    python -m bench.run --provision --pg-bin /usr/lib/postgresql/16/bin
+    python -m bench.run --database-url postgresql://postgres@127.0.0.1/bench --skip-seed
+    python -m bench.run --url http://127.0.0.1:8000 --database-url ... --skip-seed
+
+--provision starts a throwaway cluster; otherwise the database at
+--database-url is (re)seeded unless --skip-seed is given. Requests go to the
+Flask app in-process by default, or over HTTP to a running server with --url.
+Search terms are sampled from the database itself, so a replay against a copy
+of the production catalog works the same way.
+
+Results print as a table and can be written with --output and compared with
+a previous run via --baseline; the exit status is 1 when any shape's p95
+grew by more than --max-regression.
+"""
+import argparse
+import contextlib
+import json
+import math
+import os
+import random
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+import catalog_load
+from bench import seed as bench_seed
+
+
+def _pick(rng, values, power=1.0):
+    # Earlier values (the most common ones) are picked more often
+    return values[int(len(values) * rng.random() ** power)]
+
+
+# Shape name -> query parameters for one request, given the sampled terms
+SHAPES = {
+    'unfiltered': lambda rng, terms: [],
+    'language': lambda rng, terms: [('language', _pick(rng, terms['languages'], 3.0))],
+    'topic': lambda rng, terms: [('topic', _pick(rng, terms['topics']))],
+    'author': lambda rng, terms: [('author', _pick(rng, terms['authors']))],
+    'title': lambda rng, terms: [('title', _pick(rng, terms['titles']))],
+    'mime_type': lambda rng, terms: [('mime_type', _pick(rng, terms['mime_types']))],
+    'combined': lambda rng, terms: [('language', terms['languages'][0]),
+                                    ('topic', _pick(rng, terms['topics']))],
+    'book_ids': lambda rng, terms: [('book_id', book_id)
+                                    for book_id in rng.sample(terms['book_ids'], 25)],
+    'deep_page': lambda rng, terms: [('page', rng.randint(terms['last_page'] // 2, terms['last_page']))],
+    'large_page': lambda rng, terms: [('per_page', 100)],
+}
+
+TERM_QUERIES = {
+    'languages': """
+        SELECT bl.code FROM books_language AS bl
+        JOIN books_book_languages AS bbl ON bbl.language_id = bl.id
+        GROUP BY bl.code ORDER BY COUNT(*) DESC, bl.code
+    """,
+    'topics': """
+        SELECT split_part(bs.name, ' ', 1) FROM books_subject AS bs
+        ORDER BY md5(bs.id::text || %(seed)s) LIMIT 200
+    """,
+    'authors': """
+        SELECT split_part(ba.name, ',', 1) FROM books_author AS ba
+        ORDER BY md5(ba.id::text || %(seed)s) LIMIT 200
+    """,
+    'titles': """
+        SELECT split_part(bb.title, ' ', 1) FROM books_book AS bb
+        WHERE bb.title <> ''
+        ORDER BY md5(bb.gutenberg_id::text || %(seed)s) LIMIT 200
+    """,
+    'mime_types': """
+        SELECT bf.mime_type FROM books_format AS bf
+        GROUP BY bf.mime_type ORDER BY COUNT(*) DESC, bf.mime_type
+    """,
+    'book_ids': """
+        SELECT bb.gutenberg_id FROM books_book AS bb
+        ORDER BY md5(bb.gutenberg_id::text || %(seed)s) LIMIT 1000
+    """,
+}
+
+
+def load_terms(database_url, seed=1, per_page=25):
+    """Sample filter values from the catalog, deterministically for a seed."""
+    connection = psycopg2.connect(database_url)
+    try:
+        with connection.cursor() as cursor:
+            terms = {}
+            for name, query in TERM_QUERIES.items():
+                cursor.execute(query, {'seed': str(seed)})
+                terms[name] = [row[0] for row in cursor.fetchall()]
+            cursor.execute("SELECT COUNT(*) FROM books_book")
+            terms['last_page'] = max(1, math.ceil(cursor.fetchone()[0] / per_page))
+    finally:
+        connection.close()
+    return terms
+
+
+def build_plan(terms, shapes, requests_per_shape, seed=1):
+    """The replayed requests as (shape, query params), interleaved in a fixed order."""
+    rng = random.Random(seed)
+    plan = [(shape, SHAPES[shape](rng, terms)) for shape in shapes for _ in range(requests_per_shape)]
+    rng.shuffle(plan)
+    return plan
+
+
+def percentile(sorted_values, p):
+    # Nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def in_process_client():
+    """Send requests to the Flask app in this process (one test client per thread)."""
+    import models
+
+    local = threading.local()
+
+    def send(query_string):
+        client = getattr(local, 'client', None)
+        if client is None:
+            client = local.client = models.app.test_client()
+        response = client.get('/get_books?' + query_string)
+        response.get_data()
+        return response.status_code
+
+    return send
+
+
+def http_client(base_url, timeout=30):
+    """Send requests to a running server over HTTP."""
+    def send(query_string):
+        try:
+            with urllib.request.urlopen(f"{base_url.rstrip('/')}/get_books?{query_string}",
+                                        timeout=timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    return send
+
+
+def replay(send, plan, concurrency=4, warmup=0):
+    """Run the plan and return ({shape: [seconds, ...]}, {shape: errors}, wall seconds)."""
+    for shape, params in plan[:warmup]:
+        send(urllib.parse.urlencode(params))
+
+    timings = {}
+    errors = {}
+    lock = threading.Lock()
+
+    def run(item):
+        shape, params = item
+        started = time.perf_counter()
+        try:
+            ok = send(urllib.parse.urlencode(params)) == 200
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            timings.setdefault(shape, []).append(elapsed)
+            if not ok:
+                errors[shape] = errors.get(shape, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(run, plan[warmup:]))
+    return timings, errors, time.perf_counter() - started
+
+
+def summarize(timings, errors, wall_seconds):
+    """Per-shape and overall throughput and latency percentiles, in milliseconds."""
+    def stats(values, error_count):
+        values = sorted(values)
+        return {
+            'requests': len(values),
+            'errors': error_count,
+            'throughput': round(len(values) / wall_seconds, 1) if wall_seconds else None,
+            'mean_ms': round(1000 * sum(values) / len(values), 2) if values else None,
+            'p50_ms': round(1000 * percentile(values, 50), 2) if values else None,
+            'p95_ms': round(1000 * percentile(values, 95), 2) if values else None,
+            'p99_ms': round(1000 * percentile(values, 99), 2) if values else None,
+            'max_ms': round(1000 * values[-1], 2) if values else None,
+        }
+
+    summary = {shape: stats(values, errors.get(shape, 0)) for shape, values in sorted(timings.items())}
+    every = [value for values in timings.values() for value in values]
+    summary['all'] = stats(every, sum(errors.values()))
+    return summary
+
+
+def compare(summary, baseline, max_regression=1.25):
+    """Shapes whose p95 exceeds the baseline p95 by more than max_regression."""
+    regressions = []
+    for shape, stats in summary.items():
+        before = baseline.get(shape, {}).get('p95_ms')
+        if before and stats['p95_ms'] is not None and stats['p95_ms'] > before * max_regression:
+            regressions.append((shape, before, stats['p95_ms']))
+    return regressions
+
+
+def format_table(summary):
+    columns = ('requests', 'errors', 'throughput', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms')
+    lines = [f"{'shape':<12}" + ''.join(f"{column:>12}" for column in columns)]
+    for shape, stats in summary.items():
+        lines.append(f"{shape:<12}" + ''.join(f"{str(stats[column]):>12}" for column in columns))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    target.add_argument('--provision', action='store_true', help='start a throwaway Postgres cluster')
+    parser.add_argument('--pg-bin', help='directory holding initdb and pg_ctl (default: PATH)')
+    parser.add_argument('--keep', action='store_true', help='keep the provisioned cluster data')
+    parser.add_argument('--skip-seed', action='store_true', help='replay against the existing catalog')
+    bench_seed.add_seed_arguments(parser)
+    parser.add_argument('--shapes', default=','.join(SHAPES), help='comma-separated shapes to replay')
+    parser.add_argument('--requests', type=int, default=200, help='requests per shape')
+    parser.add_argument('--warmup', type=int, default=50, help='unrecorded requests sent first')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--url', help='replay over HTTP against a running server')
+    parser.add_argument('--cache', action='store_true',
+                        help='leave the in-process response and count caches enabled')
+    parser.add_argument('--count-execution', choices=('sequential', 'window', 'concurrent'),
+                        help='BOOKS_COUNT_EXECUTION for in-process runs')
+    parser.add_argument('--output', help='write the summary as JSON to this file')
+    parser.add_argument('--baseline', help='summary JSON of a previous run to compare against')
+    parser.add_argument('--max-regression', type=float, default=1.25,
+                        help='allowed p95 growth over the baseline, as a ratio')
+    args = parser.parse_args(argv)
+
+    shapes = [shape for shape in args.shapes.split(',') if shape]
+    unknown = set(shapes) - set(SHAPES)
+    if unknown:
+        parser.error(f"unknown shapes: {', '.join(sorted(unknown))}")
+    if not args.provision and not args.database_url:
+        parser.error('--database-url, DATABASE_URL or --provision is required')
+
+    with contextlib.ExitStack() as stack:
+        database_url = args.database_url
+        if args.provision:
+            database_url = stack.enter_context(bench_seed.provision_cluster(args.pg_bin, args.keep))
+        if not args.skip_seed:
+            bench_seed.seed_database(
+                database_url, args.books, args.seed, force=args.force,
+                migrations=[] if args.no_migrations else catalog_load.MIGRATIONS)
+
+        terms = load_terms(database_url, args.seed)
+        plan = build_plan(terms, shapes, args.requests, args.seed)
+
+        if args.url:
+            send = http_client(args.url)
+        else:
+            # Read by db.py and models.py at import time
+            os.environ['DATABASE_URL'] = database_url
+            if args.count_execution:
+                os.environ['BOOKS_COUNT_EXECUTION'] = args.count_execution
+            if not args.cache:
+                os.environ.setdefault('RESPONSE_CACHE_SIZE', '0')
+                os.environ.setdefault('COUNT_CACHE_SIZE', '0')
+            send = in_process_client()
+
+        warmup = build_plan(terms, shapes, math.ceil(args.warmup / len(shapes)), args.seed + 1)
+        warmup = warmup[:args.warmup]
+        timings, errors, wall_seconds = replay(send, warmup + plan, args.concurrency, len(warmup))
+
+    summary = summarize(timings, errors, wall_seconds)
+    print(format_table(summary))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(summary, json.load(f), args.max_regression)
+        for shape, before, after in regressions:
+            print(f"REGRESSION {shape}: p95 {before}ms -> {after}ms", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
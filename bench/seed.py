@@ -0,0 +1,218 @@
+"""Provision and seed a benchmark database with a synthetic catalog.
+
+    python -m bench.seed --database-url postgresql://postgres@127.0.0.1/bench --books 75000
+
+The catalog is generated from a seeded random.Random, so the same --seed and
+--books always produce identical tables. Distributions follow the real
+Gutenberg catalog loosely: most books are English, a few authors and subjects
+cover a large share of books, and download_count is heavily skewed with a
+small fraction of NULLs.
+"""
+import argparse
+import contextlib
+import os
+import random
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+
+import psycopg2
+
+from catalog_load import MIGRATIONS, check_dependents, check_empty, finish_load, load_catalog
+
+
+LANGUAGES = [
+    ('en', 80.0), ('fr', 5.0), ('de', 3.0), ('fi', 3.0), ('nl', 1.5), ('it', 1.2),
+    ('es', 1.0), ('pt', 0.8), ('zh', 0.5), ('la', 0.4), ('sv', 0.4), ('da', 0.3),
+    ('el', 0.3), ('eo', 0.3), ('hu', 0.3), ('tl', 0.2), ('ca', 0.2), ('pl', 0.2),
+]
+
+# mime type, file extension, share of books that have it
+FORMATS = [
+    ('application/rdf+xml', 'rdf', 1.0),
+    ('application/epub+zip', 'epub', 0.95),
+    ('application/x-mobipocket-ebook', 'mobi', 0.9),
+    ('text/html', 'html', 0.85),
+    ('text/plain; charset=utf-8', 'txt', 0.8),
+    ('image/jpeg', 'cover.jpg', 0.7),
+    ('text/plain; charset=us-ascii', 'ascii.txt', 0.3),
+    ('application/octet-stream', 'zip', 0.25),
+]
+
+_SYLLABLES = [
+    'al', 'ar', 'ba', 'ber', 'ca', 'cor', 'da', 'del', 'en', 'er', 'fa', 'gor',
+    'ha', 'hel', 'in', 'ka', 'lan', 'le', 'lo', 'ma', 'mer', 'na', 'nor', 'o',
+    'pa', 'per', 'ra', 'ri', 'sa', 'sen', 'ta', 'ther', 'to', 'u', 'va', 'ven',
+    'wa', 'win', 'ya', 'zel',
+]
+
+_SUBJECT_FORMS = [
+    '{a} -- {b}', '{a} -- Fiction', '{a}, {b} -- Fiction', '{a} -- History -- {b}',
+    '{a} and {b}', '{a} -- Juvenile fiction', '{a}, {b} -- Biography',
+]
+
+
+def _skewed(rng, n, power):
+    # An index in [0, n) biased towards 0; larger powers skew harder
+    return int(n * rng.random() ** power)
+
+
+def _vocabulary(rng, size):
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 3))))
+    return sorted(words)
+
+
+def generate_catalog(books=75000, seed=1):
+    """Build every books_* table as lists of row tuples (ids included)."""
+    rng = random.Random(seed)
+    words = _vocabulary(rng, 4000)
+
+    def word(power=2.0):
+        return words[_skewed(rng, len(words), power)].capitalize()
+
+    authors = []
+    for author_id in range(1, max(books * 3 // 10, 1) + 1):
+        birth_year = rng.randint(1500, 1950) if rng.random() < 0.9 else None
+        death_year = birth_year + rng.randint(25, 90) if birth_year and rng.random() < 0.9 else None
+        authors.append((author_id, f"{word(1.0)}, {word(1.0)}"[:128], birth_year, death_year, None))
+
+    subjects = []
+    for subject_id in range(1, max(books // 4, 1) + 1):
+        form = rng.choice(_SUBJECT_FORMS)
+        subjects.append((subject_id, form.format(a=word(1.5), b=word(1.5))[:256]))
+
+    shelf_names = set()
+    while len(shelf_names) < 250:
+        shelf_names.add(f"{word(1.0)} {word(1.0)}"[:64])
+    bookshelves = list(enumerate(sorted(shelf_names), start=1))
+
+    codes = [code for code, _ in LANGUAGES]
+    weights = [weight for _, weight in LANGUAGES]
+    languages = list(enumerate(codes, start=1))
+
+    catalog = {
+        'books_author': authors,
+        'books_subject': subjects,
+        'books_bookshelf': bookshelves,
+        'books_language': languages,
+        'books_book': [],
+        'books_book_authors': [],
+        'books_book_languages': [],
+        'books_book_subjects': [],
+        'books_book_bookshelves': [],
+        'books_format': [],
+    }
+
+    for gutenberg_id in range(1, books + 1):
+        title = ' '.join(word() for _ in range(rng.randint(1, 6)))
+        if rng.random() < 0.15:
+            title += ': ' + ' '.join(word() for _ in range(rng.randint(2, 5)))
+        download_count = None if rng.random() < 0.01 else min(int(40 * rng.paretovariate(0.9)) - 40, 150000)
+        catalog['books_book'].append(
+            (gutenberg_id, gutenberg_id, title, download_count, 'Text', rng.random() < 0.02))
+
+        author_count = rng.choices((0, 1, 2, 3), (5, 85, 8, 2))[0]
+        for author_id in {_skewed(rng, len(authors), 3.0) + 1 for _ in range(author_count)}:
+            catalog['books_book_authors'].append((gutenberg_id, author_id))
+
+        language_ids = {rng.choices(range(1, len(codes) + 1), weights)[0]}
+        if rng.random() < 0.02:
+            language_ids.add(rng.randint(1, len(codes)))
+        for language_id in language_ids:
+            catalog['books_book_languages'].append((gutenberg_id, language_id))
+
+        for subject_id in {_skewed(rng, len(subjects), 2.0) + 1 for _ in range(rng.randint(1, 6))}:
+            catalog['books_book_subjects'].append((gutenberg_id, subject_id))
+
+        for shelf_id in {_skewed(rng, len(bookshelves), 2.0) + 1 for _ in range(rng.randint(0, 2))}:
+            catalog['books_book_bookshelves'].append((gutenberg_id, shelf_id))
+
+        for mime_type, extension, share in FORMATS:
+            if rng.random() < share:
+                url = f"https://www.gutenberg.org/ebooks/{gutenberg_id}.{extension}"
+                catalog['books_format'].append((gutenberg_id, mime_type, url))
+
+    return catalog
+
+
+def seed_database(database_url, books=75000, seed=1, migrations=MIGRATIONS, force=False, log=print):
+    """Create the schema, load a synthetic catalog and apply the migrations."""
+    connection = psycopg2.connect(database_url)
+    try:
+        check_empty(connection, force)
+        dependents = check_dependents(connection, migrations)
+        started = time.perf_counter()
+        catalog = generate_catalog(books, seed)
+        load_catalog(connection, catalog)
+        log(f"seeded {books} books ({len(catalog['books_format'])} formats, "
+            f"{len(catalog['books_book_subjects'])} subject links) "
+            f"in {time.perf_counter() - started:.1f}s")
+        finish_load(connection, migrations, log, dependents)
+    finally:
+        connection.close()
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def provision_cluster(pg_bin=None, keep=False, log=print):
+    """Start a throwaway Postgres cluster and yield a URL for an empty database.
+
+    Needs initdb and pg_ctl (from --pg-bin or PATH) and a non-root user.
+    """
+    def tool(name):
+        return os.path.join(pg_bin, name) if pg_bin else name
+
+    data_dir = tempfile.mkdtemp(prefix='gutenberg-bench-')
+    port = _free_port()
+    subprocess.run([tool('initdb'), '-D', data_dir, '-U', 'postgres', '-A', 'trust',
+                    '-E', 'UTF8', '--no-locale'], check=True, stdout=subprocess.DEVNULL)
+    subprocess.run([tool('pg_ctl'), '-D', data_dir, '-l', os.path.join(data_dir, 'server.log'),
+                    '-w', '-o', f"-p {port} -k {data_dir} -c listen_addresses=127.0.0.1", 'start'],
+                   check=True, stdout=subprocess.DEVNULL)
+    log(f"provisioned cluster in {data_dir} on port {port}")
+    try:
+        connection = psycopg2.connect(host='127.0.0.1', port=port, user='postgres', dbname='postgres')
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute("CREATE DATABASE gutenberg_bench")
+        connection.close()
+        yield f"postgresql://postgres@127.0.0.1:{port}/gutenberg_bench"
+    finally:
+        subprocess.run([tool('pg_ctl'), '-D', data_dir, '-m', 'fast', '-w', 'stop'],
+                       stdout=subprocess.DEVNULL)
+        if keep:
+            log(f"kept cluster data in {data_dir}")
+        else:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+
+def add_seed_arguments(parser):
+    parser.add_argument('--books', type=int, default=75000, help='number of books to generate')
+    parser.add_argument('--seed', type=int, default=1, help='random seed for the catalog and the replay')
+    parser.add_argument('--no-migrations', action='store_true',
+                        help='seed the bare schema without applying migrations/*.sql')
+    parser.add_argument('--force', action='store_true', help='replace existing books_* tables')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'), required=False)
+    add_seed_arguments(parser)
+    args = parser.parse_args(argv)
+    if not args.database_url:
+        parser.error('--database-url or DATABASE_URL is required')
+    seed_database(args.database_url, args.books, args.seed,
+                  migrations=[] if args.no_migrations else MIGRATIONS, force=args.force)
+
+
+if __name__ == '__main__':
+    main()
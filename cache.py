@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Bounded, thread-safe LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, max_size=1024, ttl=300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0}
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                self._counters['misses'] += 1
+                return default
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                self._counters['expirations'] += 1
+                self._counters['misses'] += 1
+                return default
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = {'size': len(self._entries), 'max_size': self.max_size, 'ttl': self.ttl}
+            stats.update(self._counters)
+        return stats
+
+
+class SnapshotStore:
+    """The latest result of an expensive build, kept per catalog version.
+
+    Subclasses implement _build(version). The first get() builds in the
+    calling thread, or with wait=False starts a background build and returns
+    None until it is done. Afterwards a stale snapshot keeps being served
+    while one background thread builds its replacement, which is swapped in
+    with a single assignment.
+
+    A snapshot is stale when the catalog version moved, when it is older than
+    `max_age` seconds (if set), or, when there is no catalog version, older
+    than `ttl` seconds.
+    """
+
+    name = 'snapshot'
+
+    def __init__(self, ttl=300.0, max_age=None):
+        self.ttl = ttl
+        self.max_age = max_age
+        self._current = None  # (version, built_at, snapshot)
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._refreshing = False
+
+    def _build(self, version):
+        raise NotImplementedError
+
+    def _fresh(self, current, version):
+        built_version, built_at, _ = current
+        age = time.monotonic() - built_at
+        if self.max_age is not None and age >= self.max_age:
+            return False
+        if built_version != version:
+            return False
+        return version is not None or age < self.ttl
+
+    def get(self, version, wait=True):
+        current = self._current
+        if current is not None:
+            if not self._fresh(current, version):
+                self._refresh_in_background(version)
+            return current[2]
+
+        if not wait:
+            self._refresh_in_background(version)
+            return None
+        with self._build_lock:
+            if self._current is None:
+                self._current = (version, time.monotonic(), self._build(version))
+            return self._current[2]
+
+    def _refresh_in_background(self, version):
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def refresh():
+            try:
+                with self._build_lock:
+                    self._current = (version, time.monotonic(), self._build(version))
+            except Exception as e:
+                print(f"Error building {self.name}: {str(e)}")
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=refresh, name=f"{self.name}-refresh", daemon=True).start()
+
+    def clear(self):
+        self._current = None
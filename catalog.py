@@ -0,0 +1,68 @@
+import os
+import threading
+import time
+
+import psycopg2
+
+from db import pool
+
+
+# How long a worker trusts the catalog version it last read
+VERSION_TTL = float(os.environ.get('CATALOG_VERSION_TTL', 5))
+
+_lock = threading.Lock()
+# `known` is the last version actually read; a failed read answers None but
+# leaves it, so a change that lands across the failure is still noticed
+_state = {'version': None, 'checked_at': None, 'known': None}
+_listeners = []
+
+
+def on_change(callback):
+    """Register callback(old_version, new_version) for catalog changes."""
+    _listeners.append(callback)
+    return callback
+
+
+def current_version():
+    """Return the catalog version (migrations/0004_catalog_version.sql).
+
+    The value is re-read at most every VERSION_TTL seconds per process.
+    Returns None when it cannot be read, in which case callers must not
+    cache anything derived from the catalog.
+    """
+    now = time.monotonic()
+    with _lock:
+        if _state['checked_at'] is not None and now - _state['checked_at'] < VERSION_TTL:
+            return _state['version']
+        # Claim the refresh; concurrent callers keep using the old value
+        _state['checked_at'] = now
+
+    try:
+        with pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute("SELECT version FROM catalog_version")
+            row = cursor.fetchone()
+            cursor.close()
+        version = row[0] if row else None
+    except psycopg2.Error as e:
+        print(f"Could not read catalog version: {str(e)}")
+        version = None
+
+    with _lock:
+        _state['version'] = version
+        previous = _state['known']
+        if version is not None:
+            _state['known'] = version
+
+    if previous is not None and version is not None and version != previous:
+        for callback in _listeners:
+            callback(previous, version)
+    return version
+
+
+def reset():
+    # Forget the cached version so the next call re-reads it
+    with _lock:
+        _state['version'] = None
+        _state['checked_at'] = None
+        _state['known'] = None
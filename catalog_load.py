@@ -0,0 +1,252 @@
+"""Load a catalog into fresh books_* tables.
+
+Shared by rdf_loader.py (the Project Gutenberg RDF catalog) and bench/seed.py
+(a synthetic one). Both pass {table: rows} in COLUMNS order to load_catalog,
+which recreates the tables from schema.sql and COPYs the rows in, then
+finish_load applies the migrations:
+
+    check_empty(connection, force)
+    dependents = check_dependents(connection, migrations)
+    load_catalog(connection, tables)
+    finish_load(connection, migrations, log, dependents)
+"""
+import glob
+import io
+import os
+import time
+
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+SCHEMA_PATH = os.path.join(ROOT_DIR, 'schema.sql')
+MIGRATIONS = sorted(glob.glob(os.path.join(ROOT_DIR, 'migrations', '*.sql')))
+
+# Tables in dependency order, with the columns the loaders fill
+COLUMNS = {
+    'books_author': ('id', 'name', 'birth_year', 'death_year', 'agent_id'),
+    'books_subject': ('id', 'name'),
+    'books_bookshelf': ('id', 'name'),
+    'books_language': ('id', 'code'),
+    'books_book': ('id', 'gutenberg_id', 'title', 'download_count', 'media_type', 'copyright'),
+    'books_book_authors': ('book_id', 'author_id'),
+    'books_book_languages': ('book_id', 'language_id'),
+    'books_book_subjects': ('book_id', 'subject_id'),
+    'books_book_bookshelves': ('book_id', 'bookshelf_id'),
+    'books_format': ('book_id', 'mime_type', 'url'),
+}
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+
+class _RowReader(io.TextIOBase):
+    # A file-like view of COPY text lines, formatted as COPY reads them
+    def __init__(self, rows):
+        self._lines = ('\t'.join(_copy_value(value) for value in row) + '\n' for row in rows)
+        self._pending = ''
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        chunks = [self._pending]
+        length = len(self._pending)
+        for line in self._lines:
+            chunks.append(line)
+            length += len(line)
+            if 0 <= size <= length:
+                break
+        data = ''.join(chunks)
+        if size < 0:
+            size = len(data)
+        self._pending = data[size:]
+        return data[:size]
+
+
+def copy_rows(cursor, table, columns, rows):
+    """COPY an iterable of row tuples into `table`, without buffering them all."""
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", _RowReader(rows))
+
+
+def schema_statements(path=SCHEMA_PATH):
+    """The schema script split into (create, constrain) statement lists.
+
+    `create` drops and creates the bare tables; `constrain` adds their keys,
+    constraints and indexes, and is meant to run after the tables are loaded.
+    """
+    create, constrain = [], []
+    with open(path) as f:
+        for statement in split_statements(f.read()):
+            if statement.upper().startswith(('ALTER TABLE', 'CREATE INDEX')):
+                constrain.append(statement)
+            else:
+                create.append(statement)
+    return create, constrain
+
+
+def load_catalog(connection, catalog, log=None):
+    """Recreate the books_* tables and COPY `catalog` ({table: rows}) into them.
+
+    Runs in one transaction: bare tables are loaded in dependency order
+    (COLUMNS), then get their keys, constraints and indexes.
+    """
+    create, constrain = schema_statements()
+    with connection.cursor() as cursor:
+        for statement in create:
+            cursor.execute(statement)
+        for table, columns in COLUMNS.items():
+            started = time.perf_counter()
+            copy_rows(cursor, table, columns, catalog[table])
+            if 'id' in columns:
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                    f"(SELECT COALESCE(MAX(id), 1) FROM {table}))")
+            if log:
+                log(f"copied {table} in {time.perf_counter() - started:.1f}s")
+        started = time.perf_counter()
+        for statement in constrain:
+            cursor.execute(statement)
+        if log:
+            log(f"built keys and indexes in {time.perf_counter() - started:.1f}s")
+    connection.commit()
+
+
+def split_statements(sql):
+    """Split a SQL script on top-level semicolons.
+
+    Quotes, dollar-quoted bodies and -- comments are respected, so migrations
+    can run one statement at a time (CREATE INDEX CONCURRENTLY refuses to run
+    inside the implicit transaction of a multi-statement query).
+    """
+    statements = []
+    current = []
+    i = 0
+    while i < len(sql):
+        char = sql[i]
+        if sql.startswith('--', i):
+            end = sql.find('\n', i)
+            i = len(sql) if end == -1 else end
+            continue
+        if char == "'":
+            end = i + 1
+            while True:
+                end = sql.find("'", end)
+                if end == -1 or not sql.startswith("''", end):
+                    break
+                end += 2
+            end = len(sql) if end == -1 else end + 1
+            current.append(sql[i:end])
+            i = end
+            continue
+        if char == '$':
+            close = sql.find('$', i + 1)
+            tag = sql[i:close + 1] if close != -1 else ''
+            if tag and (tag == '$$' or tag[1:-1].replace('_', '').isalnum()):
+                end = sql.find(tag, close + 1)
+                end = len(sql) if end == -1 else end + len(tag)
+                current.append(sql[i:end])
+                i = end
+                continue
+        if char == ';':
+            statement = ''.join(current).strip()
+            if statement:
+                statements.append(statement)
+            current = []
+        else:
+            current.append(char)
+        i += 1
+    statement = ''.join(current).strip()
+    if statement:
+        statements.append(statement)
+    return statements
+
+
+def run_script(connection, path):
+    """Run a .sql file statement by statement in autocommit mode."""
+    with open(path) as f:
+        statements = split_statements(f.read())
+    autocommit = connection.autocommit
+    connection.autocommit = True
+    try:
+        with connection.cursor() as cursor:
+            for statement in statements:
+                cursor.execute(statement)
+    finally:
+        connection.autocommit = autocommit
+
+
+def check_empty(connection, force=False):
+    """Refuse to replace a books_book that has rows, unless `force`."""
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass('books_book') IS NOT NULL")
+        exists = cursor.fetchone()[0]
+        if exists and not force:
+            cursor.execute("SELECT EXISTS (SELECT 1 FROM books_book)")
+            if cursor.fetchone()[0]:
+                raise RuntimeError('books_book already has rows; pass --force to replace them')
+    connection.rollback()
+
+
+def dependent_objects(connection):
+    """Sorted descriptions of the triggers and views on the books_* tables."""
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT format('trigger %%I on %%I', t.tgname, c.relname)
+            FROM pg_trigger AS t
+            JOIN pg_class AS c ON c.oid = t.tgrelid
+            WHERE NOT t.tgisinternal AND c.relname = ANY(%s) AND pg_table_is_visible(c.oid)
+            UNION
+            SELECT format('view %%I', v.relname)
+            FROM pg_depend AS d
+            JOIN pg_rewrite AS r ON r.oid = d.objid
+            JOIN pg_class AS v ON v.oid = r.ev_class
+            JOIN pg_class AS c ON c.oid = d.refobjid
+            WHERE d.classid = 'pg_rewrite'::regclass AND v.oid <> c.oid
+              AND c.relname = ANY(%s) AND pg_table_is_visible(c.oid)
+            ORDER BY 1""", [list(COLUMNS), list(COLUMNS)])
+        objects = [row[0] for row in cursor.fetchall()]
+    connection.rollback()
+    return objects
+
+
+def check_dependents(connection, migrations=MIGRATIONS):
+    """Refuse a load that would lose the triggers and views on the books_* tables.
+
+    They go with the old tables (schema.sql), and only the migrations
+    re-create them, so a load without migrations must start without any.
+    Returns them for finish_load to check once the migrations have run.
+    """
+    objects = dependent_objects(connection)
+    if objects and not migrations:
+        raise RuntimeError(f"replacing the books_* tables would drop {', '.join(objects)}, "
+                           "and only the migrations re-create them; load with migrations")
+    return objects
+
+
+def finish_load(connection, migrations=MIGRATIONS, log=print, dependents=()):
+    """Apply the migrations after a load, bump the catalog version and ANALYZE.
+
+    Raises if any of `dependents` (from check_dependents) was not re-created.
+    """
+    for path in migrations:
+        started = time.perf_counter()
+        run_script(connection, path)
+        log(f"applied {os.path.basename(path)} in {time.perf_counter() - started:.1f}s")
+
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        # The version survives reloads (migrations/0004); move it so API
+        # workers drop whatever they cached from the old tables
+        cursor.execute("SELECT to_regclass('catalog_version') IS NOT NULL")
+        if cursor.fetchone()[0]:
+            cursor.execute("UPDATE catalog_version SET version = version + 1, updated_at = now()")
+        cursor.execute("ANALYZE")
+
+    missing = sorted(set(dependents) - set(dependent_objects(connection)))
+    if missing:
+        raise RuntimeError(f"{', '.join(missing)} went with the old books_* tables "
+                           "and no migration re-created them")
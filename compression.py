@@ -0,0 +1,125 @@
+# Negotiated gzip / brotli compression of JSON responses.
+#
+# Compressor picks an encoding from the request's Accept-Encoding and
+# compresses bodies of at least `min_size` bytes. Responses held in the
+# /get_books response cache are stored as CompressedBody, which keeps each
+# compressed variant next to the plain body, so a hot page is compressed
+# once per encoding rather than once per request.
+#
+# A compressed response is a different representation of the resource, so
+# its ETag gets the encoding appended ("<etag>-gzip"); etag_variants() lists
+# the tags a conditional request may carry for one body.
+
+import gzip
+import threading
+
+from werkzeug.http import parse_accept_header
+
+try:
+    import brotli
+except ImportError:  # optional; only gzip is offered without it
+    brotli = None
+
+
+# Server preference when the client accepts several equally
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def etag_variants(etag):
+    """The plain ETag and the ETag of each compressed variant."""
+    return [etag] + [f"{etag}-{encoding}" for encoding in ENCODINGS]
+
+
+class CompressedBody:
+    """A response body and its compressed variants, each made at most once."""
+
+    def __init__(self, body):
+        self.body = body
+        self._variants = {}
+
+    def get(self, compressor, encoding):
+        if encoding is None:
+            return self.body
+        variant = self._variants.get(encoding)
+        if variant is None:
+            # Racing threads may both compress; either result is kept
+            variant = self._variants[encoding] = compressor.compress(self.body, encoding)
+        else:
+            compressor.count_reuse()
+        return variant
+
+    def __len__(self):
+        return len(self.body)
+
+
+class Compressor:
+    """Content-Encoding negotiation and compression with per-encoding stats."""
+
+    def __init__(self, enabled=True, min_size=1024, gzip_level=6, brotli_quality=5):
+        self.enabled = enabled
+        self.min_size = min_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+        self._lock = threading.Lock()
+        self._counters = {'compressed': 0, 'reused': 0, 'bytes_in': 0, 'bytes_out': 0}
+
+    def select(self, size, accept_encoding):
+        """Encoding to send a `size`-byte body in, or None to send it as is."""
+        if not self.enabled or size < self.min_size or not accept_encoding:
+            return None
+        accept = parse_accept_header(accept_encoding)
+        best, best_quality = None, 0
+        for encoding in ENCODINGS:
+            quality = accept[encoding]
+            if quality > best_quality:
+                best, best_quality = encoding, quality
+        return best
+
+    def compress(self, body, encoding):
+        if encoding == 'br':
+            compressed = brotli.compress(body, quality=self.brotli_quality)
+        else:
+            # mtime=0 keeps the bytes, and so caches downstream, stable
+            compressed = gzip.compress(body, compresslevel=self.gzip_level, mtime=0)
+        with self._lock:
+            self._counters['compressed'] += 1
+            self._counters['bytes_in'] += len(body)
+            self._counters['bytes_out'] += len(compressed)
+        return compressed
+
+    def count_reuse(self):
+        with self._lock:
+            self._counters['reused'] += 1
+
+    def apply(self, response, accept_encoding, body=None):
+        """Compress a Flask/Werkzeug `response` in place if it qualifies.
+
+        Only complete 200 application/json responses are touched. `body`, a
+        CompressedBody of the response data, supplies (and keeps) the
+        compressed bytes instead of compressing them here.
+        """
+        if (response.status_code != 200 or response.mimetype != 'application/json'
+                or response.is_streamed or response.direct_passthrough
+                or 'Content-Encoding' in response.headers):
+            return response
+        response.vary.add('Accept-Encoding')
+
+        size = len(body) if body is not None else response.calculate_content_length()
+        encoding = self.select(size or 0, accept_encoding)
+        if encoding is None:
+            return response
+        if body is None:
+            body = CompressedBody(response.get_data())
+        response.set_data(body.get(self, encoding))
+        response.headers['Content-Encoding'] = encoding
+        etag, weak = response.get_etag()
+        if etag:
+            response.set_etag(f"{etag}-{encoding}", weak)
+        return response
+
+    def stats(self):
+        with self._lock:
+            stats = {'enabled': self.enabled, 'min_size': self.min_size,
+                     'encodings': ','.join(ENCODINGS)}
+            stats.update(self._counters)
+        return stats
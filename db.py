@@ -0,0 +1,292 @@
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import psycopg2
+import psycopg2.extensions as _ext
+from psycopg2.pool import PoolError
+
+from replicas import STATEMENT_ERRORS, Replica, ReplicaRouter
+
+
+def config_from_url(database_url):
+    url = urlparse(database_url)
+    return {
+        'dbname': url.path[1:],
+        'user': url.username,
+        'password': url.password,
+        'host': url.hostname,
+        'port': url.port or 5432
+    }
+
+
+DATABASE_URL = os.environ.get('DATABASE_URL')
+
+if DATABASE_URL:
+    db_config = config_from_url(DATABASE_URL)
+else:
+    # Your local database config
+    db_config = {
+        "host" : "127.0.0.1",
+        "database" : "gutenberg",
+        "user" : "nishigandha05",
+        "password": 'nishi7456',
+    }
+
+
+class PoolTimeout(PoolError):
+    pass
+
+
+class ConnectionPool:
+    """Thread-safe, fork-aware pool of psycopg2 connections.
+
+    Connections are opened lazily in the process that uses them. When the pool
+    notices it is running in a different process than the one that created it
+    (a gunicorn worker after fork) it forgets the inherited connections and
+    starts over, so workers never share a socket.
+    """
+
+    def __init__(self, config, min_size=1, max_size=10, timeout=5.0, max_lifetime=1800.0,
+                 connect_timeout=None):
+        self.config = config
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        # Whole seconds libpq waits for a new connection (it treats 1 as 2),
+        # by default the checkout timeout, so an unreachable host fails the
+        # checkout instead of hanging it
+        self.connect_timeout = connect_timeout or max(2, math.ceil(timeout))
+        # Connections inherited across a fork stay referenced so garbage
+        # collection never closes a socket the parent process still uses.
+        self._inherited = []
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._cond = threading.Condition()
+        self._idle = []
+        self._born = {}
+        self._size = 0
+        self._in_use = 0
+        self._counters = {
+            'checkouts': 0,
+            'timeouts': 0,
+            'connections_opened': 0,
+            'connections_discarded': 0,
+            'wait_seconds_total': 0.0,
+        }
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._inherited.extend(self._born)
+            self._reset()
+
+    def _connect(self):
+        conn = psycopg2.connect(**{'connect_timeout': self.connect_timeout, **self.config})
+        with self._cond:
+            self._born[conn] = time.monotonic()
+            self._counters['connections_opened'] += 1
+        return conn
+
+    def _expired(self, conn):
+        born = self._born.get(conn)
+        if born is None:
+            return True
+        return bool(self.max_lifetime) and time.monotonic() - born > self.max_lifetime
+
+    def _usable(self, conn):
+        # Cheap client-side checks only; a dead server is detected on use and
+        # the connection is then returned as broken.
+        if conn.closed or self._expired(conn):
+            return False
+        return conn.info.transaction_status == _ext.TRANSACTION_STATUS_IDLE
+
+    def _discard(self, conn):
+        # Caller holds self._cond
+        self._born.pop(conn, None)
+        self._size -= 1
+        self._counters['connections_discarded'] += 1
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def open(self):
+        """Warm the pool up to min_size idle connections."""
+        self._check_pid()
+        while True:
+            with self._cond:
+                if self._size >= self.min_size:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._size -= 1
+                raise
+            with self._cond:
+                self._idle.append(conn)
+                self._cond.notify()
+
+    def getconn(self, timeout=None):
+        # `timeout` overrides the pool's wait for a free connection
+        return self._checkout(self.timeout if timeout is None else timeout)
+
+    def try_getconn(self):
+        """A connection if one is idle or can be opened now, else None.
+
+        Never waits for another caller to return one, so a caller that already
+        holds a connection can ask for a second without risking a deadlock
+        against an exhausted pool.
+        """
+        return self._checkout(0, wait=False)
+
+    def _checkout(self, timeout, wait=True):
+        self._check_pid()
+        started = time.monotonic()
+        deadline = started + timeout
+        with self._cond:
+            while True:
+                while self._idle:
+                    conn = self._idle.pop()
+                    if self._usable(conn):
+                        self._checked_out(started)
+                        return conn
+                    self._discard(conn)
+
+                if self._size < self.max_size:
+                    # Reserve a slot, then connect outside the lock
+                    self._size += 1
+                    break
+
+                remaining = deadline - time.monotonic()
+                if not wait:
+                    return None
+                if remaining <= 0:
+                    self._counters['timeouts'] += 1
+                    raise PoolTimeout(
+                        f"no database connection available within {timeout}s")
+                self._cond.wait(remaining)
+
+        try:
+            conn = self._connect()
+        except Exception:
+            with self._cond:
+                self._size -= 1
+                self._cond.notify()
+            raise
+        with self._cond:
+            self._checked_out(started)
+        return conn
+
+    def _checked_out(self, started):
+        self._in_use += 1
+        self._counters['checkouts'] += 1
+        self._counters['wait_seconds_total'] += time.monotonic() - started
+
+    def putconn(self, conn, broken=False):
+        self._check_pid()
+        with self._cond:
+            if conn not in self._born:
+                # Checked out before a fork reset the pool: it was never
+                # counted in this process, and closing it would end the
+                # parent's session, so it only stays referenced
+                if conn not in self._inherited:
+                    self._inherited.append(conn)
+                return
+            self._in_use -= 1
+            if broken or self._expired(conn) or not self._reset_connection(conn):
+                self._discard(conn)
+            else:
+                self._idle.append(conn)
+            self._cond.notify()
+
+    def _reset_connection(self, conn):
+        # Leave the connection idle outside a transaction, or report it broken
+        if conn.closed:
+            return False
+        try:
+            status = conn.info.transaction_status
+            if status == _ext.TRANSACTION_STATUS_UNKNOWN:
+                return False
+            if status != _ext.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            return False
+        return True
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.getconn(timeout)
+        broken = False
+        try:
+            yield conn
+        except STATEMENT_ERRORS:
+            # The statement failed; the rollback on return keeps the connection
+            raise
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            self.putconn(conn, broken=broken)
+
+    def close(self):
+        """Close every idle connection; checked-out ones close on return."""
+        self._check_pid()
+        with self._cond:
+            while self._idle:
+                self._discard(self._idle.pop())
+
+    def stats(self):
+        with self._cond:
+            stats = {
+                'pid': self._pid,
+                'min_size': self.min_size,
+                'max_size': self.max_size,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'saturation': round(self._in_use / self.max_size, 3) if self.max_size else 0.0,
+            }
+            stats.update(self._counters)
+        return stats
+
+
+def _pool(config):
+    return ConnectionPool(
+        config,
+        min_size=int(os.environ.get('DB_POOL_MIN_SIZE', 1)),
+        max_size=int(os.environ.get('DB_POOL_MAX_SIZE', 10)),
+        timeout=float(os.environ.get('DB_POOL_TIMEOUT', 5)),
+        max_lifetime=float(os.environ.get('DB_POOL_MAX_LIFETIME', 1800)),
+        # 0: derive it from DB_POOL_TIMEOUT
+        connect_timeout=int(os.environ.get('DB_CONNECT_TIMEOUT', 0)),
+    )
+
+
+pool = _pool(db_config)
+
+# Comma-separated replica URLs; each replica gets a pool sized like the
+# primary's. Without any, read_pool hands out primary connections.
+DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+                         if url.strip()]
+
+# /get_books, export and lookup reads; see replicas.ReplicaRouter.
+# DB_REPLICA_MAX_LAG=off keeps lagging replicas in rotation.
+read_pool = ReplicaRouter(
+    pool,
+    [Replica(_pool(config), f"{config['host']}:{config['port']}")
+     for config in map(config_from_url, DATABASE_REPLICA_URLS)],
+    policy=os.environ.get('DB_REPLICA_POLICY', 'round_robin'),
+    max_lag=(None if os.environ.get('DB_REPLICA_MAX_LAG') == 'off'
+             else float(os.environ.get('DB_REPLICA_MAX_LAG', 5))),
+    max_errors=int(os.environ.get('DB_REPLICA_MAX_ERRORS', 3)),
+    eject_seconds=float(os.environ.get('DB_REPLICA_EJECT_SECONDS', 30)),
+    lag_interval=float(os.environ.get('DB_REPLICA_LAG_INTERVAL', 5)),
+)
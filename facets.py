@@ -0,0 +1,152 @@
+# Facet counts from an in-memory index of per-value book sets.
+#
+# Each facet value (a language code, a mime type, a bookshelf, one of the most
+# common subjects or authors) owns a bitmap with one bit per book, held as a
+# Python int. The books matching a request become one more bitmap, so every
+# facet count is an AND plus a popcount instead of a COUNT(DISTINCT) join.
+
+import time
+
+from psycopg2.extras import RealDictCursor
+
+from cache import SnapshotStore
+
+
+FACETS = ('languages', 'mime_types', 'bookshelves', 'subjects', 'authors')
+
+if hasattr(int, 'bit_count'):
+    _popcount = int.bit_count
+else:  # Python < 3.10
+    def _popcount(bitmap):
+        return bin(bitmap).count('1')
+
+
+def _facet_queries(top_subjects, top_authors):
+    # (facet, SQL returning value and book_ids) per facet
+    return {
+        'languages': """
+            SELECT bl.code AS value, array_agg(bbl.book_id) AS book_ids
+            FROM books_book_languages AS bbl
+            JOIN books_language AS bl ON bl.id = bbl.language_id
+            GROUP BY bl.code
+        """,
+        'mime_types': """
+            SELECT bf.mime_type AS value, array_agg(DISTINCT bf.book_id) AS book_ids
+            FROM books_format AS bf
+            GROUP BY bf.mime_type
+        """,
+        'bookshelves': """
+            SELECT bbk.name AS value, array_agg(bbb.book_id) AS book_ids
+            FROM books_book_bookshelves AS bbb
+            JOIN books_bookshelf AS bbk ON bbk.id = bbb.bookshelf_id
+            GROUP BY bbk.name
+        """,
+        'subjects': f"""
+            SELECT bs.name AS value, array_agg(bbs.book_id) AS book_ids
+            FROM books_book_subjects AS bbs
+            JOIN books_subject AS bs ON bs.id = bbs.subject_id
+            GROUP BY bs.name
+            ORDER BY COUNT(*) DESC, bs.name
+            LIMIT {int(top_subjects)}
+        """,
+        'authors': f"""
+            SELECT ba.name AS value, array_agg(DISTINCT bba.book_id) AS book_ids
+            FROM books_book_authors AS bba
+            JOIN books_author AS ba ON ba.id = bba.author_id
+            GROUP BY ba.name
+            ORDER BY COUNT(*) DESC, ba.name
+            LIMIT {int(top_authors)}
+        """,
+    }
+
+
+class FacetIndex:
+    """Immutable snapshot of per-value book bitmaps for one catalog version."""
+
+    def __init__(self, book_ids, facets, version=None):
+        # book_ids: every gutenberg_id; facets: {facet: {value: [gutenberg_id, ...]}}
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self._positions = {book_id: i for i, book_id in enumerate(sorted(book_ids))}
+        self.all = self.bitmap(self._positions)
+        self.size = len(self._positions)
+        self._facets = {
+            facet: {value: self.bitmap(ids) for value, ids in values.items()}
+            for facet, values in facets.items()
+        }
+        self._unfiltered = {}
+
+    @classmethod
+    def load(cls, connection, version=None, top_subjects=200, top_authors=200):
+        cursor = connection.cursor(cursor_factory=RealDictCursor)
+        try:
+            cursor.execute("SELECT gutenberg_id FROM books_book")
+            book_ids = [row['gutenberg_id'] for row in cursor.fetchall()]
+            facets = {}
+            for facet, query in _facet_queries(top_subjects, top_authors).items():
+                cursor.execute(query)
+                facets[facet] = {row['value']: row['book_ids'] for row in cursor.fetchall()}
+        finally:
+            cursor.close()
+        return cls(book_ids, facets, version)
+
+    def bitmap(self, book_ids):
+        # Bitmap of the given ids; ids outside the index are ignored
+        bits = bytearray((len(self._positions) + 7) // 8)
+        positions = self._positions
+        for book_id in book_ids:
+            position = positions.get(book_id)
+            if position is not None:
+                bits[position >> 3] |= 1 << (position & 7)
+        return int.from_bytes(bits, 'little')
+
+    def union(self, facet, values):
+        # Books having any of `values` for `facet`
+        bitmaps = self._facets.get(facet, {})
+        result = 0
+        for value in values:
+            result |= bitmaps.get(value, 0)
+        return result
+
+    @staticmethod
+    def count(bitmap):
+        return _popcount(bitmap)
+
+    def counts(self, base, limit=20):
+        """{facet: [{'value', 'count'}, ...]} within `base`, largest first.
+
+        Values with no matching books are left out; subjects and authors only
+        cover the most common values that were indexed.
+        """
+        if base == self.all and limit in self._unfiltered:
+            return self._unfiltered[limit]
+
+        result = {}
+        for facet in FACETS:
+            counts = []
+            for value, bitmap in self._facets.get(facet, {}).items():
+                count = _popcount(bitmap & base)
+                if count:
+                    counts.append((-count, value))
+            counts.sort()
+            result[facet] = [{'value': value, 'count': -count} for count, value in counts[:limit]]
+
+        if base == self.all:
+            self._unfiltered[limit] = result
+        return result
+
+
+class FacetStore(SnapshotStore):
+    """Holds the FacetIndex of the current catalog version (see SnapshotStore)."""
+
+    name = 'facet index'
+
+    def __init__(self, pool, top_subjects=200, top_authors=200, ttl=300.0):
+        super().__init__(ttl=ttl)
+        self.pool = pool
+        self.top_subjects = top_subjects
+        self.top_authors = top_authors
+
+    def _build(self, version):
+        with self.pool.connection() as connection:
+            return FacetIndex.load(connection, version, self.top_subjects, self.top_authors)
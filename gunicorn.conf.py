@@ -0,0 +1,24 @@
+# Picked up automatically by `gunicorn wsgi:app` (see render.yaml)
+
+
+def post_fork(server, worker):
+    # Each worker owns its own connections; open them after the fork
+    from db import pool
+    try:
+        pool.open()
+    except Exception as e:
+        # The pool connects lazily on first checkout, so a cold database
+        # must not keep the worker from booting
+        server.log.warning(f"Could not warm up database pool: {e}")
+
+
+def post_worker_init(worker):
+    # Start loading the in-memory catalog as soon as the app is imported
+    # rather than on the first request
+    import catalog
+    import models
+    if models.QUERY_STRATEGY == 'memory':
+        try:
+            models.memory_store.get(catalog.current_version(), wait=False)
+        except Exception as e:
+            worker.log.warning(f"Could not start loading the memory catalog: {e}")
@@ -0,0 +1,96 @@
+# Readiness probing for /readyz.
+#
+# Load balancers and orchestrators probe constantly, so a probe must neither
+# open connections nor pile up behind a slow database:
+#
+#   - the result of the last `SELECT 1` is served for `interval` seconds;
+#   - at most one probe per process is in flight, on a pooled connection,
+#     and callers that arrive meanwhile wait for that one;
+#   - callers wait at most `timeout` seconds, and are answered "not ready"
+#     when the probe has not finished by then. The probe itself gets half of
+#     it to check out a connection and half as statement_timeout, so it
+#     normally reports why it failed before the callers give up.
+#
+# Pool saturation is read live on every call; it costs no database work.
+
+import threading
+import time
+
+
+class ReadinessProbe:
+    """Cached, single-flight database readiness check for one pool."""
+
+    def __init__(self, pool, interval=2.0, timeout=1.0):
+        self.pool = pool
+        self.interval = interval
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        # (monotonic time it finished, ready, latency in seconds, error)
+        self._result = None
+        self._running = None
+        self._counters = {'probes': 0, 'failures': 0, 'cached': 0, 'timeouts': 0}
+
+    def _probe(self, done):
+        latency = error = None
+        try:
+            with self.pool.connection(timeout=self.timeout / 2) as connection:
+                cursor = connection.cursor()
+                try:
+                    # One round trip; SET LOCAL ends with the transaction
+                    # the pool rolls back on return
+                    query_started = time.monotonic()
+                    cursor.execute(f"SET LOCAL statement_timeout = {max(int(self.timeout * 500), 1)}; SELECT 1")
+                    cursor.fetchone()
+                    latency = time.monotonic() - query_started
+                finally:
+                    cursor.close()
+        except Exception as e:
+            error = f"{type(e).__name__}: {str(e).strip()}"
+        with self._lock:
+            self._result = (time.monotonic(), error is None, latency, error)
+            self._counters['probes'] += 1
+            if error is not None:
+                self._counters['failures'] += 1
+            self._running = None
+        done.set()
+
+    def check(self):
+        """(ready, report), probing the database at most once per interval."""
+        with self._lock:
+            if self._result is not None and time.monotonic() - self._result[0] < self.interval:
+                self._counters['cached'] += 1
+                return self._report(self._result, cached=True)
+            if self._running is None:
+                self._running = threading.Event()
+                threading.Thread(target=self._probe, args=(self._running,), daemon=True,
+                                 name='readiness-probe').start()
+            running = self._running
+
+        finished = running.wait(self.timeout)
+        with self._lock:
+            if not finished:
+                self._counters['timeouts'] += 1
+                return self._report((None, False, None, f"no answer within {self.timeout}s"), cached=False)
+            return self._report(self._result, cached=False)
+
+    def _report(self, result, cached):
+        # Caller holds self._lock
+        finished_at, ready, latency, error = result
+        pool = self.pool.stats()
+        report = {
+            'status': 'ready' if ready else 'unavailable',
+            'cached': cached,
+            'checked_seconds_ago': round(time.monotonic() - finished_at, 3) if finished_at else None,
+            'latency_ms': round(latency * 1000, 3) if latency is not None else None,
+            'pool': {key: pool[key] for key in ('size', 'idle', 'in_use', 'max_size', 'saturation', 'timeouts')},
+        }
+        if error is not None:
+            report['error'] = error
+        return ready, report
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['ready'] = int(bool(self._result and self._result[1]))
+            stats['latency_seconds'] = (self._result[2] or 0.0) if self._result else 0.0
+        return stats
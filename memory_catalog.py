@@ -0,0 +1,226 @@
+# The whole catalog held in process memory, for BOOKS_QUERY_STRATEGY=memory.
+#
+# Books are stored column by column in /get_books order (download_count DESC
+# NULLS LAST, gutenberg_id DESC), so a book's position is also its rank:
+#
+#   ids, downloads   array('i') of gutenberg_ids and download counts (-1 = NULL)
+#   languages, ...   {code: array('i') of positions}, one posting list per
+#                    interned language code and mime type
+#   subjects, ...    parallel lists of lowercased names and posting lists for
+#                    subjects, bookshelves and authors
+#   titles           lowercased titles, scanned for title filters
+#   documents        each book's hydrated row as compact JSON
+#
+# A filter is a set of positions, so sorting the set gives the matching books
+# in page order and a page is a slice. Postgres stays the source of truth: a
+# snapshot is reloaded from it when the catalog version moves (see
+# MemoryCatalogStore).
+
+import bisect
+import json
+from array import array
+
+from psycopg2.extras import RealDictCursor
+
+import queries
+from cache import SnapshotStore
+
+
+NULL_DOWNLOADS = -1
+
+_POSTING_QUERIES = {
+    'languages': """
+        SELECT bl.code AS value, array_agg(bbl.book_id) AS book_ids
+        FROM books_book_languages AS bbl
+        JOIN books_language AS bl ON bl.id = bbl.language_id
+        GROUP BY bl.code
+    """,
+    'mime_types': """
+        SELECT bf.mime_type AS value, array_agg(DISTINCT bf.book_id) AS book_ids
+        FROM books_format AS bf
+        GROUP BY bf.mime_type
+    """,
+    'subjects': """
+        SELECT bs.name AS value, array_agg(bbs.book_id) AS book_ids
+        FROM books_book_subjects AS bbs
+        JOIN books_subject AS bs ON bs.id = bbs.subject_id
+        GROUP BY bs.name
+    """,
+    'bookshelves': """
+        SELECT bbk.name AS value, array_agg(bbb.book_id) AS book_ids
+        FROM books_book_bookshelves AS bbb
+        JOIN books_bookshelf AS bbk ON bbk.id = bbb.bookshelf_id
+        GROUP BY bbk.name
+    """,
+    'authors': """
+        SELECT ba.name AS value, array_agg(DISTINCT bba.book_id) AS book_ids
+        FROM books_book_authors AS bba
+        JOIN books_author AS ba ON ba.id = bba.author_id
+        GROUP BY ba.name
+    """,
+}
+
+
+def _sort_key(download_count, gutenberg_id):
+    # Ascending key for download_count DESC NULLS LAST, gutenberg_id DESC
+    if download_count is None:
+        return (1, 0, -gutenberg_id)
+    return (0, -download_count, -gutenberg_id)
+
+
+def supports(search='substring', sort='downloads', topics=None, authors=None, titles=None, **_):
+    """Whether a query can be answered from memory.
+
+    Full-text search and relevance order need Postgres, and terms holding
+    LIKE wildcards ("%", "_") would not match the same books in memory.
+    """
+    if search != 'substring' or sort != 'downloads':
+        return False
+    for terms in (topics, authors, titles):
+        if terms and any('%' in term or '_' in term for term in terms):
+            return False
+    return True
+
+
+class CatalogSnapshot:
+    """Immutable in-memory copy of the catalog for one catalog version."""
+
+    def __init__(self, books, postings, version=None):
+        # books: hydrated rows (HYDRATE_COLUMNS); postings: {relation: {value: [gutenberg_id, ...]}}
+        books = sorted(books, key=lambda book: _sort_key(book['download_count'], book['gutenberg_id']))
+        self.version = version
+        self.size = len(books)
+        self.ids = array('i', (book['gutenberg_id'] for book in books))
+        self.downloads = array('i', (NULL_DOWNLOADS if book['download_count'] is None
+                                     else book['download_count'] for book in books))
+        self.titles = [(book['title'] or '').lower() for book in books]
+        self.documents = [json.dumps(book, separators=(',', ':'), default=str).encode()
+                          for book in books]
+
+        # gutenberg_id -> position, as two arrays searched with bisect
+        by_id = sorted(range(self.size), key=self.ids.__getitem__)
+        self._sorted_ids = array('i', (self.ids[position] for position in by_id))
+        self._id_positions = array('i', by_id)
+
+        self.languages = self._postings(postings.get('languages', {}))
+        self.mime_types = self._postings(postings.get('mime_types', {}))
+        self.subjects = self._named_postings(postings.get('subjects', {}))
+        self.bookshelves = self._named_postings(postings.get('bookshelves', {}))
+        self.authors = self._named_postings(postings.get('authors', {}))
+
+    @classmethod
+    def load(cls, connection, version=None):
+        cursor = connection.cursor(cursor_factory=RealDictCursor)
+        try:
+            cursor.execute(queries.build_export_query([]))
+            books = cursor.fetchall()
+            postings = {}
+            for relation, query in _POSTING_QUERIES.items():
+                cursor.execute(query)
+                postings[relation] = {row['value']: row['book_ids'] for row in cursor.fetchall()}
+        finally:
+            cursor.close()
+        return cls(books, postings, version)
+
+    def position(self, gutenberg_id):
+        index = bisect.bisect_left(self._sorted_ids, gutenberg_id)
+        if index < self.size and self._sorted_ids[index] == gutenberg_id:
+            return self._id_positions[index]
+        return None
+
+    def _positions(self, book_ids):
+        positions = (self.position(book_id) for book_id in book_ids)
+        return array('i', sorted(p for p in positions if p is not None))
+
+    def _postings(self, values):
+        # Interned value -> sorted positions
+        return {value: self._positions(book_ids) for value, book_ids in values.items()}
+
+    def _named_postings(self, values):
+        # (lowercased names, posting lists) for substring scans
+        names = list(values)
+        return ([name.lower() for name in names], [self._positions(values[name]) for name in names])
+
+    @staticmethod
+    def _matching_names(named, terms):
+        # Union of the posting lists whose name contains any term
+        matches = set()
+        for name, positions in zip(*named):
+            if any(term in name for term in terms):
+                matches.update(positions)
+        return matches
+
+    def matching(self, book_ids=None, languages=None, mime_types=None,
+                 topics=None, authors=None, titles=None):
+        """Sorted positions of the books matching every filter.
+
+        Returns a range over the whole catalog when nothing is filtered.
+        """
+        sets = []
+        if book_ids:
+            sets.append({p for p in map(self.position, book_ids) if p is not None})
+        if languages:
+            sets.append(set().union(*(self.languages.get(code, ()) for code in languages)))
+        if mime_types:
+            sets.append(set().union(*(self.mime_types.get(mime, ()) for mime in mime_types)))
+        if topics:
+            terms = [term.lower() for term in topics]
+            sets.append(self._matching_names(self.subjects, terms)
+                        | self._matching_names(self.bookshelves, terms))
+        if authors:
+            sets.append(self._matching_names(self.authors, [term.lower() for term in authors]))
+        if titles:
+            matches = set()
+            for term in {term.lower() for term in titles}:
+                matches.update([p for p, title in enumerate(self.titles) if term in title])
+            sets.append(matches)
+
+        if not sets:
+            return range(self.size)
+        sets.sort(key=len)
+        return sorted(sets[0].intersection(*sets[1:]))
+
+    def position_after(self, after):
+        # First position that sorts after the (download_count, gutenberg_id)
+        # cursor; the cursor's own book may no longer exist
+        target = _sort_key(*after)
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            downloads = self.downloads[middle]
+            key = _sort_key(None if downloads == NULL_DOWNLOADS else downloads, self.ids[middle])
+            if key <= target:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def search(self, filters, page=1, per_page=25, after=None, count='exact', lookahead=False):
+        """(total, hydrated rows) like get_books_from_db(); totals are exact."""
+        positions = self.matching(**filters)
+        if after is not None:
+            start = bisect.bisect_left(positions, self.position_after(after))
+        else:
+            start = (page - 1) * per_page
+        limit = per_page + 1 if lookahead else per_page
+        books = [json.loads(self.documents[p]) for p in positions[start:start + limit]]
+        return (None if count == 'none' else len(positions)), books
+
+
+class MemoryCatalogStore(SnapshotStore):
+    """Holds the CatalogSnapshot of the current catalog version.
+
+    Reloaded in the background when the catalog version moves and, as a
+    safety net, every `max_age` seconds; requests keep reading the previous
+    snapshot until the new one is swapped in.
+    """
+
+    name = 'memory catalog'
+
+    def __init__(self, pool, ttl=300.0, max_age=None):
+        super().__init__(ttl=ttl, max_age=max_age)
+        self.pool = pool
+
+    def _build(self, version):
+        with self.pool.connection() as connection:
+            return CatalogSnapshot.load(connection, version)
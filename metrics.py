@@ -0,0 +1,134 @@
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+
+
+# Seconds; spans cache hits through slow unindexed filters
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Every Histogram, in creation order, for render()
+REGISTRY = []
+
+# Seconds per phase name for the request being handled, or None outside one
+_phases = contextvars.ContextVar('phases', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(pairs):
+    return ','.join(f'{name}="{_escape(value)}"' for name, value in pairs)
+
+
+class Histogram:
+    """Thread-safe Prometheus histogram with one series per label set."""
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # label values -> per-bucket counts (not cumulative), then sum and count
+        self._series = {}
+        REGISTRY.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * len(self.buckets) + [0.0, 0]
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+    def render(self):
+        with self._lock:
+            series = sorted((key, list(values)) for key, values in self._series.items())
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, values in series:
+            labels = _labels(zip(self.labelnames, key))
+            prefix = labels + ',' if labels else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {values[-1]}')
+            suffix = f'{{{labels}}}' if labels else ''
+            lines.append(f'{self.name}_sum{suffix} {values[-2]}')
+            lines.append(f'{self.name}_count{suffix} {values[-1]}')
+        return lines
+
+
+def render_stats(prefix, series, documentation, counters=()):
+    """Exposition lines for stats() dicts such as ConnectionPool.stats().
+
+    `series` is a list of (labels, stats) pairs that share one set of keys.
+    Keys listed in `counters` are typed as counters (with a _total suffix),
+    other numeric keys as gauges; anything else is skipped.
+    """
+    lines = []
+    keys = series[0][1].keys() if series else ()
+    for key in keys:
+        samples = [(labels, stats[key]) for labels, stats in series
+                   if isinstance(stats.get(key), (int, float)) and not isinstance(stats.get(key), bool)]
+        if not samples:
+            continue
+        name = f"{prefix}_{key}"
+        kind = 'gauge'
+        if key in counters:
+            kind = 'counter'
+            if not name.endswith('_total'):
+                name += '_total'
+        lines.append(f"# HELP {name} {documentation} ({key})")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            labels = _labels(labels.items())
+            lines.append(f"{name}{{{labels}}} {value}" if labels else f"{name} {value}")
+    return lines
+
+
+def render(extra_lines=()):
+    """The Prometheus text exposition of every registered histogram."""
+    lines = [line for histogram in REGISTRY for line in histogram.render()]
+    lines.extend(extra_lines)
+    return '\n'.join(lines) + '\n'
+
+
+def start():
+    """Begin collecting phase timings for the current request or task."""
+    return _phases.set({})
+
+
+def finish(token):
+    """Stop collecting and return {phase: seconds} gathered since start()."""
+    phases = _phases.get() or {}
+    _phases.reset(token)
+    return phases
+
+
+@contextlib.contextmanager
+def phase(name):
+    # Adds the time spent in the block to `name`; a no-op outside a request
+    phases = _phases.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if phases is not None:
+            phases[name] = phases.get(name, 0.0) + time.perf_counter() - started
+
+
+def server_timing(phases):
+    """Server-Timing header value for {phase: seconds}, durations in ms."""
+    return ', '.join(f"{name};dur={seconds * 1000:.2f}" for name, seconds in phases.items())
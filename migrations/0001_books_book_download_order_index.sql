@@ -0,0 +1,4 @@
+-- Serves ORDER BY download_count DESC NULLS LAST, gutenberg_id DESC and the
+-- keyset (cursor) predicate of /get_books without sorting the catalog.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS books_book_download_order_idx
+    ON books_book (download_count DESC NULLS LAST, gutenberg_id DESC);
@@ -0,0 +1,41 @@
+-- Index-served text search for the title, author and topic filters.
+-- Run outside a transaction block (CREATE INDEX CONCURRENTLY), e.g. psql -f.
+
+-- search=substring: LOWER(col) LIKE '%term%' and word_similarity() ranking
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS books_book_title_trgm_idx
+    ON books_book USING gin (LOWER(title) gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS books_author_name_trgm_idx
+    ON books_author USING gin (LOWER(name) gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS books_subject_name_trgm_idx
+    ON books_subject USING gin (LOWER(name) gin_trgm_ops);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS books_bookshelf_name_trgm_idx
+    ON books_bookshelf USING gin (LOWER(name) gin_trgm_ops);
+
+-- search=fulltext: search_tsv @@ plainto_tsquery('simple', ...) || ... and ts_rank()
+ALTER TABLE books_book ADD COLUMN IF NOT EXISTS search_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', COALESCE(title, ''))) STORED;
+ALTER TABLE books_author ADD COLUMN IF NOT EXISTS search_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', COALESCE(name, ''))) STORED;
+ALTER TABLE books_subject ADD COLUMN IF NOT EXISTS search_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', COALESCE(name, ''))) STORED;
+ALTER TABLE books_bookshelf ADD COLUMN IF NOT EXISTS search_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('simple', COALESCE(name, ''))) STORED;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS books_book_search_tsv_idx
+    ON books_book USING gin (search_tsv);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS books_author_search_tsv_idx
+    ON books_author USING gin (search_tsv);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS books_subject_search_tsv_idx
+    ON books_subject USING gin (search_tsv);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS books_bookshelf_search_tsv_idx
+    ON books_bookshelf USING gin (search_tsv);
+
+-- The relation-side lookups of the EXISTS semi-joins
+CREATE INDEX CONCURRENTLY IF NOT EXISTS books_book_subjects_subject_idx
+    ON books_book_subjects (subject_id, book_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS books_book_bookshelves_bookshelf_idx
+    ON books_book_bookshelves (bookshelf_id, book_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS books_book_authors_author_idx
+    ON books_book_authors (author_id, book_id);
@@ -0,0 +1,193 @@
+-- Denormalized, precomputed /get_books documents: one row per book holding
+-- the hydrated book (same keys as queries.HYDRATE_COLUMNS) plus the columns
+-- every filter needs, so BOOKS_QUERY_STRATEGY=documents reads a page from a
+-- single indexed table. Kept current by row triggers on the books_* tables.
+--
+-- Bulk loads can skip the per-row triggers (SET session_replication_role =
+-- replica) and call rebuild_book_documents() once afterwards.
+-- Requires pg_trgm from 0002_text_search_indexes.sql.
+
+CREATE TABLE IF NOT EXISTS book_documents (
+    gutenberg_id integer PRIMARY KEY,
+    download_count integer,
+    languages text[] NOT NULL DEFAULT '{}',
+    mime_types text[] NOT NULL DEFAULT '{}',
+    title_lower text NOT NULL DEFAULT '',
+    -- newline separated, so a LIKE '%term%' cannot match across two names
+    authors_lower text NOT NULL DEFAULT '',
+    topics_lower text NOT NULL DEFAULT '',
+    document jsonb NOT NULL
+);
+
+CREATE OR REPLACE VIEW book_document_source AS
+SELECT
+    bb.gutenberg_id,
+    bb.download_count,
+    ARRAY(
+        SELECT bl.code::text
+        FROM books_book_languages AS bbl
+        JOIN books_language AS bl ON bl.id = bbl.language_id
+        WHERE bbl.book_id = bb.gutenberg_id
+        ORDER BY bl.code
+    ) AS languages,
+    ARRAY(
+        SELECT DISTINCT bf.mime_type::text
+        FROM books_format AS bf
+        WHERE bf.book_id = bb.gutenberg_id
+    ) AS mime_types,
+    LOWER(COALESCE(bb.title, '')) AS title_lower,
+    COALESCE((
+        SELECT STRING_AGG(LOWER(ba.name), E'\n')
+        FROM books_book_authors AS bba
+        JOIN books_author AS ba ON ba.id = bba.author_id
+        WHERE bba.book_id = bb.gutenberg_id
+    ), '') AS authors_lower,
+    COALESCE((
+        SELECT STRING_AGG(LOWER(t.name), E'\n')
+        FROM (
+            SELECT bs.name
+            FROM books_book_subjects AS bbs
+            JOIN books_subject AS bs ON bs.id = bbs.subject_id
+            WHERE bbs.book_id = bb.gutenberg_id
+            UNION ALL
+            SELECT bbk.name
+            FROM books_book_bookshelves AS bbb
+            JOIN books_bookshelf AS bbk ON bbk.id = bbb.bookshelf_id
+            WHERE bbb.book_id = bb.gutenberg_id
+        ) AS t
+    ), '') AS topics_lower,
+    jsonb_build_object(
+        'title', bb.title,
+        'gutenberg_id', bb.gutenberg_id,
+        'download_count', bb.download_count,
+        'author_info', (
+            SELECT jsonb_build_object(
+                'name', ba.name,
+                'birth_year', ba.birth_year,
+                'death_year', ba.death_year,
+                'id', ba.id
+            )
+            FROM books_book_authors AS bba
+            JOIN books_author AS ba ON ba.id = bba.author_id
+            WHERE bba.book_id = bb.gutenberg_id
+            ORDER BY ba.id
+            LIMIT 1
+        ),
+        'language', (
+            SELECT bl.code
+            FROM books_book_languages AS bbl
+            JOIN books_language AS bl ON bl.id = bbl.language_id
+            WHERE bbl.book_id = bb.gutenberg_id
+            ORDER BY bl.code
+            LIMIT 1
+        ),
+        'subjects', (
+            SELECT STRING_AGG(bs.name, ', ' ORDER BY bs.name)
+            FROM books_book_subjects AS bbs
+            JOIN books_subject AS bs ON bs.id = bbs.subject_id
+            WHERE bbs.book_id = bb.gutenberg_id
+        ),
+        'bookshelves', (
+            SELECT STRING_AGG(bbk.name, ', ' ORDER BY bbk.name)
+            FROM books_book_bookshelves AS bbb
+            JOIN books_bookshelf AS bbk ON bbk.id = bbb.bookshelf_id
+            WHERE bbb.book_id = bb.gutenberg_id
+        ),
+        'download_links', (
+            SELECT jsonb_agg(
+                jsonb_build_object('mime_type', bf.mime_type, 'url', bf.url)
+                ORDER BY bf.mime_type, bf.url
+            )
+            FROM books_format AS bf
+            WHERE bf.book_id = bb.gutenberg_id
+        )
+    ) AS document
+FROM books_book AS bb;
+
+CREATE OR REPLACE FUNCTION refresh_book_documents(books integer[]) RETURNS void AS $$
+BEGIN
+    DELETE FROM book_documents AS bd
+    WHERE bd.gutenberg_id = ANY(books)
+      AND NOT EXISTS (SELECT 1 FROM books_book AS bb WHERE bb.gutenberg_id = bd.gutenberg_id);
+
+    INSERT INTO book_documents
+    SELECT * FROM book_document_source WHERE gutenberg_id = ANY(books)
+    ON CONFLICT (gutenberg_id) DO UPDATE SET
+        download_count = EXCLUDED.download_count,
+        languages = EXCLUDED.languages,
+        mime_types = EXCLUDED.mime_types,
+        title_lower = EXCLUDED.title_lower,
+        authors_lower = EXCLUDED.authors_lower,
+        topics_lower = EXCLUDED.topics_lower,
+        document = EXCLUDED.document;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rebuild_book_documents() RETURNS void AS $$
+BEGIN
+    TRUNCATE book_documents;
+    INSERT INTO book_documents SELECT * FROM book_document_source;
+END
+$$ LANGUAGE plpgsql;
+
+-- Row triggers: find the affected gutenberg_ids and refresh just those
+CREATE OR REPLACE FUNCTION book_documents_sync() RETURNS trigger AS $$
+DECLARE
+    books integer[];
+BEGIN
+    IF TG_TABLE_NAME = 'books_book' THEN
+        books := ARRAY[]::integer[];
+        IF TG_OP <> 'INSERT' THEN books := books || OLD.gutenberg_id; END IF;
+        IF TG_OP <> 'DELETE' THEN books := books || NEW.gutenberg_id; END IF;
+    ELSIF TG_TABLE_NAME IN ('books_book_authors', 'books_book_languages', 'books_book_subjects',
+                            'books_book_bookshelves', 'books_format') THEN
+        books := ARRAY[]::integer[];
+        IF TG_OP <> 'INSERT' THEN books := books || OLD.book_id; END IF;
+        IF TG_OP <> 'DELETE' THEN books := books || NEW.book_id; END IF;
+    ELSIF TG_TABLE_NAME = 'books_author' THEN
+        books := ARRAY(SELECT book_id FROM books_book_authors WHERE author_id = COALESCE(NEW.id, OLD.id));
+    ELSIF TG_TABLE_NAME = 'books_language' THEN
+        books := ARRAY(SELECT book_id FROM books_book_languages WHERE language_id = COALESCE(NEW.id, OLD.id));
+    ELSIF TG_TABLE_NAME = 'books_subject' THEN
+        books := ARRAY(SELECT book_id FROM books_book_subjects WHERE subject_id = COALESCE(NEW.id, OLD.id));
+    ELSIF TG_TABLE_NAME = 'books_bookshelf' THEN
+        books := ARRAY(SELECT book_id FROM books_book_bookshelves WHERE bookshelf_id = COALESCE(NEW.id, OLD.id));
+    END IF;
+
+    PERFORM refresh_book_documents(books);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    tbl text;
+BEGIN
+    FOREACH tbl IN ARRAY ARRAY[
+        'books_book', 'books_book_authors', 'books_book_languages', 'books_book_subjects',
+        'books_book_bookshelves', 'books_format', 'books_author', 'books_language',
+        'books_subject', 'books_bookshelf'
+    ] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', tbl || '_book_documents', tbl);
+        EXECUTE format(
+            'CREATE TRIGGER %I AFTER INSERT OR UPDATE OR DELETE ON %I '
+            'FOR EACH ROW EXECUTE FUNCTION book_documents_sync()',
+            tbl || '_book_documents', tbl);
+    END LOOP;
+END
+$$;
+
+SELECT rebuild_book_documents();
+
+CREATE INDEX IF NOT EXISTS book_documents_download_order_idx
+    ON book_documents (download_count DESC NULLS LAST, gutenberg_id DESC);
+CREATE INDEX IF NOT EXISTS book_documents_languages_idx
+    ON book_documents USING gin (languages);
+CREATE INDEX IF NOT EXISTS book_documents_mime_types_idx
+    ON book_documents USING gin (mime_types);
+CREATE INDEX IF NOT EXISTS book_documents_title_trgm_idx
+    ON book_documents USING gin (title_lower gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS book_documents_authors_trgm_idx
+    ON book_documents USING gin (authors_lower gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS book_documents_topics_trgm_idx
+    ON book_documents USING gin (topics_lower gin_trgm_ops);
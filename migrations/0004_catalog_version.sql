@@ -0,0 +1,36 @@
+-- A single monotonically increasing catalog version, bumped by every
+-- statement that changes a books_* table. The API derives ETags and cache
+-- invalidation from it (see catalog.py).
+
+CREATE TABLE IF NOT EXISTS catalog_version (
+    id boolean PRIMARY KEY DEFAULT true CHECK (id),
+    version bigint NOT NULL DEFAULT 1,
+    updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+INSERT INTO catalog_version (id) VALUES (true) ON CONFLICT (id) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_catalog_version() RETURNS trigger AS $$
+BEGIN
+    UPDATE catalog_version SET version = version + 1, updated_at = now();
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
+
+DO $$
+DECLARE
+    tbl text;
+BEGIN
+    FOREACH tbl IN ARRAY ARRAY[
+        'books_book', 'books_book_authors', 'books_book_languages', 'books_book_subjects',
+        'books_book_bookshelves', 'books_format', 'books_author', 'books_language',
+        'books_subject', 'books_bookshelf'
+    ] LOOP
+        EXECUTE format('DROP TRIGGER IF EXISTS %I ON %I', tbl || '_catalog_version', tbl);
+        EXECUTE format(
+            'CREATE TRIGGER %I AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %I '
+            'FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_version()',
+            tbl || '_catalog_version', tbl);
+    END LOOP;
+END
+$$;
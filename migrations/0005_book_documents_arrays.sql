@@ -0,0 +1,93 @@
+-- Store subjects and bookshelves in book_documents as JSON arrays instead of
+-- ', '-joined strings, matching queries.HYDRATE_COLUMNS, so names that
+-- contain commas survive and rows need no splitting when served.
+-- Only the document expression of book_document_source changes.
+
+CREATE OR REPLACE VIEW book_document_source AS
+SELECT
+    bb.gutenberg_id,
+    bb.download_count,
+    ARRAY(
+        SELECT bl.code::text
+        FROM books_book_languages AS bbl
+        JOIN books_language AS bl ON bl.id = bbl.language_id
+        WHERE bbl.book_id = bb.gutenberg_id
+        ORDER BY bl.code
+    ) AS languages,
+    ARRAY(
+        SELECT DISTINCT bf.mime_type::text
+        FROM books_format AS bf
+        WHERE bf.book_id = bb.gutenberg_id
+    ) AS mime_types,
+    LOWER(COALESCE(bb.title, '')) AS title_lower,
+    COALESCE((
+        SELECT STRING_AGG(LOWER(ba.name), E'\n')
+        FROM books_book_authors AS bba
+        JOIN books_author AS ba ON ba.id = bba.author_id
+        WHERE bba.book_id = bb.gutenberg_id
+    ), '') AS authors_lower,
+    COALESCE((
+        SELECT STRING_AGG(LOWER(t.name), E'\n')
+        FROM (
+            SELECT bs.name
+            FROM books_book_subjects AS bbs
+            JOIN books_subject AS bs ON bs.id = bbs.subject_id
+            WHERE bbs.book_id = bb.gutenberg_id
+            UNION ALL
+            SELECT bbk.name
+            FROM books_book_bookshelves AS bbb
+            JOIN books_bookshelf AS bbk ON bbk.id = bbb.bookshelf_id
+            WHERE bbb.book_id = bb.gutenberg_id
+        ) AS t
+    ), '') AS topics_lower,
+    jsonb_build_object(
+        'title', bb.title,
+        'gutenberg_id', bb.gutenberg_id,
+        'download_count', bb.download_count,
+        'author_info', (
+            SELECT jsonb_build_object(
+                'name', ba.name,
+                'birth_year', ba.birth_year,
+                'death_year', ba.death_year,
+                'id', ba.id
+            )
+            FROM books_book_authors AS bba
+            JOIN books_author AS ba ON ba.id = bba.author_id
+            WHERE bba.book_id = bb.gutenberg_id
+            ORDER BY ba.id
+            LIMIT 1
+        ),
+        'language', (
+            SELECT bl.code
+            FROM books_book_languages AS bbl
+            JOIN books_language AS bl ON bl.id = bbl.language_id
+            WHERE bbl.book_id = bb.gutenberg_id
+            ORDER BY bl.code
+            LIMIT 1
+        ),
+        'subjects', to_jsonb(ARRAY(
+            SELECT bs.name
+            FROM books_book_subjects AS bbs
+            JOIN books_subject AS bs ON bs.id = bbs.subject_id
+            WHERE bbs.book_id = bb.gutenberg_id
+            ORDER BY bs.name
+        )),
+        'bookshelves', to_jsonb(ARRAY(
+            SELECT bbk.name
+            FROM books_book_bookshelves AS bbb
+            JOIN books_bookshelf AS bbk ON bbk.id = bbb.bookshelf_id
+            WHERE bbb.book_id = bb.gutenberg_id
+            ORDER BY bbk.name
+        )),
+        'download_links', (
+            SELECT jsonb_agg(
+                jsonb_build_object('mime_type', bf.mime_type, 'url', bf.url)
+                ORDER BY bf.mime_type, bf.url
+            )
+            FROM books_format AS bf
+            WHERE bf.book_id = bb.gutenberg_id
+        )
+    ) AS document
+FROM books_book AS bb;
+
+SELECT rebuild_book_documents();
@@ -0,0 +1,41 @@
+-- Let a bulk writer skip the per-row refresh of book_documents and refresh
+-- each book it touched once instead, within the same transaction:
+--
+--     SET LOCAL gutenberg.defer_book_documents = on;
+--     ... INSERT / UPDATE / DELETE on books_* ...
+--     SELECT refresh_book_documents(<every gutenberg_id written>);
+--
+-- Without it every relation row written re-renders its book's document, so
+-- rewriting a book with twenty relation rows renders it twenty times. Used
+-- by rdf_sync.py; sessions that do not set it keep the per-row behaviour.
+
+CREATE OR REPLACE FUNCTION book_documents_sync() RETURNS trigger AS $$
+DECLARE
+    books integer[];
+BEGIN
+    IF current_setting('gutenberg.defer_book_documents', true) = 'on' THEN
+        RETURN NULL;
+    END IF;
+    IF TG_TABLE_NAME = 'books_book' THEN
+        books := ARRAY[]::integer[];
+        IF TG_OP <> 'INSERT' THEN books := books || OLD.gutenberg_id; END IF;
+        IF TG_OP <> 'DELETE' THEN books := books || NEW.gutenberg_id; END IF;
+    ELSIF TG_TABLE_NAME IN ('books_book_authors', 'books_book_languages', 'books_book_subjects',
+                            'books_book_bookshelves', 'books_format') THEN
+        books := ARRAY[]::integer[];
+        IF TG_OP <> 'INSERT' THEN books := books || OLD.book_id; END IF;
+        IF TG_OP <> 'DELETE' THEN books := books || NEW.book_id; END IF;
+    ELSIF TG_TABLE_NAME = 'books_author' THEN
+        books := ARRAY(SELECT book_id FROM books_book_authors WHERE author_id = COALESCE(NEW.id, OLD.id));
+    ELSIF TG_TABLE_NAME = 'books_language' THEN
+        books := ARRAY(SELECT book_id FROM books_book_languages WHERE language_id = COALESCE(NEW.id, OLD.id));
+    ELSIF TG_TABLE_NAME = 'books_subject' THEN
+        books := ARRAY(SELECT book_id FROM books_book_subjects WHERE subject_id = COALESCE(NEW.id, OLD.id));
+    ELSIF TG_TABLE_NAME = 'books_bookshelf' THEN
+        books := ARRAY(SELECT book_id FROM books_book_bookshelves WHERE bookshelf_id = COALESCE(NEW.id, OLD.id));
+    END IF;
+
+    PERFORM refresh_book_documents(books);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,11 @@
+-- The Project Gutenberg agent id of each author, so rdf_sync.py can match
+-- catalog agents to stored authors. books_author.id is only the agent id in
+-- databases built by rdf_loader.py; elsewhere it is a plain serial.
+--
+-- rdf_loader.py fills it in as it loads (schema.sql already has the
+-- column). Rows that predate it start without one, and rdf_sync.py claims
+-- such an author by name and dates the first time its agent is seen.
+
+ALTER TABLE books_author ADD COLUMN IF NOT EXISTS agent_id integer;
+
+CREATE UNIQUE INDEX IF NOT EXISTS books_author_agent_id ON books_author (agent_id);
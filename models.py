@@ -1,105 +1,611 @@
-import imp
+import concurrent.futures
+import contextlib
+import contextvars
+import hashlib
 import os
+import threading
+import time
 from flask import Flask, jsonify, request
-from flasgger import Swagger, swag_from
-import os
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from urllib.parse import urlparse
+from db import pool, read_pool
+import queries
+import catalog
+from cache import TTLCache
+import metrics
+from slow_query import SlowQueryLog
+from prepared import PreparedStatements
+from facets import FacetStore
+import memory_catalog
+import compression
+from health import ReadinessProbe
+from json_provider import JSON_PROVIDERS
+import apidocs
+from apidocs import swag_from
 
 app = Flask(__name__)
-# Swagger configuration
-swagger_config = {
-    "headers": [],
-    "specs": [
-        {
-            "endpoint": 'apispec',
-            "route": '/apispec.json',
-            "rule_filter": lambda rule: True,
-            "model_filter": lambda tag: True,
-        }
-    ],
-    "static_url_path": "/flasgger_static",
-    "swagger_ui": True,
-    "specs_route": "/docs/"
+# "orjson" (default) or "default" for Flask's stdlib encoder
+app.json = JSON_PROVIDERS[os.environ.get('JSON_PROVIDER', 'orjson')](app)
+# Swagger UI and a cached /apispec.json; see apidocs.py for API_DOCS=off
+api_spec = apidocs.init_app(app)
+
+
+# "two_phase" pages over gutenberg_ids and hydrates only that page;
+# "documents" reads precomputed rows from book_documents (migration 0003);
+# "join" is the original single wide join kept as a fallback;
+# "memory" answers from an in-process copy of the catalog (memory_catalog.py)
+# and uses "two_phase" while it loads or for queries it cannot answer
+QUERY_STRATEGY = os.environ.get('BOOKS_QUERY_STRATEGY', 'two_phase')
+
+# Reloaded when the catalog version moves, and at least every
+# MEMORY_CATALOG_MAX_AGE seconds
+memory_store = memory_catalog.MemoryCatalogStore(
+    pool,
+    max_age=float(os.environ.get('MEMORY_CATALOG_MAX_AGE', 3600))
+)
+
+# How the total of an uncached exact count is computed next to the page:
+# "sequential" runs the count then the page on one connection; "window"
+# folds it into the page query with COUNT(*) OVER (); "concurrent" runs the
+# count on a second pooled connection while the page query runs (the ASGI
+# app always runs them concurrently unless "window" is chosen)
+COUNT_EXECUTIONS = ('sequential', 'window', 'concurrent')
+COUNT_EXECUTION = os.environ.get('BOOKS_COUNT_EXECUTION', 'sequential')
+if COUNT_EXECUTION not in COUNT_EXECUTIONS:
+    raise ValueError(f"BOOKS_COUNT_EXECUTION must be one of {', '.join(COUNT_EXECUTIONS)}")
+
+# Totals per normalized filter set; see invalidate_count_cache()
+count_cache = TTLCache(
+    max_size=int(os.environ.get('COUNT_CACHE_SIZE', 1024)),
+    ttl=float(os.environ.get('COUNT_CACHE_TTL', 300))
+)
+
+# Serialized /get_books bodies per (catalog version, request)
+response_cache = TTLCache(
+    max_size=int(os.environ.get('RESPONSE_CACHE_SIZE', 512)),
+    ttl=float(os.environ.get('RESPONSE_CACHE_TTL', 300))
+)
+
+# gzip/brotli for JSON responses of at least COMPRESSION_MIN_SIZE bytes;
+# cached /get_books bodies keep their compressed variants
+compressor = compression.Compressor(
+    enabled=os.environ.get('COMPRESSION', 'on') == 'on',
+    min_size=int(os.environ.get('COMPRESSION_MIN_SIZE', 1024)),
+    gzip_level=int(os.environ.get('GZIP_LEVEL', 6)),
+    brotli_quality=int(os.environ.get('BROTLI_QUALITY', 5))
+)
+
+
+@app.after_request
+def compress_response(response):
+    # Responses that are not already compressed (everything but /get_books)
+    return compressor.apply(response, request.headers.get('Accept-Encoding'))
+
+
+# Cache-Control max-age for /get_books, for browsers and the CDN
+RESPONSE_MAX_AGE = int(os.environ.get('RESPONSE_MAX_AGE', 60))
+
+COUNT_MODES = ('exact', 'estimate', 'none')
+SORTS = ('downloads', 'relevance')
+
+# /get_books fields= names -> the hydrated row column each is read from
+BOOK_FIELDS = {
+    'title': 'title',
+    'gutenberg_id': 'gutenberg_id',
+    'author': 'author_info',
+    'authors': 'authors',
+    'language': 'language',
+    'languages': 'languages',
+    'subjects': 'subjects',
+    'bookshelves': 'bookshelves',
+    'download_links': 'download_links',
 }
 
-swagger = Swagger(app, config=swagger_config)
 
+def book_columns(fields):
+    # Row columns to hydrate for `fields`; None (every column) without a projection
+    if fields is None:
+        return None
+    return [BOOK_FIELDS[field] for field in fields]
 
-DATABASE_URL = os.environ.get('DATABASE_URL')
+# Send per-phase durations to clients in a Server-Timing header
+SERVER_TIMING = os.environ.get('SERVER_TIMING', 'on') == 'on'
+
+# Latency by filter shape, served on /metrics
+books_request_seconds = metrics.Histogram(
+    'gutenberg_books_request_seconds', 'Time to answer /get_books', ('shape', 'cache'))
+books_phase_seconds = metrics.Histogram(
+    'gutenberg_books_phase_seconds', 'Time spent in each phase of /get_books', ('shape', 'phase'))
+
+
+def filter_shape(params):
+    # Which filters a request uses, e.g. "languages+topics"; at most 64 values
+    names = [name for name in ('book_ids', 'languages', 'mime_types', 'topics', 'authors', 'titles')
+             if params.get(name)]
+    return '+'.join(names) or 'unfiltered'
+
+
+def observe_books_request(labels, phases):
+    # Record one /get_books request; phases['total'] is the whole request
+    books_request_seconds.observe(phases['total'], shape=labels['shape'], cache=labels['cache'])
+    for name, seconds in phases.items():
+        if name != 'total':
+            books_phase_seconds.observe(seconds, shape=labels['shape'], phase=name)
+
+
+# /readyz probes the primary pool at most every READYZ_INTERVAL seconds and
+# answers within READYZ_TIMEOUT seconds; /livez never touches the database
+readiness = ReadinessProbe(
+    pool,
+    interval=float(os.environ.get('READYZ_INTERVAL', 2)),
+    timeout=float(os.environ.get('READYZ_TIMEOUT', 1))
+)
+
+
+# Statements slower than SLOW_QUERY_MS ("off" to disable) are logged as JSON
+# with their plan; see slow_query.SlowQueryLog
+slow_queries = SlowQueryLog(
+    pool,
+    threshold_ms=(None if os.environ.get('SLOW_QUERY_MS') == 'off'
+                  else float(os.environ.get('SLOW_QUERY_MS', 500))),
+    sample_rate=float(os.environ.get('SLOW_QUERY_SAMPLE_RATE', 1.0)),
+    explain=os.environ.get('SLOW_QUERY_EXPLAIN', 'plain'),
+    redact_params=os.environ.get('SLOW_QUERY_REDACT', 'on') == 'on',
+    explain_timeout_ms=int(os.environ.get('SLOW_QUERY_EXPLAIN_TIMEOUT_MS', 5000))
+)
 
-if DATABASE_URL:
-    url = urlparse(DATABASE_URL)
-    db_config = {
-        'dbname': url.path[1:],
-        'user': url.username,
-        'password': url.password,
-        'host': url.hostname,
-        'port': url.port or 5432
-    }
-else:
-    # Your local database config
-    db_config = {
-        "host" : "127.0.0.1",
-        "database" : "gutenberg",
-        "user" : "nishigandha05",
-        "password": 'nishi7456',
-    }
+
+# Count and page statements are PREPAREd once per pooled connection and
+# filter shape; set PREPARED_STATEMENTS=off behind a transaction pooler
+prepared_statements = PreparedStatements(
+    max_per_connection=int(os.environ.get('PREPARED_STATEMENTS_PER_CONNECTION', 64)),
+    enabled=os.environ.get('PREPARED_STATEMENTS', 'on') == 'on'
+)
+
+
+# The pool this request's reads are served from (see timed_connections),
+# so slow statements are EXPLAINed on the server that ran them
+_read_source = contextvars.ContextVar('read_source', default=None)
+
+# Set when this request's reads came from a replica that has not replayed
+# the catalog version caches and ETags are keyed on, or from the previous
+# memory snapshot while the current one loads; what it returns must not be
+# cached under that version
+_stale_read = contextvars.ContextVar('stale_read', default=False)
+
+
+def _check_replica_version(connection):
+    # Flag the request as a stale read when the replica's catalog version is
+    # behind the one this worker keys its caches on
+    version = catalog.current_version()
+    if version is None:
+        return
+    cursor = connection.cursor()
+    try:
+        cursor.execute("SELECT version FROM catalog_version")
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    if row is None or row[0] < version:
+        _stale_read.set(True)
+
+
+@contextlib.contextmanager
+def timed_connections(count=1):
+    # read_pool.connections() (a replica when configured, else the primary):
+    # up to `count` connections to one server, with the wait for the first
+    # timed as "connect"
+    with contextlib.ExitStack() as stack:
+        with metrics.phase('connect'):
+            source, connections = stack.enter_context(read_pool.connections(count))
+            if source is not read_pool.primary:
+                _check_replica_version(connections[0])
+        token = _read_source.set(source)
+        try:
+            yield connections
+        finally:
+            _read_source.reset(token)
+
+
+def watch_statement(phase, query, params):
+    # slow_queries.watch() for a statement on a timed_connections() connection
+    return slow_queries.watch(phase, query, params, pool=_read_source.get())
 
 #Function to retrieve data from database
 def get_books_from_db(page=1, per_page=25, book_ids=None, languages=None, mime_types=None, 
-                     topics=None, authors=None, titles=None):
-    #connect to database
-    connection = psycopg2.connect(**db_config)
-    cursor = connection.cursor(cursor_factory = RealDictCursor)
+                     topics=None, authors=None, titles=None, after=None, count='exact',
+                     search='substring', sort='downloads', fields=None, lookahead=False):
+    # `after` is a decoded (download_count, gutenberg_id) cursor; when given,
+    # the page starts right after that book and `page` is ignored.
+    # `lookahead` fetches one row past the page (which still starts at
+    # (page - 1) * per_page) to tell whether another page follows.
+    # `count` is one of COUNT_MODES; with 'none' the total is None.
+    # `search` is one of queries.SEARCH_MODES for the title/author/topic
+    # filters; sort='relevance' ranks by how well those filters match.
+    # `fields` (BOOK_FIELDS names, None for all) limits what is hydrated;
+    # rows always carry gutenberg_id and download_count.
+    filters = {
+        'book_ids': book_ids,
+        'languages': languages,
+        'mime_types': mime_types,
+        'topics': topics,
+        'authors': authors,
+        'titles': titles
+    }
+    result = get_books_from_memory(filters, page, per_page, after, count, search, sort, lookahead)
+    if result is not None:
+        return result
 
-    # Base query
-    base_query = """
-        SELECT 
-            bb.title,
-            bb.gutenberg_id,
-            bb.download_count,
-            json_build_object(
-                'name', ba.name,
-                'birth_year', ba.birth_year,
-                'death_year', ba.death_year,
-                'id', ba.id
-            ) as author_info,
-            bl.code as language,
-            STRING_AGG(DISTINCT bs.name, ', ') as subjects,
-            STRING_AGG(DISTINCT bbk.name, ', ') as bookshelves,
-            json_agg(
-                DISTINCT jsonb_build_object(
-                    'mime_type', bf.mime_type,
-                    'url', bf.url
-                )
-            ) as download_links
-        FROM books_book as bb
-        LEFT JOIN books_book_authors as bba 
+    if QUERY_STRATEGY == 'join' and search == 'substring' and sort == 'downloads':
+        with timed_connections() as (connection,):
+            return _query_books_join(connection, filters, page, per_page, after, count, fields, lookahead)
+
+    plan = plan_books_query(filters, page, per_page, after, count, search, sort, fields, lookahead)
+    # A concurrent count takes a second connection to the same server up
+    # front, or runs sequentially when the pool has none free right away
+    concurrent_count = bool(plan['count_query']) and COUNT_EXECUTION == 'concurrent'
+
+    #borrow pooled connections for this worker
+    with timed_connections(2 if concurrent_count else 1) as connections:
+        cursor = connections[0].cursor(cursor_factory = RealDictCursor)
+
+        total_count = plan['total_count']
+        pending_count = None
+        if plan['count_query'] and len(connections) > 1:
+            pending_count = _submit_count(connections[1], plan)
+        elif plan['count_query']:
+            total_count = _execute_count(cursor, plan, plan['count_query'])
+
+        try:
+            with metrics.phase('page'), watch_statement('page', *plan['page_query']):
+                prepared_statements.execute(cursor, *plan['page_query'])
+                rows = cursor.fetchall()
+        except BaseException:
+            if pending_count is not None:
+                _cancel_count(pending_count, connections[1])
+            raise
+
+        if plan['window_count']:
+            total_count = finish_window_count(plan, rows)
+            if total_count is None:
+                total_count = _execute_count(cursor, plan, plan['fallback_count_query'])
+        books = page_rows(plan, rows)
+
+        cursor.close()
+
+        if pending_count is not None:
+            total_count = pending_count.result()
+    return total_count, books
+
+
+def _cancel_count(pending_count, connection):
+    # Stop a count from _submit_count and wait for it to end before its
+    # connection goes back to the pool. A count still queued never starts; one
+    # already running is cancelled again until it ends, since a cancel that
+    # lands before its statement reaches the server does nothing
+    if pending_count.cancel():
+        return
+    connection.cancel()
+    while not concurrent.futures.wait([pending_count], timeout=0.05).done:
+        connection.cancel()
+
+
+def _execute_count(cursor, plan, count_query):
+    with metrics.phase('count'), watch_statement('count', *count_query):
+        prepared_statements.execute(cursor, *count_query)
+        return finish_count(plan, cursor.fetchone())
+
+
+_count_executor = {'pid': None, 'executor': None}
+_count_executor_lock = threading.Lock()
+
+def _submit_count(connection, plan):
+    # Run plan['count_query'] on `connection`, the caller's second one, while
+    # the caller runs the page query; returns a Future of the total
+    with _count_executor_lock:
+        if _count_executor['pid'] != os.getpid():
+            # Threads do not survive a fork; start a pool per worker
+            _count_executor['pid'] = os.getpid()
+            _count_executor['executor'] = concurrent.futures.ThreadPoolExecutor(
+                max_workers=pool.max_size, thread_name_prefix='books-count')
+        executor = _count_executor['executor']
+
+    def run():
+        cursor = connection.cursor(cursor_factory = RealDictCursor)
+        try:
+            return _execute_count(cursor, plan, plan['count_query'])
+        finally:
+            cursor.close()
+
+    # Phase timings land in this request's Server-Timing and histograms
+    return executor.submit(contextvars.copy_context().run, run)
+
+
+def get_books_from_memory(filters, page, per_page, after=None, count='exact',
+                          search='substring', sort='downloads', lookahead=False):
+    # (total, books) from the in-memory catalog, or None when the strategy is
+    # off, the snapshot is still loading or the query needs Postgres
+    if QUERY_STRATEGY != 'memory' or not memory_catalog.supports(search=search, sort=sort, **filters):
+        return None
+    version = catalog.current_version()
+    snapshot = memory_store.get(version, wait=False)
+    if snapshot is None:
+        return None
+    if snapshot.version != version:
+        # The previous snapshot, served while this version's one loads
+        _stale_read.set(True)
+    with metrics.phase('memory'):
+        return snapshot.search(filters, page, per_page, after, count, lookahead)
+
+
+def invalidate_count_cache():
+    # Call after the books_* tables change
+    count_cache.clear()
+
+
+@catalog.on_change
+def _catalog_changed(old_version, new_version):
+    invalidate_count_cache()
+    response_cache.clear()
+
+
+def plan_books_query(filters, page, per_page, after=None, count_mode='exact',
+                     search='substring', sort='downloads', fields=None, lookahead=False):
+    # Build, without running them, the count and page statements of the
+    # two-phase or documents strategy so the sync and async paths execute
+    # the same SQL. Returns a dict with
+    #   total_count  the cached total (or None)
+    #   count_query  (sql, params) to run when the total is not cached, or None
+    #   page_query   (sql, params) for the page of books
+    #   window_count whether page_query also returns the total (see
+    #                COUNT_EXECUTION); pass its rows to finish_window_count()
+    #                and, if that returns None, run fallback_count_query
+    # Pass the count query's row to finish_count() and the page rows to
+    # page_rows().
+    # Only the two-phase plan knows full-text search and relevance order
+    documents = QUERY_STRATEGY == 'documents' and search == 'substring' and sort == 'downloads'
+    if documents:
+        conditions, params = queries.build_document_conditions(**filters)
+        count_query = (queries.build_document_count_query(conditions), params)
+        estimate_query = (queries.build_estimate_query(conditions, 'book_documents AS bd'), params)
+    else:
+        conditions, params = queries.build_filter_conditions(**filters, search=search)
+        count_query = (queries.build_count_query(conditions), params)
+        estimate_query = (queries.build_estimate_query(conditions), params)
+
+    plan = {'documents': documents, 'count_mode': count_mode}
+    plan.update(_count_plan(filters, count_mode, search, count_query, estimate_query))
+
+    rank, rank_params = None, []
+    if sort == 'relevance':
+        rank, rank_params = queries.build_rank_expression(**filters, search=search)
+
+    offset = (page - 1) * per_page
+    if after is not None:
+        keyset_condition, keyset_params = queries.build_keyset_condition(
+            after, alias='bd' if documents else 'bb')
+        conditions = conditions + [keyset_condition]
+        params = params + keyset_params
+        offset = 0
+
+    # Fold an exact count into the page query. A keyset page only sees the
+    # books after its cursor, so it keeps the separate count.
+    window_count = (COUNT_EXECUTION == 'window' and count_mode == 'exact'
+                    and plan['count_query'] is not None and after is None)
+    plan['window_count'] = window_count
+    plan['offset'] = offset
+    if window_count:
+        plan['fallback_count_query'] = plan['count_query']
+        plan['count_query'] = None
+
+    columns = book_columns(fields)
+    if documents:
+        page_query = queries.build_document_page_query(conditions, window_count, columns)
+    else:
+        page_query = queries.build_two_phase_page_query(conditions, rank, window_count, columns)
+    limit = per_page + 1 if lookahead else per_page
+    plan['page_query'] = (page_query, rank_params + params + [limit, offset])
+    return plan
+
+
+def _count_plan(filters, count_mode, search, count_query, estimate_query):
+    if count_mode == 'none':
+        return {'count_key': None, 'total_count': None, 'count_query': None}
+
+    # Keyed on the catalog version too, so a total never outlives the
+    # catalog it counted even if a change notification was missed
+    key = (catalog.current_version(), count_mode, search, queries.filter_key(filters))
+    total_count = count_cache.get(key)
+    if total_count is not None:
+        return {'count_key': key, 'total_count': total_count, 'count_query': None}
+
+    # Estimates are the planner's row estimate; no rows are read
+    return {
+        'count_key': key,
+        'total_count': None,
+        'count_query': estimate_query if count_mode == 'estimate' else count_query
+    }
+
+
+def finish_count(plan, row):
+    # Total from the row of plan['count_query'], remembered in the count cache
+    if plan['count_mode'] == 'estimate':
+        total_count = queries.plan_rows(row['QUERY PLAN'])
+    else:
+        total_count = row['count']
+    if not _stale_read.get():
+        count_cache.set(plan['count_key'], total_count)
+    return total_count
+
+
+def finish_window_count(plan, rows):
+    # Total carried by the rows of a window-count page query, remembered in
+    # the count cache; None when a page past the end carried no rows and
+    # plan['fallback_count_query'] has to run after all
+    if rows:
+        total_count = rows[0]['total_count']
+    elif plan['offset'] == 0:
+        total_count = 0
+    else:
+        return None
+    if not _stale_read.get():
+        count_cache.set(plan['count_key'], total_count)
+    return total_count
+
+
+def page_rows(plan, rows):
+    # Hydrated books from the rows of plan['page_query']
+    if plan['documents']:
+        return [row['document'] for row in rows]
+    if plan['window_count']:
+        for row in rows:
+            row.pop('total_count', None)
+    return rows
+
+
+# Rows fetched per round trip by the /export/books server-side cursor
+EXPORT_ITERSIZE = int(os.environ.get('EXPORT_ITERSIZE', 2000))
+
+def export_books_from_db(book_ids=None, languages=None, mime_types=None, topics=None,
+                         authors=None, titles=None, search='substring'):
+    # Generator over every matching hydrated book, in gutenberg_id order.
+    # A named (server-side) cursor keeps memory flat however large the
+    # export; the pooled connection is held until the generator is closed.
+    filters = {
+        'book_ids': book_ids,
+        'languages': languages,
+        'mime_types': mime_types,
+        'topics': topics,
+        'authors': authors,
+        'titles': titles
+    }
+    documents = QUERY_STRATEGY == 'documents' and search == 'substring'
+    if documents:
+        conditions, params = queries.build_document_conditions(**filters)
+        export_query = queries.build_document_export_query(conditions)
+    else:
+        conditions, params = queries.build_filter_conditions(**filters, search=search)
+        export_query = queries.build_export_query(conditions)
+
+    with read_pool.connection() as connection:
+        cursor = connection.cursor(name='export_books', cursor_factory = RealDictCursor)
+        cursor.itersize = EXPORT_ITERSIZE
+        try:
+            cursor.execute(export_query, params)
+            for row in cursor:
+                yield row['document'] if documents else row
+        finally:
+            cursor.close()
+
+
+# Largest id list accepted by POST /books/batch
+BATCH_MAX_IDS = int(os.environ.get('BATCH_MAX_IDS', 1000))
+
+def get_books_by_ids(book_ids):
+    # One hydration round trip for an id list; no counting or paging.
+    # Returns {gutenberg_id: row} for the ids that exist.
+    documents = QUERY_STRATEGY == 'documents'
+    with read_pool.connection() as connection:
+        cursor = connection.cursor(cursor_factory = RealDictCursor)
+        if documents:
+            cursor.execute(queries.build_document_lookup_query(), [book_ids])
+            books = [row['document'] for row in cursor.fetchall()]
+        else:
+            cursor.execute(queries.build_lookup_query(), [book_ids])
+            books = cursor.fetchall()
+        cursor.close()
+    return {book['gutenberg_id']: book for book in books}
+
+
+# Per-value book bitmaps behind /facets, rebuilt when the catalog version
+# moves; see facets.py
+facet_store = FacetStore(
+    pool,
+    top_subjects=int(os.environ.get('FACET_TOP_SUBJECTS', 200)),
+    top_authors=int(os.environ.get('FACET_TOP_AUTHORS', 200)),
+    ttl=float(os.environ.get('FACET_INDEX_TTL', 300))
+)
+
+def get_text_match_ids(topics=None, authors=None, titles=None, search='substring'):
+    # gutenberg_ids matching the text filters, which the facet index cannot
+    # evaluate itself
+    conditions, params = queries.build_filter_conditions(
+        topics=topics, authors=authors, titles=titles, search=search)
+    with read_pool.connection() as connection:
+        cursor = connection.cursor()
+        cursor.execute(queries.build_ids_query(conditions), params)
+        book_ids = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+    return book_ids
+
+
+# The relations of the wide join: its LEFT JOINs and the columns it adds
+JOIN_RELATIONS = {
+    'authors': """
+        LEFT JOIN books_book_authors as bba
             ON bb.gutenberg_id = bba.book_id
-        LEFT JOIN books_author as ba 
-            ON ba.id = bba.author_id
-        LEFT JOIN books_book_languages as bbl 
+        LEFT JOIN books_author as ba
+            ON ba.id = bba.author_id""",
+    'languages': """
+        LEFT JOIN books_book_languages as bbl
             ON bb.gutenberg_id = bbl.book_id
-        LEFT JOIN books_language as bl 
-            ON bbl.language_id = bl.id
-        LEFT JOIN books_book_subjects as bbs 
+        LEFT JOIN books_language as bl
+            ON bbl.language_id = bl.id""",
+    'subjects': """
+        LEFT JOIN books_book_subjects as bbs
             ON bb.gutenberg_id = bbs.book_id
-        LEFT JOIN books_subject as bs 
-            ON bbs.subject_id = bs.id
+        LEFT JOIN books_subject as bs
+            ON bbs.subject_id = bs.id""",
+    'bookshelves': """
         LEFT JOIN books_book_bookshelves as bbb
             ON bb.gutenberg_id = bbb.book_id
         LEFT JOIN books_bookshelf as bbk
-            ON bbb.bookshelf_id = bbk.id
+            ON bbb.bookshelf_id = bbk.id""",
+    'formats': """
         LEFT JOIN books_format as bf
-            ON bb.gutenberg_id = bf.book_id
-        WHERE 1=1
-    """
-    
-    # Build where clause for filtering
+            ON bb.gutenberg_id = bf.book_id""",
+}
+
+# Row column -> (relation it needs, select expression). Authors and languages
+# are the per-book subqueries of the other strategies, so a book with several
+# of them is still one row, with the same author_info and language.
+JOIN_COLUMNS = {
+    'title': (None, "bb.title"),
+    'author_info': (None, queries.HYDRATE_EXPRESSIONS['author_info'] + " as author_info"),
+    'authors': (None, queries.HYDRATE_EXPRESSIONS['authors'] + " as authors"),
+    'language': (None, queries.HYDRATE_EXPRESSIONS['language'] + " as language"),
+    'languages': (None, queries.HYDRATE_EXPRESSIONS['languages'] + " as languages"),
+    'subjects': ('subjects',
+                 "array_agg(DISTINCT bs.name) FILTER (WHERE bs.name IS NOT NULL) as subjects"),
+    'bookshelves': ('bookshelves',
+                    "array_agg(DISTINCT bbk.name) FILTER (WHERE bbk.name IS NOT NULL) as bookshelves"),
+    'download_links': ('formats', """json_agg(
+                DISTINCT jsonb_build_object(
+                    'mime_type', bf.mime_type,
+                    'url', bf.url
+                )
+            ) as download_links"""),
+}
+
+
+def _join_clause(relations):
+    return "".join(JOIN_RELATIONS[name] for name in JOIN_RELATIONS if name in relations)
+
+
+def _query_books_join(connection, filters, page, per_page, after, count_mode, fields=None,
+                      lookahead=False):
+    book_ids = filters['book_ids']
+    languages = filters['languages']
+    mime_types = filters['mime_types']
+    topics = filters['topics']
+    authors = filters['authors']
+    titles = filters['titles']
+    cursor = connection.cursor(cursor_factory = RealDictCursor)
+
+    # Build where clause for filtering, noting the relations each filter reads
     where_conditions = []
     params = []
+    filter_relations = set()
 
     if book_ids:
         where_conditions.append("bb.gutenberg_id = ANY(%s)")
@@ -108,93 +614,90 @@ def get_books_from_db(page=1, per_page=25, book_ids=None, languages=None, mime_t
     if languages:
         where_conditions.append("bl.code = ANY(%s)")
         params.append(languages)
+        filter_relations.add('languages')
 
     if mime_types:
         where_conditions.append("bf.mime_type = ANY(%s)")
         params.append(mime_types)
+        filter_relations.add('formats')
 
+    # One LIKE ANY per filter, so the SQL (and its prepared statement)
+    # depends only on which filters are present, not on how many terms
     if topics:
-        topic_conditions = []
-        for topic in topics:
-            topic_param = f"%{topic.lower()}%"
-            topic_conditions.append("""
-                (LOWER(bs.name) LIKE %s 
-                OR LOWER(bbk.name) LIKE %s)
-            """)
-            params.extend([topic_param, topic_param])
-        if topic_conditions:
-            where_conditions.append(f"({' OR '.join(topic_conditions)})")
+        where_conditions.append("(LOWER(bs.name) LIKE ANY(%s) OR LOWER(bbk.name) LIKE ANY(%s))")
+        params.extend([queries.like_patterns(topics), queries.like_patterns(topics)])
+        filter_relations.update(['subjects', 'bookshelves'])
 
     if authors:
-        author_conditions = []
-        for author in authors:
-            author_param = f"%{author.lower()}%"
-            author_conditions.append("LOWER(ba.name) LIKE %s")
-            params.append(author_param)
-        if author_conditions:
-            where_conditions.append(f"({' OR '.join(author_conditions)})")
+        where_conditions.append("LOWER(ba.name) LIKE ANY(%s)")
+        params.append(queries.like_patterns(authors))
+        filter_relations.add('authors')
 
     if titles:
-        title_conditions = []
-        for title in titles:
-            title_param = f"%{title.lower()}%"
-            title_conditions.append("LOWER(bb.title) LIKE %s")
-            params.append(title_param)
-        if title_conditions:
-            where_conditions.append(f"({' OR '.join(title_conditions)})")
-
-    # Add where conditions to base query
-    if where_conditions:
-        base_query += " AND " + " AND ".join(where_conditions)
+        where_conditions.append("LOWER(bb.title) LIKE ANY(%s)")
+        params.append(queries.like_patterns(titles))
+
+    # Only the relations that requested fields aggregate, plus those the
+    # filters read, are joined
+    columns = [column for column in JOIN_COLUMNS if fields is None or column in book_columns(fields)]
+    relations = filter_relations | {JOIN_COLUMNS[column][0] for column in columns}
+    select_list = ["bb.gutenberg_id", "bb.download_count"] + [JOIN_COLUMNS[column][1] for column in columns]
+    group_by = ["bb.title", "bb.gutenberg_id", "bb.download_count"]
+
+    base_query = (
+        "\n        SELECT\n            " + ",\n            ".join(select_list)
+        + "\n        FROM books_book as bb" + _join_clause(relations)
+        + "\n        WHERE 1=1\n    "
+    )
+
+    # Add where conditions to base query; the keyset condition only narrows
+    # the page, never the total count
+    page_conditions = list(where_conditions)
+    page_params = list(params)
+    if after is not None:
+        keyset_condition, keyset_params = queries.build_keyset_condition(after)
+        page_conditions.append(keyset_condition)
+        page_params.extend(keyset_params)
+
+    if page_conditions:
+        base_query += " AND " + " AND ".join(page_conditions)
 
     # Add GROUP BY for aggregations
-    base_query += """
-        GROUP BY 
-            bb.title,
-            bb.gutenberg_id,
-            bb.download_count,
-            ba.name,
-            ba.birth_year,
-            ba.death_year,
-            ba.id,
-            bl.code
-    """
-
-    # Get total count of unique books with filters
-    count_query = """
-        SELECT COUNT(DISTINCT bb.gutenberg_id) 
-        FROM books_book as bb
-        LEFT JOIN books_book_authors as bba ON bb.gutenberg_id = bba.book_id
-        LEFT JOIN books_author as ba ON ba.id = bba.author_id
-        LEFT JOIN books_book_languages as bbl ON bb.gutenberg_id = bbl.book_id
-        LEFT JOIN books_language as bl ON bbl.language_id = bl.id
-        LEFT JOIN books_book_subjects as bbs ON bb.gutenberg_id = bbs.book_id
-        LEFT JOIN books_subject as bs ON bbs.subject_id = bs.id
-        LEFT JOIN books_book_bookshelves as bbb ON bb.gutenberg_id = bbb.book_id
-        LEFT JOIN books_bookshelf as bbk ON bbb.bookshelf_id = bbk.id
-        LEFT JOIN books_format as bf ON bb.gutenberg_id = bf.book_id
-        WHERE 1=1
-    """
-    
+    base_query += "\n        GROUP BY " + ", ".join(group_by)
+
+    # Get total count of unique books with filters, joining only what the
+    # filters read
+    count_query = (
+        "\n        SELECT COUNT(DISTINCT bb.gutenberg_id)"
+        + "\n        FROM books_book as bb" + _join_clause(filter_relations)
+        + "\n        WHERE 1=1\n    "
+    )
+
     if where_conditions:
         count_query += " AND " + " AND ".join(where_conditions)
-    
-    cursor.execute(count_query, params)
-    total_count = cursor.fetchone()['count']
+
+    # Legacy COUNT(DISTINCT) over the same join; estimates use the semi-join form
+    conditions, estimate_params = queries.build_filter_conditions(**filters)
+    plan = {'documents': False, 'count_mode': count_mode}
+    plan.update(_count_plan(filters, count_mode, 'substring', (count_query, params),
+                            (queries.build_estimate_query(conditions), estimate_params)))
+    total_count = plan['total_count']
+    if plan['count_query']:
+        total_count = _execute_count(cursor, plan, plan['count_query'])
 
     # Add ordering and pagination to main query
-    base_query += " ORDER BY bb.download_count DESC NULLS LAST"
+    base_query += f" ORDER BY {queries.ORDER_BY}"
     base_query += " LIMIT %s OFFSET %s"
-    
+
     # Add pagination parameters
-    offset = (page - 1) * per_page
-    params.extend([per_page, offset])
+    offset = 0 if after is not None else (page - 1) * per_page
+    page_params.extend([per_page + 1 if lookahead else per_page, offset])
 
-    cursor.execute(base_query, params)
-    books = cursor.fetchall()
+    with metrics.phase('page'), watch_statement('page', base_query, page_params):
+        prepared_statements.execute(cursor, base_query, page_params)
+        books = cursor.fetchall()
 
     cursor.close()
-    connection.close()
 
     return total_count, books
 
@@ -217,6 +720,44 @@ def get_books_from_db(page=1, per_page=25, book_ids=None, languages=None, mime_t
             'default': 25,
             'description': 'Items per page (max 100)'
         },
+        {
+            'name': 'cursor',
+            'in': 'query',
+            'type': 'string',
+            'description': 'Opaque keyset cursor from pagination.next_cursor; replaces page'
+        },
+        {
+            'name': 'count',
+            'in': 'query',
+            'type': 'string',
+            'enum': ['exact', 'estimate', 'none'],
+            'default': 'exact',
+            'description': 'How total_books is computed: exact (cached), planner estimate, or skipped (null)'
+        },
+        {
+            'name': 'search',
+            'in': 'query',
+            'type': 'string',
+            'enum': ['substring', 'fulltext'],
+            'default': 'substring',
+            'description': 'How title, author and topic match: partial substring, or whole words (full-text)'
+        },
+        {
+            'name': 'sort',
+            'in': 'query',
+            'type': 'string',
+            'enum': ['downloads', 'relevance'],
+            'default': 'downloads',
+            'description': 'Order by download count, or by text-search relevance (not with cursor)'
+        },
+        {
+            'name': 'fields',
+            'in': 'query',
+            'type': 'string',
+            'description': 'Comma-separated book fields to return (title, gutenberg_id, author, '
+                           'authors, language, languages, subjects, bookshelves, download_links); '
+                           'default all. Fields left out are not queried at all'
+        },
         {
             'name': 'book_id',
             'in': 'query',
@@ -282,6 +823,7 @@ def get_books_from_db(page=1, per_page=25, book_ids=None, languages=None, mime_t
                                 'gutenberg_id': {'type': 'integer'},
                                 'author': {
                                     'type': 'object',
+                                    'description': 'The first of authors',
                                     'properties': {
                                         'name': {'type': 'string'},
                                         'birth_year': {'type': 'integer'},
@@ -289,7 +831,20 @@ def get_books_from_db(page=1, per_page=25, book_ids=None, languages=None, mime_t
                                         'id': {'type': 'integer'}
                                     }
                                 },
-                                'language': {'type': 'string'},
+                                'authors': {
+                                    'type': 'array',
+                                    'items': {
+                                        'type': 'object',
+                                        'properties': {
+                                            'name': {'type': 'string'},
+                                            'birth_year': {'type': 'integer'},
+                                            'death_year': {'type': 'integer'},
+                                            'id': {'type': 'integer'}
+                                        }
+                                    }
+                                },
+                                'language': {'type': 'string', 'description': 'The first of languages'},
+                                'languages': {'type': 'array', 'items': {'type': 'string'}},
                                 'subjects': {'type': 'array', 'items': {'type': 'string'}},
                                 'bookshelves': {'type': 'array', 'items': {'type': 'string'}},
                                 'download_links': {
@@ -312,7 +867,9 @@ def get_books_from_db(page=1, per_page=25, book_ids=None, languages=None, mime_t
                             'per_page': {'type': 'integer'},
                             'total_pages': {'type': 'integer'},
                             'has_next': {'type': 'boolean'},
-                            'has_prev': {'type': 'boolean'}
+                            'has_prev': {'type': 'boolean'},
+                            'cursor': {'type': 'string'},
+                            'next_cursor': {'type': 'string'}
                         }
                     }
                 }
@@ -320,26 +877,412 @@ def get_books_from_db(page=1, per_page=25, book_ids=None, languages=None, mime_t
         }
     }
 })
+def get_books():
+    # Time every phase of the request for Server-Timing and /metrics
+    token = metrics.start()
+    started = time.perf_counter()
+    labels = {'shape': 'invalid', 'cache': 'none'}
+    stale_token = _stale_read.set(False)
+    try:
+        response = app.make_response(_get_books(labels))
+    finally:
+        _stale_read.reset(stale_token)
+        phases = metrics.finish(token)
+    phases['total'] = time.perf_counter() - started
+    observe_books_request(labels, phases)
+    if SERVER_TIMING:
+        response.headers['Server-Timing'] = metrics.server_timing(phases)
+    return response
+
+
+def _get_books(labels):
+    # `labels` receives the request's filter shape and cache outcome
+    per_page = 25
+    try:
+        params, error = parse_books_args(request.args)
+        if error:
+            return jsonify({'error': error}), 400
+        per_page = params['per_page']
+        labels['shape'] = filter_shape(params)
+
+        # Identical requests against an unchanged catalog are answered from
+        # the response cache, or with 304 when the client already has them
+        body = None
+        with metrics.phase('cache'):
+            cache_key = books_cache_key(params, catalog.current_version())
+            if cache_key is not None:
+                etag = books_etag(cache_key)
+                if not_modified(request.if_none_match, etag):
+                    labels['cache'] = 'not_modified'
+                    return _cacheable(app.response_class(status=304), etag)
+                body = response_cache.get(cache_key)
+                labels['cache'] = 'miss' if body is None else 'hit'
+        if body is not None:
+            return _compressed(app.response_class(body.body, mimetype='application/json'), etag, body)
+
+        # Get filtered books
+        total_count, books = get_books_from_db(**books_query_kwargs(params))
+        if _stale_read.get():
+            # A lagging replica or memory snapshot answered; its rows predate
+            # the version the cache key and ETag name
+            labels['cache'] = 'stale'
+            cache_key = None
+
+        with metrics.phase('format'):
+            data = books_response_data(params, total_count, books)
+        with metrics.phase('encode'):
+            response = jsonify(data)
+        if cache_key is not None:
+            body = compression.CompressedBody(response.get_data())
+            response_cache.set(cache_key, body)
+            return _compressed(response, etag, body)
+        return response
+
+    except Exception as e:
+        # Log the error for debugging
+        print(f"Error in get_books: {str(e)}")
+        labels['cache'] = 'error'
+        # Return empty result set instead of error
+        return jsonify(empty_books_response_data(per_page)), 200  # Return 200 even for empty results
+
 
+def parse_books_args(args):
+    # Validate the /get_books query string. Returns (params, None), or
+    # (None, message) for a 400 response.
+    # Get and validate pagination parameters
+    page = max(1, args.get('page', 1, type=int))
+    per_page = min(max(1, args.get('per_page', 25, type=int)), 100)
 
+    # Keyset pagination: an opaque cursor replaces page/offset
+    cursor = args.get('cursor')
+    after = None
+    if cursor:
+        try:
+            after = queries.decode_cursor(cursor)
+        except ValueError:
+            return None, 'Invalid cursor'
+
+    # How total_books is computed
+    count_mode = args.get('count', 'exact')
+    if count_mode not in COUNT_MODES:
+        return None, f"count must be one of {', '.join(COUNT_MODES)}"
+
+    # Text search mode and ordering
+    search = args.get('search', 'substring')
+    if search not in queries.SEARCH_MODES:
+        return None, f"search must be one of {', '.join(queries.SEARCH_MODES)}"
+    sort = args.get('sort', 'downloads')
+    if sort not in SORTS:
+        return None, f"sort must be one of {', '.join(SORTS)}"
+    if after and sort != 'downloads':
+        return None, 'cursor pagination requires sort=downloads'
+
+    # Projection: only these fields of each book, in BOOK_FIELDS order
+    fields = None
+    requested = [field.strip() for value in args.getlist('fields') for field in value.split(',')
+                 if field.strip()]
+    if requested:
+        unknown = [field for field in requested if field not in BOOK_FIELDS]
+        if unknown:
+            return None, f"fields must be a comma-separated subset of {', '.join(BOOK_FIELDS)}"
+        fields = tuple(field for field in BOOK_FIELDS if field in requested)
+
+    # Get filter parameters
+    book_ids, languages, mime_types, topics, authors, titles = _filter_args(args)
+
+    return {
+        'page': page,
+        'per_page': per_page,
+        'cursor': cursor,
+        'after': after,
+        'count': count_mode,
+        'search': search,
+        'sort': sort,
+        # Anything but an exact count falls back to an extra lookahead row
+        # for has_next
+        'lookahead': bool(after) or count_mode != 'exact',
+        'fields': fields,
+        'book_ids': book_ids,
+        'languages': languages,
+        'mime_types': mime_types,
+        'topics': topics,
+        'authors': authors,
+        'titles': titles
+    }, None
+
+
+def books_query_kwargs(params):
+    # get_books_from_db() arguments for parsed /get_books params; with
+    # lookahead one extra row tells whether another page follows
+    return {
+        'page': params['page'],
+        'per_page': params['per_page'],
+        'lookahead': params['lookahead'],
+        'book_ids': params['book_ids'] or None,
+        'languages': params['languages'] or None,
+        'mime_types': params['mime_types'] or None,
+        'topics': params['topics'] or None,
+        'authors': params['authors'] or None,
+        'titles': params['titles'] or None,
+        'after': params['after'],
+        'count': params['count'],
+        'search': params['search'],
+        'sort': params['sort'],
+        'fields': params['fields']
+    }
+
+
+def books_cache_key(params, catalog_version):
+    # Response cache key, or None when responses must not be cached
+    if catalog_version is None or not response_cache.max_size:
+        return None
+    return (catalog_version, params['page'], params['per_page'], params['cursor'],
+            params['count'], params['search'], params['sort'], params['fields'],
+            tuple(params['book_ids']), tuple(params['languages']), tuple(params['mime_types']),
+            tuple(params['topics']), tuple(params['authors']), tuple(params['titles']))
+
+
+def books_response_data(params, total_count, books):
+    # The /get_books response body for one page of hydrated books
+    page = params['page']
+    per_page = params['per_page']
+    after = params['after']
+
+    if params['lookahead']:
+        has_more = len(books) > per_page
+        books = books[:per_page]
+
+    # Format the books data
+    formatted_books = [format_book(book, params['fields']) for book in books]
+
+    # Calculate pagination metadata
+    total_pages = (total_count + per_page - 1) // per_page if total_count is not None else None
+    if after:
+        page = None
+        has_next = has_more
+        has_prev = True
+    else:
+        has_next = has_more if params['lookahead'] else page < total_pages
+        has_prev = page > 1
+
+    next_cursor = None
+    if has_next and books and params['sort'] == 'downloads':
+        last_book = books[-1]
+        next_cursor = queries.encode_cursor(last_book.get('download_count'), last_book['gutenberg_id'])
+
+    return {
+        'total_books': total_count,
+        'books': formatted_books,
+        'filters_applied': {
+            'book_ids': params['book_ids'] or None,
+            'languages': params['languages'] or None,
+            'mime_types': params['mime_types'] or None,
+            'topics': params['topics'] or None,
+            'authors': params['authors'] or None,
+            'titles': params['titles'] or None
+        },
+        'pagination': {
+            'page': page,
+            'per_page': per_page,
+            'total_pages': total_pages,
+            'has_next': has_next,
+            'has_prev': has_prev,
+            'next_page': page + 1 if page and has_next else None,
+            'prev_page': page - 1 if page and has_prev else None,
+            'cursor': params['cursor'],
+            'next_cursor': next_cursor
+        }
+    }
+
+
+def empty_books_response_data(per_page):
+    return {
+        'total_books': 0,
+        'books': [],
+        'filters_applied': {},
+        'pagination': {
+            'page': 1,
+            'per_page': per_page,
+            'total_pages': 0,
+            'has_next': False,
+            'has_prev': False,
+            'next_page': None,
+            'prev_page': None,
+            'cursor': None,
+            'next_cursor': None
+        }
+    }
+
+@app.route('/export/books')
 @swag_from({
     'tags': ['Books'],
-    'summary': 'Get books from Project Gutenberg',
+    'summary': 'Stream every matching book as newline-delimited JSON',
     'parameters': [
         {
-            'name': 'page',
+            'name': 'book_id',
             'in': 'query',
-            'type': 'integer',
-            'default': 1,
-            'description': 'Page number'
+            'type': 'array',
+            'items': {'type': 'integer'},
+            'collectionFormat': 'csv',
+            'description': 'Filter by Gutenberg book IDs'
         },
         {
-            'name': 'per_page',
+            'name': 'language',
             'in': 'query',
-            'type': 'integer',
-            'default': 25,
-            'description': 'Items per page (max 100)'
+            'type': 'array',
+            'items': {'type': 'string'},
+            'collectionFormat': 'csv',
+            'description': 'Filter by language codes (e.g., en,fr)'
         },
+        {
+            'name': 'mime_type',
+            'in': 'query',
+            'type': 'array',
+            'items': {'type': 'string'},
+            'collectionFormat': 'csv',
+            'description': 'Filter by mime types'
+        },
+        {
+            'name': 'topic',
+            'in': 'query',
+            'type': 'array',
+            'items': {'type': 'string'},
+            'collectionFormat': 'csv',
+            'description': 'Filter by topics (searches both subjects and bookshelves)'
+        },
+        {
+            'name': 'author',
+            'in': 'query',
+            'type': 'array',
+            'items': {'type': 'string'},
+            'collectionFormat': 'csv',
+            'description': 'Filter by author names (case-insensitive partial match)'
+        },
+        {
+            'name': 'title',
+            'in': 'query',
+            'type': 'array',
+            'items': {'type': 'string'},
+            'collectionFormat': 'csv',
+            'description': 'Filter by book titles (case-insensitive partial match)'
+        },
+        {
+            'name': 'search',
+            'in': 'query',
+            'type': 'string',
+            'enum': ['substring', 'fulltext'],
+            'default': 'substring',
+            'description': 'How title, author and topic match: partial substring, or whole words (full-text)'
+        }
+    ],
+    'produces': ['application/x-ndjson'],
+    'responses': {
+        '200': {
+            'description': 'One book object per line, in gutenberg_id order, same shape as /get_books books'
+        },
+        '500': {
+            'description': 'The export query could not be started'
+        }
+    }
+})
+def export_books():
+    search = request.args.get('search', 'substring')
+    if search not in queries.SEARCH_MODES:
+        return jsonify({'error': f"search must be one of {', '.join(queries.SEARCH_MODES)}"}), 400
+    book_ids, languages, mime_types, topics, authors, titles = _filter_args(request.args)
+
+    books = export_books_from_db(
+        book_ids=book_ids if book_ids else None,
+        languages=languages if languages else None,
+        mime_types=mime_types if mime_types else None,
+        topics=topics if topics else None,
+        authors=authors if authors else None,
+        titles=titles if titles else None,
+        search=search
+    )
+    # Start the query before committing to a 200 so failures are reported
+    try:
+        first_book = next(books, None)
+    except Exception as e:
+        print(f"Error in export_books: {str(e)}")
+        return jsonify({'error': 'Export failed'}), 500
+
+    def generate():
+        if first_book is None:
+            return
+        yield app.json.dumps(format_book(first_book)) + '\n'
+        for book in books:
+            yield app.json.dumps(format_book(book)) + '\n'
+
+    return app.response_class(generate(), mimetype='application/x-ndjson')
+
+
+@app.route('/books/batch', methods=['POST'])
+@swag_from({
+    'tags': ['Books'],
+    'summary': 'Look up many books by Gutenberg ID in one request',
+    'parameters': [
+        {
+            'name': 'body',
+            'in': 'body',
+            'required': True,
+            'description': 'A JSON list of Gutenberg IDs, or {"ids": [...]}',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'ids': {'type': 'array', 'items': {'type': 'integer'}}
+                }
+            }
+        }
+    ],
+    'responses': {
+        '200': {
+            'description': 'Books keyed by Gutenberg ID, plus the IDs that were not found',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'books': {'type': 'object', 'additionalProperties': {'type': 'object'}},
+                    'missing': {'type': 'array', 'items': {'type': 'integer'}}
+                }
+            }
+        },
+        '400': {
+            'description': 'The body is not a list of integer IDs or has too many of them'
+        },
+        '500': {
+            'description': 'The lookup query failed'
+        }
+    }
+})
+def get_books_batch():
+    payload = request.get_json(silent=True)
+    if isinstance(payload, dict):
+        payload = payload.get('ids')
+    if not isinstance(payload, list) or not all(
+            isinstance(book_id, int) and not isinstance(book_id, bool) for book_id in payload):
+        return jsonify({'error': 'Expected a JSON list of integer book IDs'}), 400
+    if len(payload) > BATCH_MAX_IDS:
+        return jsonify({'error': f"At most {BATCH_MAX_IDS} IDs per request"}), 400
+
+    # Keep the caller's order, without duplicates
+    book_ids = list(dict.fromkeys(payload))
+    try:
+        books = get_books_by_ids(book_ids) if book_ids else {}
+    except Exception as e:
+        print(f"Error in get_books_batch: {str(e)}")
+        return jsonify({'error': 'Lookup failed'}), 500
+
+    return jsonify({
+        'books': {str(book_id): format_book(books[book_id]) for book_id in book_ids if book_id in books},
+        'missing': [book_id for book_id in book_ids if book_id not in books]
+    })
+
+
+@app.route('/facets')
+@swag_from({
+    'tags': ['Books'],
+    'summary': 'Counts per language, mime type, bookshelf, subject and author for a filter set',
+    'parameters': [
         {
             'name': 'book_id',
             'in': 'query',
@@ -387,161 +1330,157 @@ def get_books_from_db(page=1, per_page=25, book_ids=None, languages=None, mime_t
             'items': {'type': 'string'},
             'collectionFormat': 'csv',
             'description': 'Filter by book titles (case-insensitive partial match)'
+        },
+        {
+            'name': 'search',
+            'in': 'query',
+            'type': 'string',
+            'enum': ['substring', 'fulltext'],
+            'default': 'substring',
+            'description': 'How title, author and topic match: partial substring, or whole words (full-text)'
+        },
+        {
+            'name': 'facet_limit',
+            'in': 'query',
+            'type': 'integer',
+            'default': 20,
+            'description': 'Values returned per facet, most books first (max 100)'
         }
     ],
     'responses': {
         '200': {
-            'description': 'Successful response',
+            'description': 'Matching book count and per-facet value counts',
             'schema': {
                 'type': 'object',
                 'properties': {
                     'total_books': {'type': 'integer'},
-                    'books': {
-                        'type': 'array',
-                        'items': {
-                            'type': 'object',
-                            'properties': {
-                                'title': {'type': 'string'},
-                                'gutenberg_id': {'type': 'integer'},
-                                'author': {
-                                    'type': 'object',
-                                    'properties': {
-                                        'name': {'type': 'string'},
-                                        'birth_year': {'type': 'integer'},
-                                        'death_year': {'type': 'integer'},
-                                        'id': {'type': 'integer'}
-                                    }
-                                },
-                                'language': {'type': 'string'},
-                                'subjects': {'type': 'array', 'items': {'type': 'string'}},
-                                'bookshelves': {'type': 'array', 'items': {'type': 'string'}},
-                                'download_links': {
-                                    'type': 'array',
-                                    'items': {
-                                        'type': 'object',
-                                        'properties': {
-                                            'mime_type': {'type': 'string'},
-                                            'url': {'type': 'string'}
-                                        }
-                                    }
+                    'facets': {
+                        'type': 'object',
+                        'additionalProperties': {
+                            'type': 'array',
+                            'items': {
+                                'type': 'object',
+                                'properties': {
+                                    'value': {'type': 'string'},
+                                    'count': {'type': 'integer'}
                                 }
                             }
                         }
                     },
-                    'pagination': {
-                        'type': 'object',
-                        'properties': {
-                            'page': {'type': 'integer'},
-                            'per_page': {'type': 'integer'},
-                            'total_pages': {'type': 'integer'},
-                            'has_next': {'type': 'boolean'},
-                            'has_prev': {'type': 'boolean'}
-                        }
-                    }
+                    'filters_applied': {'type': 'object'}
                 }
             }
+        },
+        '500': {
+            'description': 'The facet index could not be loaded'
         }
     }
 })
+def get_facets():
+    search = request.args.get('search', 'substring')
+    if search not in queries.SEARCH_MODES:
+        return jsonify({'error': f"search must be one of {', '.join(queries.SEARCH_MODES)}"}), 400
+    limit = min(max(1, request.args.get('facet_limit', 20, type=int)), 100)
+    book_ids, languages, mime_types, topics, authors, titles = _filter_args(request.args)
 
+    try:
+        index = facet_store.get(catalog.current_version())
 
+        # Exact filters are bitmap operations; text filters come from the
+        # database as one id list
+        matching = index.all
+        if book_ids:
+            matching &= index.bitmap(book_ids)
+        if languages:
+            matching &= index.union('languages', languages)
+        if mime_types:
+            matching &= index.union('mime_types', mime_types)
+        if topics or authors or titles:
+            matching &= index.bitmap(get_text_match_ids(topics, authors, titles, search))
 
+        return jsonify({
+            'total_books': index.count(matching),
+            'facets': index.counts(matching, limit),
+            'filters_applied': {
+                'book_ids': book_ids or None,
+                'languages': languages or None,
+                'mime_types': mime_types or None,
+                'topics': topics or None,
+                'authors': authors or None,
+                'titles': titles or None
+            }
+        })
+    except Exception as e:
+        print(f"Error in get_facets: {str(e)}")
+        return jsonify({'error': 'Facets unavailable'}), 500
 
 
-def get_books():
-    try:
-        # Get and validate pagination parameters
-        page = max(1, request.args.get('page', 1, type=int))
-        per_page = min(max(1, request.args.get('per_page', 25, type=int)), 100)
-
-        # Get filter parameters
-        book_ids = request.args.getlist('book_id', type=int)
-        languages = request.args.getlist('language')
-        mime_types = request.args.getlist('mime_type')
-        topics = request.args.getlist('topic')
-        authors = request.args.getlist('author')
-        titles = request.args.getlist('title')
-
-        # Split comma-separated values
-        languages = [lang for langs in languages for lang in langs.split(',')]
-        mime_types = [mime for mimes in mime_types for mime in mimes.split(',')]
-        topics = [topic.strip() for topics_list in topics for topic in topics_list.split(',')]
-        authors = [author.strip() for authors_list in authors for author in authors_list.split(',')]
-        titles = [title.strip() for titles_list in titles for title in titles_list.split(',')]
+def _filter_args(args):
+    # Filter query parameters shared by /get_books, /export/books and /facets, with
+    # comma-separated values split out
+    book_ids = args.getlist('book_id', type=int)
+    languages = args.getlist('language')
+    mime_types = args.getlist('mime_type')
+    topics = args.getlist('topic')
+    authors = args.getlist('author')
+    titles = args.getlist('title')
 
-        # Get filtered books
-        total_count, books = get_books_from_db(
-            page=page,
-            per_page=per_page,
-            book_ids=book_ids if book_ids else None,
-            languages=languages if languages else None,
-            mime_types=mime_types if mime_types else None,
-            topics=topics if topics else None,
-            authors=authors if authors else None,
-            titles=titles if titles else None
-        )
-
-        # Format the books data
-        formatted_books = []
-        for book in books:
-            formatted_book = {
-                'title': book['title'],
-                'gutenberg_id': book['gutenberg_id'],
-                'author': book['author_info'],
-                'language': book['language'],
-                'subjects': [s.strip() for s in book['subjects'].split(',')] if book['subjects'] else [],
-                'bookshelves': [b.strip() for b in book['bookshelves'].split(',')] if book['bookshelves'] else [],
-                'download_links': book['download_links'] if book['download_links'] else []
-            }
-            formatted_books.append(formatted_book)
+    # Split comma-separated values
+    languages = [lang for langs in languages for lang in langs.split(',')]
+    mime_types = [mime for mimes in mime_types for mime in mimes.split(',')]
+    topics = [topic.strip() for topics_list in topics for topic in topics_list.split(',')]
+    authors = [author.strip() for authors_list in authors for author in authors_list.split(',')]
+    titles = [title.strip() for titles_list in titles for title in titles_list.split(',')]
 
-        # Calculate pagination metadata
-        total_pages = (total_count + per_page - 1) // per_page
-        has_next = page < total_pages
-        has_prev = page > 1
+    return book_ids, languages, mime_types, topics, authors, titles
 
-        response_data = {
-            'total_books': total_count,
-            'books': formatted_books,
-            'filters_applied': {
-                'book_ids': book_ids if book_ids else None,
-                'languages': languages if languages else None,
-                'mime_types': mime_types if mime_types else None,
-                'topics': topics if topics else None,
-                'authors': authors if authors else None,
-                'titles': titles if titles else None
-            },
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total_pages': total_pages,
-                'has_next': has_next,
-                'has_prev': has_prev,
-                'next_page': page + 1 if has_next else None,
-                'prev_page': page - 1 if has_prev else None
-            }
-        }
-        
-        return jsonify(response_data)
 
-    except Exception as e:
-        # Log the error for debugging
-        print(f"Error in get_books: {str(e)}")
-        # Return empty result set instead of error
-        return jsonify({
-            'total_books': 0,
-            'books': [],
-            'filters_applied': {},
-            'pagination': {
-                'page': 1,
-                'per_page': per_page,
-                'total_pages': 0,
-                'has_next': False,
-                'has_prev': False,
-                'next_page': None,
-                'prev_page': None
-            }
-        }), 200  # Return 200 even for empty results
+_LIST_FIELDS = ('authors', 'languages', 'subjects', 'bookshelves', 'download_links')
+
+def format_book(book, fields=None):
+    # Shape a hydrated row (queries.HYDRATE_COLUMNS) as an API book, with
+    # only `fields` when given. The lists arrive as native arrays from SQL
+    # and are passed through untouched.
+    formatted = {}
+    for field in fields or BOOK_FIELDS:
+        value = book[BOOK_FIELDS[field]]
+        formatted[field] = (value or []) if field in _LIST_FIELDS else value
+    return formatted
+
+
+def books_etag(cache_key):
+    # Strong: the body is fully determined by the catalog version and request
+    return hashlib.sha1(repr(cache_key).encode()).hexdigest()
+
+
+def cache_headers(etag):
+    # Vary goes on 304s too, so a cache revalidating a compressed copy keeps
+    # it for the encoding it was negotiated for
+    return {
+        'ETag': f'"{etag}"',
+        'Cache-Control': f'public, max-age={RESPONSE_MAX_AGE}',
+        'Vary': 'Accept-Encoding'
+    }
+
+
+def _cacheable(response, etag):
+    response.headers.update(cache_headers(etag))
+    return response
+
+
+def not_modified(if_none_match, etag):
+    # Whether a conditional request already has this body, in any encoding
+    return if_none_match.star_tag or any(
+        if_none_match.contains_weak(tag) for tag in compression.etag_variants(etag))
+
+
+def _compressed(response, etag, body):
+    # A cacheable /get_books response, in the client's encoding; compressed
+    # variants are made once and kept with the cached body
+    _cacheable(response, etag)
+    with metrics.phase('compress'):
+        return compressor.apply(response, request.headers.get('Accept-Encoding'), body)
+
 
 @app.route('/')
 @swag_from({
@@ -568,12 +1507,171 @@ def index():
         if not DATABASE_URL:
             return "DATABASE_URL not found", 500
             
-        connection = psycopg2.connect(DATABASE_URL)
-        cursor = connection.cursor()
-        cursor.execute('SELECT 1')
-        cursor.close()
-        connection.close()
+        with pool.connection() as connection:
+            cursor = connection.cursor()
+            cursor.execute('SELECT 1')
+            cursor.close()
         return "Database connection successful!"
 
+@app.route('/livez')
+@swag_from({
+    'tags': ['Health Check'],
+    'summary': 'Liveness probe; answers without touching the database',
+    'responses': {
+        '200': {
+            'description': 'The worker process is serving requests',
+            'schema': {
+                'type': 'string'
+            }
+        }
+    }
+})
+def livez():
+    return app.response_class('OK', mimetype='text/plain', headers={'Cache-Control': 'no-store'})
+
+@app.route('/readyz')
+@swag_from({
+    'tags': ['Health Check'],
+    'summary': 'Readiness probe: database round trip and pool saturation',
+    'description': 'The database is probed on a pooled connection at most once per READYZ_INTERVAL '
+                   'seconds; other requests get the last result. Answers within READYZ_TIMEOUT seconds.',
+    'responses': {
+        '200': {
+            'description': 'The database answered the last probe',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'status': {'type': 'string', 'enum': ['ready', 'unavailable']},
+                    'cached': {'type': 'boolean'},
+                    'checked_seconds_ago': {'type': 'number'},
+                    'latency_ms': {'type': 'number'},
+                    'pool': {
+                        'type': 'object',
+                        'description': 'Primary pool size, idle, in_use, max_size, saturation and timeouts'
+                    },
+                    'error': {'type': 'string'}
+                }
+            }
+        },
+        '503': {
+            'description': 'The last probe failed or did not answer in time; same body'
+        }
+    }
+})
+def readyz():
+    ready, report = readiness.check()
+    response = jsonify(report)
+    response.status_code = 200 if ready else 503
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@app.route('/pool_stats')
+@swag_from({
+    'tags': ['Health Check'],
+    'summary': 'Connection pool statistics for this worker process',
+    'responses': {
+        '200': {
+            'description': 'Current pool size, usage and lifetime counters',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'pid': {'type': 'integer'},
+                    'min_size': {'type': 'integer'},
+                    'max_size': {'type': 'integer'},
+                    'size': {'type': 'integer'},
+                    'idle': {'type': 'integer'},
+                    'in_use': {'type': 'integer'},
+                    'saturation': {'type': 'number'},
+                    'checkouts': {'type': 'integer'},
+                    'timeouts': {'type': 'integer'},
+                    'connections_opened': {'type': 'integer'},
+                    'connections_discarded': {'type': 'integer'},
+                    'wait_seconds_total': {'type': 'number'},
+                    'read_replicas': {
+                        'type': 'object',
+                        'description': 'Read routing policy, primary fallbacks and per-replica health, lag, latency and pool'
+                    }
+                }
+            }
+        }
+    }
+})
+def pool_stats():
+    return jsonify(dict(pool.stats(), read_replicas=read_pool.stats()))
+
+@app.route('/cache_stats')
+@swag_from({
+    'tags': ['Health Check'],
+    'summary': 'Response and count cache statistics for this worker process',
+    'responses': {
+        '200': {
+            'description': 'Catalog version and per-cache size, hit, miss and eviction counters',
+            'schema': {
+                'type': 'object',
+                'properties': {
+                    'catalog_version': {'type': 'integer'},
+                    'responses': {'type': 'object'},
+                    'counts': {'type': 'object'}
+                }
+            }
+        }
+    }
+})
+def cache_stats():
+    return jsonify({
+        'catalog_version': catalog.current_version(),
+        'responses': response_cache.stats(),
+        'counts': count_cache.stats()
+    })
+
+@app.route('/metrics')
+@swag_from({
+    'tags': ['Health Check'],
+    'summary': 'Prometheus metrics for this worker process',
+    'produces': ['text/plain'],
+    'responses': {
+        '200': {
+            'description': '/get_books latency histograms by filter shape and phase, plus pool and cache statistics'
+        }
+    }
+})
+def prometheus_metrics():
+    extra = metrics.render_stats(
+        'gutenberg_db_pool', [({}, dict(pool.stats(), pid=None))], 'Connection pool',
+        counters=('checkouts', 'timeouts', 'connections_opened', 'connections_discarded',
+                  'wait_seconds_total'))
+    read_stats = read_pool.stats()
+    extra += metrics.render_stats(
+        'gutenberg_db_read', [({}, read_stats)], 'Read routing', counters=('primary_checkouts',))
+    extra += metrics.render_stats(
+        'gutenberg_db_replica',
+        [({'replica': replica['replica']}, dict(replica, healthy=int(replica['healthy'])))
+         for replica in read_stats['replicas']],
+        'Read replica', counters=('checkouts', 'errors', 'error_ejections', 'lag_ejections'))
+    extra += metrics.render_stats(
+        'gutenberg_db_replica_pool',
+        [({'replica': replica['replica']}, dict(replica['pool'], pid=None))
+         for replica in read_stats['replicas']],
+        'Read replica connection pool',
+        counters=('checkouts', 'timeouts', 'connections_opened', 'connections_discarded',
+                  'wait_seconds_total'))
+    extra += metrics.render_stats(
+        'gutenberg_readiness', [({}, readiness.stats())], 'Readiness probe',
+        counters=('probes', 'failures', 'cached', 'timeouts'))
+    extra += metrics.render_stats(
+        'gutenberg_cache', [({'cache': 'responses'}, response_cache.stats()),
+                            ({'cache': 'counts'}, count_cache.stats())],
+        'Cache', counters=('hits', 'misses', 'evictions', 'expirations'))
+    extra += metrics.render_stats(
+        'gutenberg_compression', [({}, compressor.stats())], 'Response compression',
+        counters=('compressed', 'reused', 'bytes_in', 'bytes_out'))
+    extra += metrics.render_stats(
+        'gutenberg_prepared_statements', [({}, prepared_statements.stats())],
+        'Prepared statement cache', counters=('hits', 'misses', 'evictions', 'invalidations'))
+    extra += metrics.render_stats(
+        'gutenberg_slow_queries', [({}, slow_queries.stats())], 'Slow query log',
+        counters=('slow', 'sampled_out', 'dropped', 'logged', 'explain_errors'))
+    return app.response_class(metrics.render(extra), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,111 @@
+# Server-side prepared statements for the /get_books queries.
+#
+# The SQL text of a count or page query depends only on its shape (which
+# filters are present, the search mode and sort order), never on the filter
+# values, which are always bound parameters. Each pooled connection PREPAREs
+# a shape the first time it runs it and EXECUTEs it afterwards, so Postgres
+# parses and analyzes it once per connection and may switch to a cached
+# generic plan (see plan_cache_mode) instead of planning every request.
+
+import hashlib
+import re
+import threading
+import weakref
+from collections import OrderedDict
+
+import psycopg2
+
+
+_PLACEHOLDER = re.compile(r'%([s%])')
+
+
+def to_server_placeholders(query):
+    """Return (sql, count): psycopg2 "%s" placeholders numbered $1, $2, ..."""
+    count = 0
+
+    def replace(match):
+        nonlocal count
+        if match.group(1) == '%':
+            return '%'
+        count += 1
+        return f"${count}"
+
+    return _PLACEHOLDER.sub(replace, query), count
+
+
+def statement_name(query):
+    # Same shape, same name, on every connection and in every process
+    return 'books_' + hashlib.sha1(query.encode()).hexdigest()[:16]
+
+
+class PreparedStatements:
+    """Per-connection LRU of prepared statements, keyed by SQL text.
+
+    execute() is a drop-in for cursor.execute(). Each connection keeps at
+    most `max_per_connection` statements; the least recently used one is
+    DEALLOCATEd to make room. Statements survive rollbacks, so the pool can
+    reset connections freely. Disable (enabled=False) behind a transaction-
+    pooling proxy such as pgbouncer, where a session may change under us.
+    """
+
+    def __init__(self, max_per_connection=64, enabled=True):
+        self.max_per_connection = max_per_connection
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        # connection -> OrderedDict of prepared statement names
+        self._connections = weakref.WeakKeyDictionary()
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def execute(self, cursor, query, params=()):
+        params = list(params or ())
+        if not self.enabled or query.lstrip().upper().startswith('EXPLAIN'):
+            # EXPLAIN (count=estimate) cannot be prepared
+            cursor.execute(query, params)
+            return
+
+        sql, count = to_server_placeholders(query)
+        if count != len(params):
+            cursor.execute(query, params)
+            return
+
+        name = statement_name(query)
+        connection = cursor.connection
+        with self._lock:
+            statements = self._connections.setdefault(connection, OrderedDict())
+            prepared = name in statements
+            if prepared:
+                statements.move_to_end(name)
+                self._counters['hits'] += 1
+            else:
+                self._counters['misses'] += 1
+                evicted = []
+                while len(statements) >= self.max_per_connection > 0:
+                    evicted.append(statements.popitem(last=False)[0])
+                self._counters['evictions'] += len(evicted)
+
+        if not prepared:
+            for old_name in evicted:
+                cursor.execute(f"DEALLOCATE {old_name}")
+            cursor.execute(f"PREPARE {name} AS {sql}")
+            with self._lock:
+                statements[name] = None
+
+        arguments = f" ({', '.join(['%s'] * count)})" if count else ''
+        try:
+            cursor.execute(f"EXECUTE {name}{arguments}", params)
+        except psycopg2.errors.InvalidSqlStatementName:
+            # Deallocated behind our back (DISCARD ALL, a proxy switching
+            # sessions): forget this connection's statements
+            with self._lock:
+                self._connections.pop(connection, None)
+                self._counters['invalidations'] += 1
+            raise
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats['connections'] = len(self._connections)
+            stats['prepared'] = sum(len(statements) for statements in self._connections.values())
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_ratio'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+        return stats
@@ -0,0 +1,446 @@
+# SQL builders for the "page ids first, hydrate second" query strategy.
+#
+# Filters are expressed as EXISTS semi-joins against books_book, so selecting
+# and counting a page never multiplies rows by a book's authors, subjects,
+# bookshelves or formats. Only the books on the requested page are then
+# hydrated with per-relation aggregates.
+
+import base64
+import json
+
+
+def order_by(alias='bb'):
+    # gutenberg_id breaks download_count ties so keyset pagination is stable;
+    # served by migrations/0001_books_book_download_order_index.sql
+    return f"{alias}.download_count DESC NULLS LAST, {alias}.gutenberg_id DESC"
+
+
+ORDER_BY = order_by()
+
+
+# "substring" keeps the case-insensitive partial matching of LIKE '%term%'
+# (served by the pg_trgm GIN indexes); "fulltext" matches whole words
+# through the search_tsv columns. See migrations/0002_text_search_indexes.sql.
+SEARCH_MODES = ('substring', 'fulltext')
+
+
+def like_patterns(terms):
+    """LIKE patterns matching any of `terms` as a case-insensitive substring."""
+    return [f"%{term.lower()}%" for term in terms]
+
+
+def _tsquery(terms):
+    # Terms are alternatives, like the OR'ed LIKE patterns of substring mode.
+    # Each one goes through plainto_tsquery on its own, so its words are
+    # matched literally: "-", quotes and "or" in a term are not operators.
+    return '(' + ' || '.join(["plainto_tsquery('simple', %s)"] * len(terms)) + ')', list(terms)
+
+
+def _text_match(column, tsv_column, terms, search):
+    if search == 'fulltext':
+        tsquery, params = _tsquery(terms)
+        return f"{tsv_column} @@ {tsquery}", params
+    return f"LOWER({column}) LIKE ANY(%s)", [like_patterns(terms)]
+
+
+def build_filter_conditions(book_ids=None, languages=None, mime_types=None,
+                            topics=None, authors=None, titles=None, search='substring'):
+    """Return (conditions, params) restricting books_book as bb."""
+    conditions = []
+    params = []
+
+    if book_ids:
+        conditions.append("bb.gutenberg_id = ANY(%s)")
+        params.append(book_ids)
+
+    if languages:
+        conditions.append("""
+            EXISTS (
+                SELECT 1 FROM books_book_languages AS bbl
+                JOIN books_language AS bl ON bl.id = bbl.language_id
+                WHERE bbl.book_id = bb.gutenberg_id AND bl.code = ANY(%s)
+            )""")
+        params.append(languages)
+
+    if mime_types:
+        conditions.append("""
+            EXISTS (
+                SELECT 1 FROM books_format AS bf
+                WHERE bf.book_id = bb.gutenberg_id AND bf.mime_type = ANY(%s)
+            )""")
+        params.append(mime_types)
+
+    if topics:
+        subject_match, subject_params = _text_match('bs.name', 'bs.search_tsv', topics, search)
+        shelf_match, shelf_params = _text_match('bbk.name', 'bbk.search_tsv', topics, search)
+        conditions.append(f"""
+            (EXISTS (
+                SELECT 1 FROM books_book_subjects AS bbs
+                JOIN books_subject AS bs ON bs.id = bbs.subject_id
+                WHERE bbs.book_id = bb.gutenberg_id AND {subject_match}
+            ) OR EXISTS (
+                SELECT 1 FROM books_book_bookshelves AS bbb
+                JOIN books_bookshelf AS bbk ON bbk.id = bbb.bookshelf_id
+                WHERE bbb.book_id = bb.gutenberg_id AND {shelf_match}
+            ))""")
+        params.extend(subject_params + shelf_params)
+
+    if authors:
+        author_match, author_params = _text_match('ba.name', 'ba.search_tsv', authors, search)
+        conditions.append(f"""
+            EXISTS (
+                SELECT 1 FROM books_book_authors AS bba
+                JOIN books_author AS ba ON ba.id = bba.author_id
+                WHERE bba.book_id = bb.gutenberg_id AND {author_match}
+            )""")
+        params.extend(author_params)
+
+    if titles:
+        title_match, title_params = _text_match('bb.title', 'bb.search_tsv', titles, search)
+        conditions.append(title_match)
+        params.extend(title_params)
+
+    return conditions, params
+
+
+def _rank(column, tsv_column, terms, search):
+    if search == 'fulltext':
+        tsquery, params = _tsquery(terms)
+        return f"ts_rank({tsv_column}, {tsquery})", params
+    # pg_trgm: how well the best term matches some part of the column
+    return (f"(SELECT MAX(word_similarity(t, LOWER({column}))) FROM unnest(%s::text[]) AS t)",
+            [[term.lower() for term in terms]])
+
+
+def build_rank_expression(topics=None, authors=None, titles=None, search='substring', **_):
+    """Return (expression, params) scoring a book against its text filters.
+
+    Returns (None, []) when there are no text filters to rank by.
+    """
+    parts = []
+    params = []
+
+    if titles:
+        rank, rank_params = _rank('bb.title', 'bb.search_tsv', titles, search)
+        parts.append(rank)
+        params.extend(rank_params)
+
+    if authors:
+        rank, rank_params = _rank('ba.name', 'ba.search_tsv', authors, search)
+        parts.append(f"""(
+            SELECT MAX({rank}) FROM books_book_authors AS bba
+            JOIN books_author AS ba ON ba.id = bba.author_id
+            WHERE bba.book_id = bb.gutenberg_id
+        )""")
+        params.extend(rank_params)
+
+    if topics:
+        subject_rank, subject_params = _rank('bs.name', 'bs.search_tsv', topics, search)
+        shelf_rank, shelf_params = _rank('bbk.name', 'bbk.search_tsv', topics, search)
+        parts.append(f"""GREATEST(
+            (SELECT MAX({subject_rank}) FROM books_book_subjects AS bbs
+             JOIN books_subject AS bs ON bs.id = bbs.subject_id
+             WHERE bbs.book_id = bb.gutenberg_id),
+            (SELECT MAX({shelf_rank}) FROM books_book_bookshelves AS bbb
+             JOIN books_bookshelf AS bbk ON bbk.id = bbb.bookshelf_id
+             WHERE bbb.book_id = bb.gutenberg_id)
+        )""")
+        params.extend(subject_params + shelf_params)
+
+    if not parts:
+        return None, []
+    return " + ".join(f"COALESCE({part}, 0)" for part in parts), params
+
+
+def encode_cursor(download_count, gutenberg_id):
+    """Opaque keyset cursor pointing just after the given book."""
+    payload = json.dumps([download_count, gutenberg_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return (download_count, gutenberg_id); raise ValueError if malformed."""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        download_count, gutenberg_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"invalid cursor: {cursor!r}") from e
+    if not isinstance(gutenberg_id, int) or not (download_count is None or isinstance(download_count, int)):
+        raise ValueError(f"invalid cursor: {cursor!r}")
+    return download_count, gutenberg_id
+
+
+def build_keyset_condition(after, alias='bb'):
+    """Return (condition, params) selecting the books that sort after `after`."""
+    download_count, gutenberg_id = after
+    if download_count is None:
+        # Already in the NULLS LAST tail
+        return f"({alias}.download_count IS NULL AND {alias}.gutenberg_id < %s)", [gutenberg_id]
+    return (
+        f"(({alias}.download_count, {alias}.gutenberg_id) < (%s, %s) OR {alias}.download_count IS NULL)",
+        [download_count, gutenberg_id]
+    )
+
+
+def filter_key(filters):
+    """Canonical, hashable form of a filter dict for cache keys.
+
+    Value order, duplicates and the case of text search terms don't change
+    which books match, so they don't change the key either.
+    """
+    key = []
+    for name in sorted(filters):
+        values = filters[name]
+        if not values:
+            continue
+        if name in ('topics', 'authors', 'titles'):
+            values = [value.lower() for value in values]
+        key.append((name, tuple(sorted(set(values)))))
+    return tuple(key)
+
+
+def where_clause(conditions):
+    if not conditions:
+        return ""
+    return " WHERE " + " AND ".join(conditions)
+
+
+# Total of the filtered rows, computed before LIMIT/OFFSET apply, so a page
+# query can carry the count instead of a second statement running the same
+# filters (models.COUNT_EXECUTION = "window")
+WINDOW_COUNT_COLUMN = ", COUNT(*) OVER () AS total_count"
+
+
+def build_count_query(conditions):
+    return "SELECT COUNT(*) AS count FROM books_book AS bb" + where_clause(conditions)
+
+
+def build_ids_query(conditions):
+    """Every matching gutenberg_id, unordered (for in-memory set operations)."""
+    return "SELECT bb.gutenberg_id FROM books_book AS bb" + where_clause(conditions)
+
+
+def build_estimate_query(conditions, table='books_book AS bb'):
+    return f"EXPLAIN (FORMAT JSON) SELECT 1 FROM {table}" + where_clause(conditions)
+
+
+def plan_rows(plan):
+    """Top-level row estimate from EXPLAIN (FORMAT JSON) output."""
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def build_page_ids_query(conditions, rank=None, window_count=False):
+    """Select one page of gutenberg_ids; takes LIMIT and OFFSET as the last params.
+
+    With a rank expression its params come first and the page is ordered by
+    relevance, then by the usual download order. With window_count every row
+    also carries the number of matching books as total_count.
+    """
+    columns = "bb.gutenberg_id, bb.download_count"
+    if window_count:
+        columns += WINDOW_COUNT_COLUMN
+    order_by = ORDER_BY
+    if rank:
+        columns += f", {rank} AS rank"
+        order_by = "rank DESC, " + ORDER_BY
+    return (
+        f"SELECT {columns} FROM books_book AS bb"
+        + where_clause(conditions)
+        + f" ORDER BY {order_by} LIMIT %s OFFSET %s"
+    )
+
+
+# Per-book aggregates, each a correlated subquery over one relation so the
+# cost is proportional to that book's rows in that relation only.
+# author_info and language are a book's first author (by id) and language
+# (by code); authors and languages list all of them in the same order.
+HYDRATE_EXPRESSIONS = {
+    'title': "bb.title",
+    'gutenberg_id': "bb.gutenberg_id",
+    'download_count': "bb.download_count",
+    'author_info': """(
+        SELECT json_build_object(
+            'name', ba.name,
+            'birth_year', ba.birth_year,
+            'death_year', ba.death_year,
+            'id', ba.id
+        )
+        FROM books_book_authors AS bba
+        JOIN books_author AS ba ON ba.id = bba.author_id
+        WHERE bba.book_id = bb.gutenberg_id
+        ORDER BY ba.id
+        LIMIT 1
+    )""",
+    'authors': """(
+        SELECT json_agg(
+            json_build_object(
+                'name', ba.name,
+                'birth_year', ba.birth_year,
+                'death_year', ba.death_year,
+                'id', ba.id
+            )
+            ORDER BY ba.id
+        )
+        FROM books_book_authors AS bba
+        JOIN books_author AS ba ON ba.id = bba.author_id
+        WHERE bba.book_id = bb.gutenberg_id
+    )""",
+    'language': """(
+        SELECT bl.code
+        FROM books_book_languages AS bbl
+        JOIN books_language AS bl ON bl.id = bbl.language_id
+        WHERE bbl.book_id = bb.gutenberg_id
+        ORDER BY bl.code
+        LIMIT 1
+    )""",
+    'languages': """ARRAY(
+        SELECT bl.code
+        FROM books_book_languages AS bbl
+        JOIN books_language AS bl ON bl.id = bbl.language_id
+        WHERE bbl.book_id = bb.gutenberg_id
+        ORDER BY bl.code
+    )""",
+    'subjects': """ARRAY(
+        SELECT bs.name
+        FROM books_book_subjects AS bbs
+        JOIN books_subject AS bs ON bs.id = bbs.subject_id
+        WHERE bbs.book_id = bb.gutenberg_id
+        ORDER BY bs.name
+    )""",
+    'bookshelves': """ARRAY(
+        SELECT bbk.name
+        FROM books_book_bookshelves AS bbb
+        JOIN books_bookshelf AS bbk ON bbk.id = bbb.bookshelf_id
+        WHERE bbb.book_id = bb.gutenberg_id
+        ORDER BY bbk.name
+    )""",
+    'download_links': """(
+        SELECT json_agg(
+            json_build_object('mime_type', bf.mime_type, 'url', bf.url)
+            ORDER BY bf.mime_type, bf.url
+        )
+        FROM books_format AS bf
+        WHERE bf.book_id = bb.gutenberg_id
+    )""",
+}
+
+# Row columns always hydrated: the id, and download_count for keyset cursors
+KEY_COLUMNS = ('gutenberg_id', 'download_count')
+
+
+def hydrate_columns(columns=None):
+    """Select list hydrating `columns` (keys of HYDRATE_EXPRESSIONS), or every column.
+
+    Each aggregate that is left out is a subquery Postgres never runs.
+    """
+    if columns is None:
+        names = list(HYDRATE_EXPRESSIONS)
+    else:
+        names = [name for name in HYDRATE_EXPRESSIONS if name in KEY_COLUMNS or name in columns]
+    return ",\n".join(f"{HYDRATE_EXPRESSIONS[name]} AS {name}" for name in names)
+
+
+HYDRATE_COLUMNS = hydrate_columns()
+
+
+def build_two_phase_page_query(conditions, rank=None, window_count=False, columns=None):
+    """Select a page of ids and hydrate only those books, in one statement.
+
+    Takes the rank params (if any), the filter params, then LIMIT and OFFSET.
+    Filters live in the id subquery, so `columns` (see hydrate_columns())
+    only decides what is hydrated, never which books match.
+    """
+    order_by = ("page.rank DESC, " + ORDER_BY) if rank else ORDER_BY
+    columns = hydrate_columns(columns) + (", page.total_count" if window_count else "")
+    return (
+        "SELECT " + columns
+        + " FROM (" + build_page_ids_query(conditions, rank, window_count) + ") AS page"
+        + " JOIN books_book AS bb ON bb.gutenberg_id = page.gutenberg_id"
+        + f" ORDER BY {order_by}"
+    )
+
+
+def build_export_query(conditions):
+    """Every matching book, hydrated, in gutenberg_id order."""
+    return (
+        "SELECT " + HYDRATE_COLUMNS + " FROM books_book AS bb"
+        + where_clause(conditions)
+        + " ORDER BY bb.gutenberg_id"
+    )
+
+
+def build_lookup_query():
+    """Hydrate the books whose ids are given as the only param."""
+    return "SELECT " + HYDRATE_COLUMNS + " FROM books_book AS bb WHERE bb.gutenberg_id = ANY(%s)"
+
+
+# Precomputed documents (migrations/0003_book_documents.sql): every filter is
+# a column of book_documents, so a page is a single-table scan.
+
+def build_document_conditions(book_ids=None, languages=None, mime_types=None,
+                              topics=None, authors=None, titles=None):
+    """Return (conditions, params) restricting book_documents as bd."""
+    conditions = []
+    params = []
+
+    if book_ids:
+        conditions.append("bd.gutenberg_id = ANY(%s)")
+        params.append(book_ids)
+
+    if languages:
+        conditions.append("bd.languages && %s::text[]")
+        params.append(languages)
+
+    if mime_types:
+        conditions.append("bd.mime_types && %s::text[]")
+        params.append(mime_types)
+
+    if topics:
+        conditions.append("bd.topics_lower LIKE ANY(%s)")
+        params.append(like_patterns(topics))
+
+    if authors:
+        conditions.append("bd.authors_lower LIKE ANY(%s)")
+        params.append(like_patterns(authors))
+
+    if titles:
+        conditions.append("bd.title_lower LIKE ANY(%s)")
+        params.append(like_patterns(titles))
+
+    return conditions, params
+
+
+def build_document_count_query(conditions):
+    return "SELECT COUNT(*) AS count FROM book_documents AS bd" + where_clause(conditions)
+
+
+def build_document_page_query(conditions, window_count=False, columns=None):
+    """Takes the filter params followed by LIMIT and OFFSET.
+
+    With `columns`, the other document keys are dropped before the rows are sent.
+    """
+    document = "bd.document"
+    if columns is not None:
+        dropped = [name for name in HYDRATE_EXPRESSIONS if name not in KEY_COLUMNS and name not in columns]
+        if dropped:
+            document = f"bd.document - '{{{','.join(dropped)}}}'::text[] AS document"
+    columns = document + (WINDOW_COUNT_COLUMN if window_count else "")
+    return (
+        f"SELECT {columns} FROM book_documents AS bd"
+        + where_clause(conditions)
+        + f" ORDER BY {order_by('bd')} LIMIT %s OFFSET %s"
+    )
+
+
+def build_document_export_query(conditions):
+    return (
+        "SELECT bd.document FROM book_documents AS bd"
+        + where_clause(conditions)
+        + " ORDER BY bd.gutenberg_id"
+    )
+
+
+def build_document_lookup_query():
+    return "SELECT bd.document FROM book_documents AS bd WHERE bd.gutenberg_id = ANY(%s)"
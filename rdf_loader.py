@@ -0,0 +1,295 @@
+"""Build the books_* tables from the Project Gutenberg RDF catalog.
+
+    python -m rdf_loader --database-url postgresql://... rdf-files.tar.bz2
+
+The input is the RDF/XML dump published at
+https://www.gutenberg.org/cache/epub/feeds/rdf-files.tar.bz2, either as the
+archive itself, the uncompressed tar on stdin ("-"), or extracted into a
+directory of cache/epub/<id>/pg<id>.rdf files. Decompressing the archive
+is single-threaded and costs more than parsing it, so on a many-core host
+extract it first, or pipe it through a parallel decompressor:
+
+    lbzip2 -dc rdf-files.tar.bz2 | python -m rdf_loader -
+
+Files are parsed in a process pool; authors, subjects, bookshelves and
+languages are deduplicated across books; and every table is COPYed, in
+dependency order, into freshly created tables inside one transaction, with
+keys and indexes built after the data is in (catalog_load.load_catalog). The
+migrations then run as after a benchmark seed (book_documents, search
+indexes, catalog version).
+"""
+import argparse
+import collections
+import concurrent.futures
+import os
+import sys
+import tarfile
+import time
+import xml.etree.ElementTree as ElementTree
+
+import psycopg2
+
+from catalog_load import COLUMNS, MIGRATIONS, check_dependents, check_empty, finish_load, load_catalog
+
+
+NAMESPACES = {
+    'rdf': 'http://www.w3.org/1999/02/22-rdf-syntax-ns#',
+    'dcterms': 'http://purl.org/dc/terms/',
+    'dcam': 'http://purl.org/dc/dcam/',
+    'pgterms': 'http://www.gutenberg.org/2009/pgterms/',
+}
+RDF_ABOUT = f"{{{NAMESPACES['rdf']}}}about"
+RDF_RESOURCE = f"{{{NAMESPACES['rdf']}}}resource"
+LCSH = 'http://purl.org/dc/terms/LCSH'
+
+# Column widths in schema.sql; longer values are truncated
+MAX_LENGTHS = {'author': 128, 'subject': 256, 'bookshelf': 64, 'language': 4,
+               'media_type': 16, 'mime_type': 32, 'url': 256}
+
+# RDF files handed to a worker process at a time
+BATCH_SIZE = 500
+
+
+def _text(element, path):
+    found = element.find(path, NAMESPACES)
+    if found is None or found.text is None:
+        return None
+    return found.text.strip()
+
+
+def _values(element, path):
+    # rdf:value texts of the rdf:Description nodes at `path`
+    return [value.text.strip() for value in element.findall(f"{path}/rdf:Description/rdf:value", NAMESPACES)
+            if value.text and value.text.strip()]
+
+
+def _year(element, path):
+    value = _text(element, path)
+    try:
+        return int(value) if value else None
+    except ValueError:
+        return None
+
+
+def _trim(value, kind):
+    return value[:MAX_LENGTHS[kind]]
+
+
+def parse_rdf(data):
+    """One book from an RDF/XML file's bytes, or None if it holds no ebook.
+
+    Returns a dict with gutenberg_id, title, download_count, media_type,
+    copyright, authors (tuples of (agent id, name, birth, death)),
+    languages, subjects, bookshelves and formats ((mime type, url) pairs).
+    """
+    root = ElementTree.fromstring(data)
+    ebook = root.find('pgterms:ebook', NAMESPACES)
+    if ebook is None:
+        return None
+    try:
+        gutenberg_id = int(ebook.get(RDF_ABOUT, '').rsplit('/', 1)[-1])
+    except ValueError:
+        return None
+
+    authors = []
+    for agent in ebook.findall('dcterms:creator/pgterms:agent', NAMESPACES):
+        name = _text(agent, 'pgterms:name')
+        if not name:
+            continue
+        agent_id = agent.get(RDF_ABOUT, '').rsplit('/', 1)[-1]
+        authors.append((int(agent_id) if agent_id.isdigit() else None, _trim(name, 'author'),
+                        _year(agent, 'pgterms:birthdate'), _year(agent, 'pgterms:deathdate')))
+
+    subjects = []
+    for description in ebook.findall('dcterms:subject/rdf:Description', NAMESPACES):
+        member = description.find('dcam:memberOf', NAMESPACES)
+        value = _text(description, 'rdf:value')
+        # Library of Congress subject headings; LCC class codes are skipped
+        if value and member is not None and member.get(RDF_RESOURCE) == LCSH:
+            subjects.append(_trim(value, 'subject'))
+
+    formats = []
+    for file in ebook.findall('dcterms:hasFormat/pgterms:file', NAMESPACES):
+        url = file.get(RDF_ABOUT)
+        mime_types = _values(file, 'dcterms:format')
+        if url and mime_types:
+            # Zipped files list application/zip next to what the zip holds
+            mime_type = next((mime for mime in mime_types if mime != 'application/zip'), mime_types[0])
+            formats.append((_trim(mime_type, 'mime_type'), _trim(url, 'url')))
+
+    downloads = _text(ebook, 'pgterms:downloads')
+    rights = _text(ebook, 'dcterms:rights') or ''
+    media_types = _values(ebook, 'dcterms:type')
+    return {
+        'gutenberg_id': gutenberg_id,
+        'title': _text(ebook, 'dcterms:title'),
+        'download_count': int(downloads) if downloads and downloads.isdigit() else None,
+        'media_type': _trim(media_types[0], 'media_type') if media_types else 'Text',
+        'copyright': (True if rights.lower().startswith('copyrighted') else
+                      False if rights.lower().startswith('public domain') else None),
+        'authors': authors,
+        'languages': [_trim(code, 'language') for code in _values(ebook, 'dcterms:language')],
+        'subjects': subjects,
+        'bookshelves': [_trim(shelf, 'bookshelf') for shelf in _values(ebook, 'pgterms:bookshelf')],
+        'formats': formats,
+    }
+
+
+def _parse_batch(batch):
+    # Worker entry point: a list of file contents or of paths to read
+    books = []
+    for item in batch:
+        if isinstance(item, str):
+            with open(item, 'rb') as f:
+                item = f.read()
+        book = parse_rdf(item)
+        if book is not None:
+            books.append(book)
+    return books
+
+
+def _batches(items, size=BATCH_SIZE):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def read_sources(path):
+    """RDF inputs under `path`: file paths for a directory, else archive members' bytes.
+
+    Workers read paths themselves; an archive is decompressed here, in one
+    stream, and only the member bytes are sent to the workers.
+    """
+    if os.path.isdir(path):
+        for directory, _, names in sorted(os.walk(path)):
+            for name in sorted(names):
+                if name.endswith('.rdf'):
+                    yield os.path.join(directory, name)
+        return
+    source = {'fileobj': sys.stdin.buffer} if path == '-' else {'name': path}
+    with tarfile.open(mode='r|*', **source) as archive:
+        for member in archive:
+            if member.isfile() and member.name.endswith('.rdf'):
+                yield archive.extractfile(member).read()
+
+
+def parse_catalog(path, workers=None):
+    """Every book under `path`, parsed in a pool of `workers` processes."""
+    workers = workers or os.cpu_count() or 1
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        # A few batches per worker in flight, so a decompressed archive is
+        # never held in memory all at once; results come back in file order
+        pending = collections.deque()
+        for batch in _batches(read_sources(path)):
+            pending.append(executor.submit(_parse_batch, batch))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def build_tables(books):
+    """{table: rows} in catalog_load.COLUMNS order for parsed books.
+
+    Authors are deduplicated by Gutenberg agent id (their books_author id
+    and agent_id), or by name and dates for the rare agent without one; subjects,
+    bookshelves and languages by name and get ids in name order.
+    """
+    tables = {table: [] for table in COLUMNS}
+    authors = {}
+    agentless = {}
+    names = {'subject': set(), 'bookshelf': set(), 'language': set()}
+    links = []
+    seen = set()
+
+    for book in books:
+        gutenberg_id = book['gutenberg_id']
+        if gutenberg_id in seen:
+            continue
+        seen.add(gutenberg_id)
+        tables['books_book'].append((gutenberg_id, gutenberg_id, book['title'], book['download_count'],
+                                     book['media_type'], book['copyright']))
+        author_keys = []
+        for agent_id, name, birth_year, death_year in book['authors']:
+            key = agent_id if agent_id is not None else (name, birth_year, death_year)
+            if agent_id is not None:
+                authors.setdefault(agent_id, (name, birth_year, death_year))
+            else:
+                agentless.setdefault(key, None)
+            author_keys.append(key)
+        names['subject'].update(book['subjects'])
+        names['bookshelf'].update(book['bookshelves'])
+        names['language'].update(book['languages'])
+        for mime_type, url in dict.fromkeys(book['formats']):
+            tables['books_format'].append((gutenberg_id, mime_type, url))
+        links.append((gutenberg_id, author_keys, book))
+
+    next_id = max(authors, default=0) + 1
+    for key in sorted(agentless, key=lambda key: (key[0], key[1] or 0, key[2] or 0)):
+        agentless[key] = next_id
+        next_id += 1
+    tables['books_author'] = sorted((author_id, *author, author_id) for author_id, author in authors.items())
+    tables['books_author'] += [(author_id, *key, None) for key, author_id in agentless.items()]
+
+    ids = {}
+    for kind, table in (('subject', 'books_subject'), ('bookshelf', 'books_bookshelf'),
+                        ('language', 'books_language')):
+        tables[table] = list(enumerate(sorted(names[kind]), start=1))
+        ids[kind] = {name: name_id for name_id, name in tables[table]}
+
+    for gutenberg_id, author_keys, book in links:
+        for key in dict.fromkeys(author_keys):
+            author_id = key if not isinstance(key, tuple) else agentless[key]
+            tables['books_book_authors'].append((gutenberg_id, author_id))
+        for kind, table, values in (('language', 'books_book_languages', book['languages']),
+                                    ('subject', 'books_book_subjects', book['subjects']),
+                                    ('bookshelf', 'books_book_bookshelves', book['bookshelves'])):
+            for value in dict.fromkeys(values):
+                tables[table].append((gutenberg_id, ids[kind][value]))
+    return tables
+
+
+def load_rdf(database_url, path, workers=None, migrations=MIGRATIONS, force=False, log=print):
+    """Parse the RDF catalog at `path` and load it into a fresh set of tables."""
+    connection = psycopg2.connect(database_url)
+    try:
+        check_empty(connection, force)
+        dependents = check_dependents(connection, migrations)
+        started = time.perf_counter()
+        tables = build_tables(parse_catalog(path, workers))
+        log(f"parsed {len(tables['books_book'])} books ({len(tables['books_author'])} authors, "
+            f"{len(tables['books_subject'])} subjects, {len(tables['books_format'])} formats) "
+            f"in {time.perf_counter() - started:.1f}s")
+
+        started = time.perf_counter()
+        load_catalog(connection, tables, log=log)
+        log(f"loaded every table in {time.perf_counter() - started:.1f}s")
+        finish_load(connection, migrations, log, dependents)
+    finally:
+        connection.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help='rdf-files.tar.bz2, a directory it was extracted into, '
+                                     'or - for a tar on stdin')
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'), required=False)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='parser processes (default: one per CPU)')
+    parser.add_argument('--no-migrations', action='store_true',
+                        help='load the bare schema without applying migrations/*.sql')
+    parser.add_argument('--force', action='store_true', help='replace existing books_* tables')
+    args = parser.parse_args(argv)
+    if not args.database_url:
+        parser.error('--database-url or DATABASE_URL is required')
+    load_rdf(args.database_url, args.path, args.workers,
+             migrations=[] if args.no_migrations else MIGRATIONS, force=args.force)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,452 @@
+"""Apply new and changed books from the Project Gutenberg RDF catalog.
+
+    python -m rdf_sync --database-url postgresql://... rdf-files.tar.bz2
+
+Takes the same inputs as rdf_loader (archive, extracted directory, or "-")
+but, instead of rebuilding the tables, compares every book with what is
+stored and writes only the difference while the API keeps serving:
+
+  - books whose content (title, authors, languages, subjects, bookshelves,
+    formats...) hashes differently from the stored rows, or that are new,
+    are upserted along with just the relation rows that changed;
+  - books whose only change is download_count get a bulk UPDATE;
+  - with --delete-missing, stored books absent from the input are deleted
+    (only meaningful for a complete dump).
+
+Writes go in batches of --batch-size books, one short transaction each, so
+no lock is held for long and readers are never blocked. Each batch
+re-renders the book_documents of the books it touched once (migration
+0006), and the triggers from migration 0004 bump catalog_version, which
+invalidates the API caches. Authors are matched on their Gutenberg agent
+id (migration 0007). One sync runs at a time (an advisory lock). What
+changed is printed as a JSON report.
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+import psycopg2
+
+from rdf_loader import parse_catalog
+
+
+# pg_try_advisory_lock key held for the duration of a sync
+SYNC_LOCK_ID = 4716221
+
+# Books written per transaction
+BATCH_SIZE = 500
+
+# Each stored book in parse_rdf's shape (author ids are not compared)
+STORED_BOOKS_QUERY = """
+    SELECT
+        bb.gutenberg_id,
+        bb.title,
+        bb.download_count,
+        bb.media_type,
+        bb.copyright,
+        COALESCE((
+            SELECT json_agg(json_build_array(ba.name, ba.birth_year, ba.death_year))
+            FROM books_book_authors AS bba
+            JOIN books_author AS ba ON ba.id = bba.author_id
+            WHERE bba.book_id = bb.gutenberg_id
+        ), '[]') AS authors,
+        ARRAY(
+            SELECT bl.code::text
+            FROM books_book_languages AS bbl
+            JOIN books_language AS bl ON bl.id = bbl.language_id
+            WHERE bbl.book_id = bb.gutenberg_id
+        ) AS languages,
+        ARRAY(
+            SELECT bs.name::text
+            FROM books_book_subjects AS bbs
+            JOIN books_subject AS bs ON bs.id = bbs.subject_id
+            WHERE bbs.book_id = bb.gutenberg_id
+        ) AS subjects,
+        ARRAY(
+            SELECT bbk.name::text
+            FROM books_book_bookshelves AS bbb
+            JOIN books_bookshelf AS bbk ON bbk.id = bbb.bookshelf_id
+            WHERE bbb.book_id = bb.gutenberg_id
+        ) AS bookshelves,
+        COALESCE((
+            SELECT json_agg(json_build_array(bf.mime_type, bf.url))
+            FROM books_format AS bf
+            WHERE bf.book_id = bb.gutenberg_id
+        ), '[]') AS formats
+    FROM books_book AS bb
+"""
+
+# Relation tables: the columns after book_id and their array types
+LINKS = {
+    'books_book_authors': (('author_id', 'integer'),),
+    'books_book_languages': (('language_id', 'integer'),),
+    'books_book_subjects': (('subject_id', 'integer'),),
+    'books_book_bookshelves': (('bookshelf_id', 'integer'),),
+    'books_format': (('mime_type', 'text'), ('url', 'text')),
+}
+
+# Lookup tables deduplicated by name: (table, name column, parse_rdf key)
+NAMED = (
+    ('books_language', 'code', 'languages'),
+    ('books_subject', 'name', 'subjects'),
+    ('books_bookshelf', 'name', 'bookshelves'),
+)
+
+
+def content_hash(book):
+    """Hash of everything stored for a book except its download_count."""
+    content = [
+        book['title'],
+        book['media_type'],
+        book['copyright'],
+        sorted({json.dumps(list(author[1:])) for author in book['authors']}),
+        sorted(set(book['languages'])),
+        sorted(set(book['subjects'])),
+        sorted(set(book['bookshelves'])),
+        sorted({json.dumps(list(book_format)) for book_format in book['formats']}),
+    ]
+    return hashlib.sha1(json.dumps(content, ensure_ascii=False).encode()).hexdigest()
+
+
+def stored_hashes(connection):
+    """{gutenberg_id: (content hash, download_count)} for every stored book."""
+    hashes = {}
+    with connection.cursor(name='stored_books') as cursor:
+        cursor.itersize = 5000
+        cursor.execute(STORED_BOOKS_QUERY)
+        for (gutenberg_id, title, download_count, media_type, copyright,
+             authors, languages, subjects, bookshelves, formats) in cursor:
+            book = {
+                'title': title,
+                'media_type': media_type,
+                'copyright': copyright,
+                'authors': [(None, *author) for author in authors],
+                'languages': languages,
+                'subjects': subjects,
+                'bookshelves': bookshelves,
+                'formats': formats,
+            }
+            hashes[gutenberg_id] = (content_hash(book), download_count)
+    connection.rollback()
+    return hashes
+
+
+def diff_catalog(books, stored, delete_missing=False):
+    """Sort parsed books against `stored` (see stored_hashes()).
+
+    Returns a dict of 'added' and 'changed' books, 'downloads' as
+    (gutenberg_id, download_count) pairs, 'deleted' gutenberg_ids (only
+    with `delete_missing`) and the number of 'unchanged' books.
+    """
+    diff = {'added': [], 'changed': [], 'downloads': [], 'deleted': [], 'unchanged': 0}
+    seen = set()
+    for book in books:
+        gutenberg_id = book['gutenberg_id']
+        if gutenberg_id in seen:
+            continue
+        seen.add(gutenberg_id)
+        if gutenberg_id not in stored:
+            diff['added'].append(book)
+            continue
+        stored_hash, stored_downloads = stored[gutenberg_id]
+        if content_hash(book) != stored_hash:
+            diff['changed'].append(book)
+        elif book['download_count'] != stored_downloads:
+            diff['downloads'].append((gutenberg_id, book['download_count']))
+        else:
+            diff['unchanged'] += 1
+    if delete_missing:
+        diff['deleted'] = sorted(set(stored) - seen)
+    return diff
+
+
+def _batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _author_ids(cursor, books):
+    # ({author: books_author id} for every author of `books`, ids of stored
+    # authors that changed). Gutenberg agents are matched on agent_id
+    # (migration 0007), never on books_author.id, which is only the agent id
+    # in databases rdf_loader built. An agent seen for the first time claims
+    # a stored author without an agent_id by name and dates, else is
+    # inserted; agents without an id are matched by name and dates alone.
+    agents = {}
+    agentless = {}
+    for book in books:
+        for agent_id, name, birth_year, death_year in book['authors']:
+            if agent_id is not None:
+                agents[agent_id] = (name, birth_year, death_year)
+            else:
+                agentless[(name, birth_year, death_year)] = None
+
+    updated = []
+    stored = {}
+    if agents:
+        agent_ids, names, births, deaths = zip(*((agent_id, *author) for agent_id, author in agents.items()))
+        cursor.execute("""
+            UPDATE books_author AS ba SET
+                name = a.name,
+                birth_year = a.birth_year,
+                death_year = a.death_year
+            FROM unnest(%s::integer[], %s::text[], %s::integer[], %s::integer[])
+                AS a(agent_id, name, birth_year, death_year)
+            WHERE ba.agent_id = a.agent_id
+              AND (ba.name, ba.birth_year, ba.death_year)
+                IS DISTINCT FROM (a.name, a.birth_year, a.death_year)
+            RETURNING ba.id
+        """, [list(agent_ids), list(names), list(births), list(deaths)])
+        updated = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT agent_id, id FROM books_author WHERE agent_id = ANY(%s)", [list(agent_ids)])
+        stored = dict(cursor.fetchall())
+
+    for agent_id, key in agents.items():
+        if agent_id in stored:
+            continue
+        cursor.execute("""
+            UPDATE books_author SET agent_id = %s
+            WHERE id = (
+                SELECT id FROM books_author
+                WHERE agent_id IS NULL AND name = %s
+                  AND birth_year IS NOT DISTINCT FROM %s AND death_year IS NOT DISTINCT FROM %s
+                ORDER BY id LIMIT 1
+            )
+            RETURNING id
+        """, [agent_id, *key])
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute("""
+                INSERT INTO books_author (name, birth_year, death_year, agent_id)
+                VALUES (%s, %s, %s, %s) RETURNING id
+            """, [*key, agent_id])
+            row = cursor.fetchone()
+        stored[agent_id] = row[0]
+
+    for key in agentless:
+        cursor.execute("""
+            SELECT id FROM books_author
+            WHERE agent_id IS NULL AND name = %s
+              AND birth_year IS NOT DISTINCT FROM %s AND death_year IS NOT DISTINCT FROM %s
+            ORDER BY id LIMIT 1
+        """, key)
+        row = cursor.fetchone()
+        if row is None:
+            cursor.execute(
+                "INSERT INTO books_author (name, birth_year, death_year) VALUES (%s, %s, %s) RETURNING id", key)
+            row = cursor.fetchone()
+        agentless[key] = row[0]
+
+    ids = {author: stored[author[0]] if author[0] is not None else agentless[author[1:]]
+           for book in books for author in book['authors']}
+    return ids, updated
+
+
+def _name_ids(cursor, table, column, names):
+    # {name: id} in `table`, inserting names it does not have yet
+    names = sorted(set(names))
+    if not names:
+        return {}
+    cursor.execute(
+        f"SELECT DISTINCT ON ({column}) {column}, id FROM {table} "
+        f"WHERE {column} = ANY(%s) ORDER BY {column}, id", [names])
+    ids = dict(cursor.fetchall())
+    missing = [name for name in names if name not in ids]
+    if missing:
+        cursor.execute(
+            f"INSERT INTO {table} ({column}) SELECT unnest(%s::text[]) RETURNING {column}, id", [missing])
+        ids.update(cursor.fetchall())
+    return ids
+
+
+def _sync_links(cursor, table, book_ids, rows):
+    # Make `table`'s rows for `book_ids` exactly `rows` ((book_id, *values)),
+    # deleting and inserting only the difference
+    columns = LINKS[table]
+    names = ['book_id'] + [name for name, _ in columns]
+    types = ['integer'] + [kind for _, kind in columns]
+    arrays = [list(values) for values in zip(*rows)] if rows else [[] for _ in names]
+    desired = (f"unnest({', '.join(f'%s::{kind}[]' for kind in types)}) "
+               f"AS d({', '.join(names)})")
+    matches = ' AND '.join(f"d.{name} = t.{name}" for name in names)
+    cursor.execute(f"""
+        DELETE FROM {table} AS t
+        WHERE t.book_id = ANY(%s)
+          AND NOT EXISTS (SELECT 1 FROM {desired} WHERE {matches})
+    """, [book_ids] + arrays)
+    cursor.execute(f"""
+        INSERT INTO {table} ({', '.join(names)})
+        SELECT DISTINCT {', '.join(f'd.{name}' for name in names)} FROM {desired}
+        WHERE NOT EXISTS (SELECT 1 FROM {table} AS t WHERE {matches})
+    """, arrays)
+
+
+def apply_books(cursor, books):
+    """Upsert `books` (parse_rdf dicts) and make their relation rows match.
+
+    Returns the gutenberg_ids whose documents changed: `books`, and other
+    books by an author whose name or dates changed.
+    """
+    book_ids = [book['gutenberg_id'] for book in books]
+    author_ids, updated_authors = _author_ids(cursor, books)
+    name_ids = {key: _name_ids(cursor, table, column, [name for book in books for name in book[key]])
+                for table, column, key in NAMED}
+
+    cursor.execute("""
+        INSERT INTO books_book (gutenberg_id, title, download_count, media_type, copyright)
+        SELECT * FROM unnest(%s::integer[], %s::text[], %s::integer[], %s::text[], %s::boolean[])
+        ON CONFLICT (gutenberg_id) DO UPDATE SET
+            title = EXCLUDED.title,
+            download_count = EXCLUDED.download_count,
+            media_type = EXCLUDED.media_type,
+            copyright = EXCLUDED.copyright
+        WHERE (books_book.title, books_book.download_count, books_book.media_type, books_book.copyright)
+            IS DISTINCT FROM (EXCLUDED.title, EXCLUDED.download_count, EXCLUDED.media_type, EXCLUDED.copyright)
+    """, [book_ids,
+          [book['title'] for book in books],
+          [book['download_count'] for book in books],
+          [book['media_type'] for book in books],
+          [book['copyright'] for book in books]])
+
+    links = {table: [] for table in LINKS}
+    for book in books:
+        gutenberg_id = book['gutenberg_id']
+        links['books_book_authors'] += [(gutenberg_id, author_ids[author]) for author in book['authors']]
+        links['books_book_languages'] += [(gutenberg_id, name_ids['languages'][code])
+                                          for code in book['languages']]
+        links['books_book_subjects'] += [(gutenberg_id, name_ids['subjects'][name])
+                                         for name in book['subjects']]
+        links['books_book_bookshelves'] += [(gutenberg_id, name_ids['bookshelves'][name])
+                                            for name in book['bookshelves']]
+        links['books_format'] += [(gutenberg_id, *book_format) for book_format in book['formats']]
+    for table, rows in links.items():
+        _sync_links(cursor, table, book_ids, rows)
+
+    touched = set(book_ids)
+    if updated_authors:
+        cursor.execute("SELECT DISTINCT book_id FROM books_book_authors WHERE author_id = ANY(%s)",
+                       [updated_authors])
+        touched.update(row[0] for row in cursor.fetchall())
+    return sorted(touched)
+
+
+def apply_downloads(cursor, downloads):
+    """Set download_count for (gutenberg_id, download_count) pairs; returns their ids."""
+    book_ids, counts = zip(*downloads)
+    cursor.execute("""
+        UPDATE books_book AS bb SET download_count = d.download_count
+        FROM unnest(%s::integer[], %s::integer[]) AS d(gutenberg_id, download_count)
+        WHERE bb.gutenberg_id = d.gutenberg_id
+          AND bb.download_count IS DISTINCT FROM d.download_count
+    """, [list(book_ids), list(counts)])
+    return list(book_ids)
+
+
+def delete_books(cursor, book_ids):
+    """Delete books and their relation rows; returns `book_ids`."""
+    for table in LINKS:
+        cursor.execute(f"DELETE FROM {table} WHERE book_id = ANY(%s)", [book_ids])
+    cursor.execute("DELETE FROM books_book WHERE gutenberg_id = ANY(%s)", [book_ids])
+    return book_ids
+
+
+def _log(message):
+    # Progress goes to stderr; stdout carries the JSON report
+    print(message, file=sys.stderr)
+
+
+def sync_rdf(database_url, path, workers=None, batch_size=BATCH_SIZE, delete_missing=False,
+             dry_run=False, log=_log):
+    """Sync the tables with the RDF catalog at `path`; returns the report."""
+    started = time.perf_counter()
+    connection = psycopg2.connect(database_url)
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_try_advisory_lock(%s)", [SYNC_LOCK_ID])
+            if not cursor.fetchone()[0]:
+                raise RuntimeError('another catalog sync is running')
+            # Fail a batch rather than queue behind (and in front of) other locks
+            cursor.execute("SET lock_timeout = '5s'")
+            cursor.execute("""
+                SELECT 1 FROM information_schema.columns
+                WHERE table_name = 'books_author' AND column_name = 'agent_id'
+            """)
+            if cursor.fetchone() is None:
+                raise RuntimeError('books_author has no agent_id column; '
+                                   'apply migrations/0007_author_agent_ids.sql first')
+        connection.commit()
+
+        stored = stored_hashes(connection)
+        diff = diff_catalog(parse_catalog(path, workers), stored, delete_missing)
+        log(f"compared {len(stored)} stored books in {time.perf_counter() - started:.1f}s")
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regproc('refresh_book_documents') IS NOT NULL")
+            documents = cursor.fetchone()[0]
+        connection.commit()
+
+        batches = 0
+        if not dry_run:
+            steps = ((apply_books, diff['added'] + diff['changed']),
+                     (apply_downloads, diff['downloads']),
+                     (delete_books, diff['deleted']))
+            for step, items in steps:
+                for batch in _batches(items, batch_size):
+                    with connection.cursor() as cursor:
+                        if documents:
+                            # Render each touched document once (migration 0006)
+                            cursor.execute("SET LOCAL gutenberg.defer_book_documents = on")
+                        touched = step(cursor, batch)
+                        if documents:
+                            cursor.execute("SELECT refresh_book_documents(%s)", [touched])
+                    connection.commit()
+                    batches += 1
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('catalog_version') IS NOT NULL")
+            version = None
+            if cursor.fetchone()[0]:
+                cursor.execute("SELECT version FROM catalog_version")
+                version = cursor.fetchone()[0]
+            cursor.execute("SELECT pg_advisory_unlock(%s)", [SYNC_LOCK_ID])
+        connection.commit()
+    finally:
+        connection.close()
+
+    return {
+        'dry_run': dry_run,
+        'added': sorted(book['gutenberg_id'] for book in diff['added']),
+        'changed': sorted(book['gutenberg_id'] for book in diff['changed']),
+        'deleted': diff['deleted'],
+        'downloads_updated': len(diff['downloads']),
+        'unchanged': diff['unchanged'],
+        'batches': batches,
+        'catalog_version': version,
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('path', help='rdf-files.tar.bz2, a directory it was extracted into, '
+                                     'or - for a tar on stdin')
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'), required=False)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='parser processes (default: one per CPU)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='books written per transaction')
+    parser.add_argument('--delete-missing', action='store_true',
+                        help='delete stored books the input does not have (complete dumps only)')
+    parser.add_argument('--dry-run', action='store_true', help='report the changes without writing them')
+    args = parser.parse_args(argv)
+    if not args.database_url:
+        parser.error('--database-url or DATABASE_URL is required')
+    report = sync_rdf(args.database_url, args.path, args.workers, args.batch_size,
+                      args.delete_missing, args.dry_run)
+    print(json.dumps(report))
+
+
+if __name__ == '__main__':
+    main()
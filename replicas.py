@@ -0,0 +1,252 @@
+# Read-replica routing.
+#
+# ReplicaRouter hands out connections for read-only work from a set of
+# replica pools, picked round-robin or by lowest round-trip latency, and from
+# the primary pool when no replica is usable. Latency is the time the lag
+# query takes to answer, sampled at most every `lag_interval` seconds; how
+# long callers hold their connections says nothing about the replica.
+# A replica is ejected while
+#
+#   - its replication lag, re-read at most every `lag_interval` seconds,
+#     exceeds `max_lag` seconds (it rejoins once it has caught up), or
+#   - it failed `max_errors` times in a row: connection errors, pool
+#     timeouts or lost connections (it rejoins after `eject_seconds`).
+#
+# Errors raised by the statement itself (bad SQL, bad parameters, a
+# statement timeout or cancel, a recovery conflict) say nothing about the
+# replica and are not counted.
+
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import PoolError
+
+
+POLICIES = ('round_robin', 'least_latency')
+
+# Seconds the replica's replayed data is behind its primary; 0 when it has
+# replayed everything it received (an idle primary writes nothing, so the
+# last replay timestamp alone would keep growing) or when it is a primary
+LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery()
+             OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+# Weight of the newest sample in a replica's latency average
+LATENCY_SMOOTHING = 0.2
+
+# Failures that count against a replica
+REPLICA_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, PoolError)
+
+# OperationalErrors that end only the statement: statement_timeout or a
+# cancel(), and serialization failures or recovery conflicts on a replica.
+# The connection is still usable and the server is healthy.
+STATEMENT_ERRORS = (psycopg2.extensions.QueryCanceledError,
+                    psycopg2.extensions.TransactionRollbackError)
+
+
+def _checkout(pool, count):
+    # One connection waited for, plus up to count - 1 more that `pool` can
+    # hand out without waiting
+    connections = [pool.getconn()]
+    try:
+        while len(connections) < count:
+            connection = pool.try_getconn()
+            if connection is None:
+                break
+            connections.append(connection)
+    except Exception:
+        for connection in connections:
+            pool.putconn(connection)
+        raise
+    return connections
+
+
+def read_lag(connection):
+    cursor = connection.cursor()
+    try:
+        cursor.execute(LAG_QUERY)
+        return float(cursor.fetchone()[0])
+    finally:
+        cursor.close()
+
+
+class Replica:
+    """One replica pool and what the router knows about its health."""
+
+    def __init__(self, pool, name):
+        self.pool = pool
+        self.name = name
+        self.lag = None
+        self.lag_checked_at = None
+        self.latency = None
+        self.errors = 0
+        self.ejected_until = None
+        self.counters = {'checkouts': 0, 'errors': 0, 'error_ejections': 0, 'lag_ejections': 0}
+
+
+class ReplicaRouter:
+    """Connections for reads, from a healthy replica or else the primary."""
+
+    def __init__(self, primary, replicas=(), policy='round_robin', max_lag=5.0,
+                 max_errors=3, eject_seconds=30.0, lag_interval=5.0):
+        if policy not in POLICIES:
+            raise ValueError(f"replica policy must be one of {', '.join(POLICIES)}")
+        self.primary = primary
+        self.replicas = [replica if isinstance(replica, Replica) else Replica(replica, str(index))
+                         for index, replica in enumerate(replicas)]
+        self.policy = policy
+        self.max_lag = max_lag
+        self.max_errors = max_errors
+        self.eject_seconds = eject_seconds
+        self.lag_interval = lag_interval
+        self._lock = threading.Lock()
+        self._turn = itertools.count()
+        self._counters = {'primary_checkouts': 0}
+
+    @contextmanager
+    def connection(self):
+        """A pooled connection for read-only statements."""
+        with self.connections() as (_, [connection]):
+            yield connection
+
+    @contextmanager
+    def connections(self, count=1):
+        """Up to `count` pooled connections to one server, for read-only statements.
+
+        Yields (pool, connections). The first connection is waited for like
+        connection(); the others come from the same pool, and only if it has
+        them free right away, so statements run side by side see the same
+        server and a caller holding one connection never waits for another.
+        """
+        for replica in self._candidates():
+            try:
+                connections = _checkout(replica.pool, count)
+            except REPLICA_ERRORS:
+                self._failed(replica)
+                continue
+            broken = False
+            try:
+                yield replica.pool, connections
+            except STATEMENT_ERRORS:
+                raise
+            except REPLICA_ERRORS:
+                broken = True
+                self._failed(replica)
+                raise
+            finally:
+                for connection in connections:
+                    replica.pool.putconn(connection, broken=broken)
+            self._succeeded(replica)
+            return
+
+        if self.replicas:
+            with self._lock:
+                self._counters['primary_checkouts'] += 1
+        connections = _checkout(self.primary, count)
+        broken = False
+        try:
+            yield self.primary, connections
+        except STATEMENT_ERRORS:
+            raise
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            for connection in connections:
+                self.primary.putconn(connection, broken=broken)
+
+    def _candidates(self):
+        # Usable replicas in the order to try them
+        now = time.monotonic()
+        usable = [replica for replica in self.replicas if self._usable(replica, now)]
+        if self.policy == 'least_latency':
+            # Replicas without a sample yet sort first so each gets measured
+            return sorted(usable, key=lambda replica: replica.latency or 0.0)
+        if not usable:
+            return usable
+        start = next(self._turn) % len(usable)
+        return usable[start:] + usable[:start]
+
+    def _usable(self, replica, now):
+        with self._lock:
+            if replica.ejected_until is not None:
+                if now < replica.ejected_until:
+                    return False
+                # Back on probation after the ejection period
+                replica.ejected_until = None
+                replica.errors = 0
+                replica.latency = None
+            # The lag query doubles as the latency probe
+            check_lag = ((self.max_lag is not None or self.policy == 'least_latency') and
+                         (replica.lag_checked_at is None or
+                          now - replica.lag_checked_at >= self.lag_interval))
+            if check_lag:
+                # Claim the check; concurrent callers go by the last reading
+                replica.lag_checked_at = now
+            lag = replica.lag
+
+        if check_lag:
+            try:
+                with replica.pool.connection() as connection:
+                    started = time.monotonic()
+                    lag = read_lag(connection)
+                    round_trip = time.monotonic() - started
+            except REPLICA_ERRORS:
+                self._failed(replica)
+                return False
+            with self._lock:
+                if self._lagging(lag) and not self._lagging(replica.lag):
+                    replica.counters['lag_ejections'] += 1
+                replica.lag = lag
+                if replica.latency is None:
+                    replica.latency = round_trip
+                else:
+                    replica.latency += LATENCY_SMOOTHING * (round_trip - replica.latency)
+        return not self._lagging(lag)
+
+    def _lagging(self, lag):
+        return lag is not None and self.max_lag is not None and lag > self.max_lag
+
+    def _failed(self, replica):
+        with self._lock:
+            replica.counters['errors'] += 1
+            replica.errors += 1
+            if replica.errors >= self.max_errors and replica.ejected_until is None:
+                replica.ejected_until = time.monotonic() + self.eject_seconds
+                replica.counters['error_ejections'] += 1
+
+    def _succeeded(self, replica):
+        with self._lock:
+            replica.errors = 0
+            replica.counters['checkouts'] += 1
+
+    def stats(self):
+        """Router counters and, per replica, its health, counters and pool stats."""
+        now = time.monotonic()
+        with self._lock:
+            replicas = []
+            for replica in self.replicas:
+                ejected = replica.ejected_until is not None and now < replica.ejected_until
+                lagging = self._lagging(replica.lag)
+                stats = {
+                    'replica': replica.name,
+                    'healthy': not (ejected or lagging),
+                    'ejected_for': 'errors' if ejected else 'lag' if lagging else None,
+                    'lag_seconds': replica.lag,
+                    'latency_ms': (round(replica.latency * 1000, 3)
+                                   if replica.latency is not None else None),
+                }
+                stats.update(replica.counters)
+                stats['pool'] = replica.pool.stats()
+                replicas.append(stats)
+            stats = {'policy': self.policy, 'replicas': replicas}
+            stats.update(self._counters)
+        return stats
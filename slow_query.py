@@ -0,0 +1,181 @@
+import contextlib
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+from cache import TTLCache
+
+
+logger = logging.getLogger('gutenberg.slow_queries')
+
+EXPLAIN_MODES = ('plain', 'analyze', 'off')
+
+
+def redact(value):
+    # Keep the shape of bound parameters but not the search text itself
+    if isinstance(value, str):
+        return f"<{len(value)} chars>"
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    return value
+
+
+def server_name(pool):
+    # "host:port" of the server a ConnectionPool connects to
+    config = getattr(pool, 'config', None) or {}
+    return f"{config.get('host')}:{config.get('port') or 5432}"
+
+
+class SlowQueryLog:
+    """Structured JSON log of statements slower than a threshold.
+
+    watch() times a block that runs one statement. Slow statements are
+    sampled, then handed to a background thread that captures the plan on its
+    own pooled connection to the server that ran the statement and logs one
+    JSON object per statement, so the request that was slow does not also
+    wait for EXPLAIN.
+
+    explain='plain' runs EXPLAIN (FORMAT JSON) and caches the plan per SQL
+    text, which is per filter shape. explain='analyze' runs
+    EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON), which executes the statement
+    again, so keep sample_rate low. explain='off' logs without a plan.
+    """
+
+    def __init__(self, pool, threshold_ms=500.0, sample_rate=1.0, explain='plain', redact_params=True,
+                 explain_timeout_ms=5000, plan_cache=None, queue_size=100):
+        if explain not in EXPLAIN_MODES:
+            raise ValueError(f"explain must be one of {', '.join(EXPLAIN_MODES)}")
+        self.pool = pool
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.explain = explain
+        self.redact_params = redact_params
+        self.explain_timeout_ms = explain_timeout_ms
+        self.plan_cache = plan_cache if plan_cache is not None else TTLCache(max_size=256, ttl=3600)
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._pid = None
+        self._queue = None
+        self._counters = {'slow': 0, 'sampled_out': 0, 'dropped': 0, 'logged': 0, 'explain_errors': 0}
+
+    @property
+    def enabled(self):
+        return self.threshold_ms is not None
+
+    @contextlib.contextmanager
+    def watch(self, phase, query, params, pool=None):
+        # Time the block that executes `query`; report it if it was slow,
+        # including when it failed (e.g. hit statement_timeout). `pool` is
+        # where the statement ran (a read replica), when not self.pool; its
+        # plan is captured on that same server.
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, query, params, time.perf_counter() - started, pool)
+
+    def observe(self, phase, query, params, seconds, pool=None):
+        duration_ms = seconds * 1000
+        if not self.enabled or duration_ms < self.threshold_ms:
+            return
+        with self._lock:
+            self._counters['slow'] += 1
+            if random.random() >= self.sample_rate:
+                self._counters['sampled_out'] += 1
+                return
+        entry = {'phase': phase, 'query': query, 'params': params, 'duration_ms': duration_ms,
+                 'logged_at': time.time(), 'pool': pool}
+        try:
+            self._worker_queue().put_nowait(entry)
+        except queue.Full:
+            with self._lock:
+                self._counters['dropped'] += 1
+
+    def _worker_queue(self):
+        # One background thread per process, started lazily (after any fork)
+        with self._lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._queue = queue.Queue(maxsize=self.queue_size)
+                threading.Thread(target=self._run, args=(self._queue,), name='slow-query-log',
+                                 daemon=True).start()
+            return self._queue
+
+    def _run(self, entries):
+        while True:
+            entry = entries.get()
+            try:
+                self.write(entry)
+            except Exception as e:
+                logger.error(f"Could not write slow query log entry: {e}")
+
+    def write(self, entry):
+        """Capture the plan for one slow statement and log it."""
+        pool = entry.get('pool') or self.pool
+        plan, plan_source = None, None
+        if self.explain != 'off':
+            try:
+                plan, plan_source = self.capture_plan(entry['query'], entry['params'], pool)
+            except Exception as e:
+                plan_source = f"error: {e}"
+                with self._lock:
+                    self._counters['explain_errors'] += 1
+
+        params = entry['params']
+        record = {
+            'event': 'slow_query',
+            'timestamp': round(entry['logged_at'], 3),
+            'phase': entry['phase'],
+            'duration_ms': round(entry['duration_ms'], 2),
+            'threshold_ms': self.threshold_ms,
+            'server': server_name(pool),
+            'sql': ' '.join(entry['query'].split()),
+            'params': redact(params) if self.redact_params else params,
+            'plan_source': plan_source,
+            'plan': plan,
+        }
+        logger.warning(json.dumps(record, default=str))
+        with self._lock:
+            self._counters['logged'] += 1
+        return record
+
+    def capture_plan(self, query, params, pool=None):
+        # Returns (plan, source) where source is "explain", "explain_analyze" or "cached";
+        # plans are captured and cached per server
+        if query.lstrip().upper().startswith('EXPLAIN'):
+            # count=estimate already is an EXPLAIN
+            return None, 'not_explainable'
+        pool = pool or self.pool
+        analyze = self.explain == 'analyze'
+        cache_key = (server_name(pool), query)
+        if not analyze:
+            plan = self.plan_cache.get(cache_key)
+            if plan is not None:
+                return plan, 'cached'
+
+        options = 'ANALYZE, BUFFERS, FORMAT JSON' if analyze else 'FORMAT JSON'
+        with pool.connection() as connection:
+            cursor = connection.cursor()
+            try:
+                # Rolled back with the transaction when the connection is returned
+                cursor.execute("SET LOCAL statement_timeout = %s", [int(self.explain_timeout_ms)])
+                cursor.execute(f"EXPLAIN ({options}) {query}", params)
+                plan = cursor.fetchone()[0]
+            finally:
+                cursor.close()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+
+        if not analyze:
+            self.plan_cache.set(cache_key, plan)
+        return plan, 'explain_analyze' if analyze else 'explain'
+
+    def stats(self):
+        with self._lock:
+            stats = {'threshold_ms': self.threshold_ms, 'sample_rate': self.sample_rate}
+            stats.update(self._counters)
+        return stats
@@ -20,9 +20,16 @@ class TestGutenbergAPI(unittest.TestCase):
                 'death_year': 1880,
                 'id': 1
             },
+            'authors': [{
+                'name': 'Test Author',
+                'birth_year': 1800,
+                'death_year': 1880,
+                'id': 1
+            }],
             'language': 'en',
-            'subjects': 'Fiction, Drama',
-            'bookshelves': 'Classic Literature',
+            'languages': ['en'],
+            'subjects': ['Fiction', 'Drama'],
+            'bookshelves': ['Classic Literature'],
             'download_links': [
                 {'mime_type': 'text/plain', 'url': 'http://example.com/book.txt'}
             ]
@@ -76,7 +83,7 @@ class TestGutenbergAPI(unittest.TestCase):
         """Test topic filtering"""
         with patch('models.get_books_from_db') as mock_db:
             mock_book = self.mock_book.copy()
-            mock_book['subjects'] = 'Children, Education'
+            mock_book['subjects'] = ['Children', 'Education']
             mock_db.return_value = (1, [mock_book])
             
             response = self.app.get('/get_books?topic=child')
@@ -104,7 +111,7 @@ class TestGutenbergAPI(unittest.TestCase):
             mock_book = self.mock_book.copy()
             mock_book.update({
                 'language': 'en',
-                'subjects': 'Children, Education',
+                'subjects': ['Children', 'Education'],
                 'author_info': {'name': 'Shakespeare, William'}
             })
             mock_db.return_value = (1, [mock_book])
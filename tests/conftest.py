@@ -0,0 +1,13 @@
+# Helpers shared by the test modules, which import them as `from conftest
+# import ...` (pytest and `unittest discover` both put tests/ on sys.path).
+from unittest.mock import MagicMock
+
+import psycopg2.extensions as _ext
+
+
+def make_connection(name=None):
+    """A mock psycopg2 connection that pools see as open and idle."""
+    conn = MagicMock(name=name)
+    conn.closed = 0
+    conn.info.transaction_status = _ext.TRANSACTION_STATUS_IDLE
+    return conn
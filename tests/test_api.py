@@ -1,7 +1,12 @@
+import gzip
 import unittest
+from contextlib import contextmanager
 from unittest.mock import patch, MagicMock
 import json
 from models import app
+import models
+import queries
+from facets import FacetIndex
 
 class TestGutenbergAPI(unittest.TestCase):
     def setUp(self):
@@ -19,9 +24,16 @@ class TestGutenbergAPI(unittest.TestCase):
                 'death_year': 1880,
                 'id': 1
             },
+            'authors': [{
+                'name': 'Test Author',
+                'birth_year': 1800,
+                'death_year': 1880,
+                'id': 1
+            }],
             'language': 'en',
-            'subjects': 'Fiction, Drama',
-            'bookshelves': 'Classic Literature',
+            'languages': ['en'],
+            'subjects': ['Fiction', 'Drama'],
+            'bookshelves': ['Classic Literature'],
             'download_links': [
                 {'mime_type': 'text/plain', 'url': 'http://example.com/book.txt'}
             ]
@@ -75,7 +87,7 @@ class TestGutenbergAPI(unittest.TestCase):
         """Test topic filtering"""
         with patch('models.get_books_from_db') as mock_db:
             mock_book = self.mock_book.copy()
-            mock_book['subjects'] = 'Children, Education'
+            mock_book['subjects'] = ['Children', 'Education']
             mock_db.return_value = (1, [mock_book])
             
             response = self.app.get('/get_books?topic=child')
@@ -103,7 +115,7 @@ class TestGutenbergAPI(unittest.TestCase):
             mock_book = self.mock_book.copy()
             mock_book.update({
                 'language': 'en',
-                'subjects': 'Children, Education',
+                'subjects': ['Children', 'Education'],
                 'author_info': {'name': 'Shakespeare, William'}
             })
             mock_db.return_value = (1, [mock_book])
@@ -161,6 +173,349 @@ class TestGutenbergAPI(unittest.TestCase):
             self.assertEqual(response.status_code, 500)
             self.assertEqual(response.data.decode(), "DATABASE_URL not found")
 
+    def test_pool_stats(self):
+        """Test connection pool statistics endpoint"""
+        response = self.app.get('/pool_stats')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        for key in ('size', 'idle', 'in_use', 'max_size', 'checkouts', 'timeouts'):
+            self.assertIn(key, data)
+
+    def test_livez(self):
+        """Test liveness never touches the database"""
+        with patch('psycopg2.connect') as mock_connect, patch.object(models.pool, 'getconn') as getconn:
+            response = self.app.get('/livez')
+            self.assertEqual((response.status_code, response.data), (200, b'OK'))
+            mock_connect.assert_not_called()
+            getconn.assert_not_called()
+
+    def test_readyz(self):
+        """Test readiness reports the probe result, 503 when the database is unavailable"""
+        report = {'status': 'ready', 'latency_ms': 0.4, 'pool': {'saturation': 0.1}}
+        with patch.object(models.readiness, 'check', return_value=(True, report)):
+            response = self.app.get('/readyz')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.data), report)
+            self.assertEqual(response.headers['Cache-Control'], 'no-store')
+        with patch.object(models.readiness, 'check', return_value=(False, dict(report, status='unavailable'))):
+            self.assertEqual(self.app.get('/readyz').status_code, 503)
+
+    def test_next_cursor_in_page_mode(self):
+        """Test page mode also hands out a cursor for the next page"""
+        with patch('models.get_books_from_db') as mock_db:
+            mock_db.return_value = (30, [self.mock_book] * 25)
+
+            response = self.app.get('/get_books')
+            data = json.loads(response.data)
+            self.assertEqual(queries.decode_cursor(data['pagination']['next_cursor']), (1000, 1))
+
+    def test_cursor_pagination(self):
+        """Test cursor mode fetches one extra row and ignores page numbers"""
+        with patch('models.get_books_from_db') as mock_db:
+            mock_db.return_value = (30, [self.mock_book] * 3)
+
+            cursor = queries.encode_cursor(2000, 7)
+            response = self.app.get(f'/get_books?per_page=2&page=9&cursor={cursor}')
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data)
+            self.assertEqual(mock_db.call_args.kwargs['after'], (2000, 7))
+            self.assertEqual(mock_db.call_args.kwargs['per_page'], 2)
+            self.assertTrue(mock_db.call_args.kwargs['lookahead'])
+            self.assertEqual(len(data['books']), 2)
+            self.assertIsNone(data['pagination']['page'])
+            self.assertTrue(data['pagination']['has_next'])
+            self.assertIsNotNone(data['pagination']['next_cursor'])
+
+    def test_cursor_last_page(self):
+        """Test the last cursor page has no next cursor"""
+        with patch('models.get_books_from_db') as mock_db:
+            mock_db.return_value = (30, [self.mock_book])
+
+            response = self.app.get(f'/get_books?per_page=2&cursor={queries.encode_cursor(None, 7)}')
+            data = json.loads(response.data)
+            self.assertFalse(data['pagination']['has_next'])
+            self.assertIsNone(data['pagination']['next_cursor'])
+
+    def test_count_none(self):
+        """Test skipping the count uses a lookahead row for has_next"""
+        with patch('models.get_books_from_db') as mock_db:
+            mock_db.return_value = (None, [self.mock_book] * 3)
+
+            response = self.app.get('/get_books?per_page=2&count=none')
+            data = json.loads(response.data)
+            self.assertEqual(mock_db.call_args.kwargs['count'], 'none')
+            self.assertEqual(mock_db.call_args.kwargs['per_page'], 2)
+            self.assertTrue(mock_db.call_args.kwargs['lookahead'])
+            self.assertIsNone(data['total_books'])
+            self.assertIsNone(data['pagination']['total_pages'])
+            self.assertEqual(len(data['books']), 2)
+            self.assertTrue(data['pagination']['has_next'])
+            self.assertEqual(data['pagination']['next_page'], 2)
+
+    def test_invalid_count_mode(self):
+        """Test unknown count modes are rejected"""
+        response = self.app.get('/get_books?count=maybe')
+        self.assertEqual(response.status_code, 400)
+
+    def test_search_and_sort(self):
+        """Test search mode and relevance sort reach the query layer"""
+        with patch('models.get_books_from_db') as mock_db:
+            mock_db.return_value = (1, [self.mock_book])
+
+            response = self.app.get('/get_books?title=emma&search=fulltext&sort=relevance')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(mock_db.call_args.kwargs['search'], 'fulltext')
+            self.assertEqual(mock_db.call_args.kwargs['sort'], 'relevance')
+
+    def test_invalid_search_and_sort(self):
+        """Test unknown search modes and sorts, and relevance with cursors, are rejected"""
+        for query in ('search=regex', 'sort=title',
+                      f'sort=relevance&cursor={queries.encode_cursor(1, 1)}'):
+            response = self.app.get(f'/get_books?{query}')
+            self.assertEqual(response.status_code, 400)
+
+    def test_response_cache_and_etag(self):
+        """Test repeated requests are served from cache with a stable ETag"""
+        models.response_cache.clear()
+        with patch('catalog.current_version', return_value=7), \
+                patch('models.get_books_from_db') as mock_db:
+            mock_db.return_value = (1, [self.mock_book])
+
+            first = self.app.get('/get_books?language=en')
+            second = self.app.get('/get_books?language=en')
+            self.assertEqual(mock_db.call_count, 1)
+            self.assertEqual(first.data, second.data)
+            self.assertEqual(first.headers['ETag'], second.headers['ETag'])
+            self.assertIn('max-age', first.headers['Cache-Control'])
+
+            not_modified = self.app.get('/get_books?language=en',
+                                        headers={'If-None-Match': first.headers['ETag']})
+            self.assertEqual(not_modified.status_code, 304)
+            self.assertEqual(not_modified.headers['Vary'], 'Accept-Encoding')
+            self.assertEqual(mock_db.call_count, 1)
+
+    def test_cached_responses_are_compressed_once(self):
+        """Test gzip is negotiated and cached pages are not compressed again"""
+        models.response_cache.clear()
+        books = [dict(self.mock_book, gutenberg_id=i) for i in range(25)]
+        with patch('catalog.current_version', return_value=7), \
+                patch('models.get_books_from_db', return_value=(25, books)):
+            plain = self.app.get('/get_books')
+            compressed_before = models.compressor.stats()['compressed']
+            first = self.app.get('/get_books', headers={'Accept-Encoding': 'gzip'})
+            second = self.app.get('/get_books', headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(models.compressor.stats()['compressed'], compressed_before + 1)
+
+            self.assertNotIn('Content-Encoding', plain.headers)
+            self.assertEqual(first.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(first.headers['Vary'], 'Accept-Encoding')
+            self.assertEqual(gzip.decompress(second.data), plain.data)
+            self.assertEqual(first.headers['ETag'], plain.headers['ETag'][:-1] + '-gzip"')
+
+            not_modified = self.app.get('/get_books', headers={'Accept-Encoding': 'gzip',
+                                                               'If-None-Match': first.headers['ETag']})
+            self.assertEqual(not_modified.status_code, 304)
+
+        response = self.app.get('/metrics')
+        self.assertIn('gutenberg_compression_compressed_total', response.data.decode())
+
+    def test_response_cache_follows_catalog_version(self):
+        """Test a new catalog version changes the ETag and bypasses cached bodies"""
+        models.response_cache.clear()
+        with patch('models.get_books_from_db') as mock_db:
+            mock_db.return_value = (1, [self.mock_book])
+            with patch('catalog.current_version', return_value=7):
+                old = self.app.get('/get_books')
+            with patch('catalog.current_version', return_value=8):
+                new = self.app.get('/get_books', headers={'If-None-Match': old.headers['ETag']})
+            self.assertEqual(new.status_code, 200)
+            self.assertNotEqual(old.headers['ETag'], new.headers['ETag'])
+            self.assertEqual(mock_db.call_count, 2)
+
+    def test_errors_are_not_cached(self):
+        """Test fallback responses after a database error are not cached"""
+        models.response_cache.clear()
+        with patch('catalog.current_version', return_value=7):
+            with patch('models.get_books_from_db', side_effect=Exception("Database error")):
+                response = self.app.get('/get_books?title=x')
+            self.assertNotIn('ETag', response.headers)
+            self.assertEqual(models.response_cache.stats()['size'], 0)
+
+    def test_stale_replica_reads_are_not_cached(self):
+        """Test a page from a replica behind the catalog version gets no ETag and no cache entry"""
+        models.response_cache.clear()
+        replica_pool = MagicMock()
+        connection = MagicMock()
+        connection.cursor.return_value.fetchone.return_value = (6,)
+
+        @contextmanager
+        def replica_connections(count=1):
+            yield replica_pool, [connection]
+
+        def query(**kwargs):
+            with models.timed_connections():
+                return 1, [self.mock_book]
+
+        with patch('catalog.current_version', return_value=7), \
+                patch.object(models.read_pool, 'connections', replica_connections), \
+                patch('models.get_books_from_db', side_effect=query):
+            response = self.app.get('/get_books?title=stale')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(json.loads(response.data)['books']), 1)
+            self.assertNotIn('ETag', response.headers)
+            self.assertEqual(models.response_cache.stats()['size'], 0)
+
+            # Once the replica has replayed version 7 the page is cached again
+            connection.cursor.return_value.fetchone.return_value = (7,)
+            response = self.app.get('/get_books?title=stale')
+            self.assertIn('ETag', response.headers)
+            self.assertEqual(models.response_cache.stats()['size'], 1)
+
+    def test_cache_stats(self):
+        """Test cache statistics endpoint"""
+        with patch('catalog.current_version', return_value=7):
+            response = self.app.get('/cache_stats')
+        data = json.loads(response.data)
+        self.assertEqual(data['catalog_version'], 7)
+        for key in ('hits', 'misses', 'evictions', 'size'):
+            self.assertIn(key, data['responses'])
+            self.assertIn(key, data['counts'])
+
+    def test_server_timing_and_metrics(self):
+        """Test phase timings reach the Server-Timing header and /metrics"""
+        models.response_cache.clear()
+        with patch('catalog.current_version', return_value=7), \
+                patch('models.get_books_from_db') as mock_db:
+            mock_db.return_value = (1, [self.mock_book])
+            response = self.app.get('/get_books?language=en&topic=war')
+            cached = self.app.get('/get_books?language=en&topic=war')
+
+        phases = [entry.split(';')[0] for entry in response.headers['Server-Timing'].split(', ')]
+        self.assertEqual(phases, ['cache', 'format', 'encode', 'compress', 'total'])
+        self.assertNotIn('format', cached.headers['Server-Timing'])
+
+        response = self.app.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.mimetype.startswith('text/plain'))
+        body = response.data.decode()
+        self.assertIn('gutenberg_books_request_seconds_count{shape="languages+topics",cache="hit"}', body)
+        self.assertIn('gutenberg_books_phase_seconds_count{shape="languages+topics",phase="encode"}', body)
+        self.assertIn('gutenberg_db_pool_checkouts_total', body)
+        self.assertIn('gutenberg_cache_hits_total{cache="responses"}', body)
+
+    def test_facets(self):
+        """Test facet counts combine bitmap filters with text matches from the database"""
+        index = FacetIndex([1, 2, 3], {
+            'languages': {'en': [1, 2], 'fr': [3]},
+            'mime_types': {'text/plain': [2, 3], 'text/html': [1, 2]},
+        })
+        with patch('models.facet_store') as mock_store, \
+                patch('catalog.current_version', return_value=1), \
+                patch('models.get_text_match_ids', return_value=[2, 3]) as mock_ids:
+            mock_store.get.return_value = index
+            response = self.app.get('/facets?language=en&author=austen&facet_limit=1')
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.data)
+        self.assertEqual(data['total_books'], 1)
+        self.assertEqual(data['facets']['languages'], [{'value': 'en', 'count': 1}])
+        self.assertEqual(data['facets']['mime_types'], [{'value': 'text/html', 'count': 1}])
+        self.assertEqual(mock_ids.call_args.args, ([], ['austen'], [], 'substring'))
+
+    def test_facets_error(self):
+        """Test facet failures are reported as 500"""
+        with patch('models.facet_store') as mock_store:
+            mock_store.get.side_effect = Exception("Database error")
+            response = self.app.get('/facets')
+        self.assertEqual(response.status_code, 500)
+
+    def test_export_books(self):
+        """Test the export streams one formatted book per line"""
+        with patch('models.export_books_from_db') as mock_export:
+            mock_export.return_value = iter([self.mock_book, self.mock_book])
+
+            response = self.app.get('/export/books?language=en,fr')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.mimetype, 'application/x-ndjson')
+            lines = response.data.decode().splitlines()
+            self.assertEqual(len(lines), 2)
+            self.assertEqual(json.loads(lines[0])['subjects'], ['Fiction', 'Drama'])
+            self.assertEqual(mock_export.call_args.kwargs['languages'], ['en', 'fr'])
+
+    def test_fields_projection(self):
+        """Test fields= reaches the query layer and trims each book"""
+        with patch('models.get_books_from_db') as mock_db:
+            mock_book = {key: self.mock_book[key]
+                         for key in ('title', 'gutenberg_id', 'download_count', 'author_info')}
+            mock_db.return_value = (1, [mock_book])
+
+            response = self.app.get('/get_books?fields=author,title&fields=gutenberg_id')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(mock_db.call_args.kwargs['fields'], ('title', 'gutenberg_id', 'author'))
+            book = json.loads(response.data)['books'][0]
+            self.assertEqual(book, {'title': 'Sample Book', 'gutenberg_id': 1,
+                                    'author': self.mock_book['author_info']})
+
+        response = self.app.get('/get_books?fields=title,isbn')
+        self.assertEqual(response.status_code, 400)
+
+    def test_subject_arrays_pass_through(self):
+        """Test subject names containing commas are not split"""
+        with patch('models.get_books_from_db') as mock_db:
+            mock_book = self.mock_book.copy()
+            mock_book['subjects'] = ['Kings and rulers -- Succession', 'Denmark, History -- Drama']
+            mock_book['bookshelves'] = None
+            mock_db.return_value = (1, [mock_book])
+
+            response = self.app.get('/get_books')
+            book = json.loads(response.data)['books'][0]
+            self.assertEqual(book['subjects'], mock_book['subjects'])
+            self.assertEqual(book['bookshelves'], [])
+
+    def test_json_provider_output(self):
+        """Test the fast JSON provider matches the stdlib provider's output"""
+        data = {'b': [1, 2.5, None], 'a': {'title': 'Hamlet', 'id': 1}, 'ok': True}
+        default = models.JSON_PROVIDERS['default'](app)
+        self.assertEqual(app.json.dumps(data), default.dumps(data, separators=(',', ':')))
+        self.assertEqual(app.json.loads(app.json.dumps(data)), data)
+        with app.app_context():
+            self.assertEqual(app.json.response(data).get_data(), default.response(data).get_data())
+
+    def test_export_books_error(self):
+        """Test a failing export query is reported before streaming starts"""
+        def failing_export(**kwargs):
+            raise Exception("Database error")
+            yield
+
+        with patch('models.export_books_from_db', side_effect=failing_export):
+            response = self.app.get('/export/books')
+            self.assertEqual(response.status_code, 500)
+
+    def test_batch_lookup(self):
+        """Test batch lookup returns books keyed by ID and reports missing IDs"""
+        with patch('models.get_books_by_ids') as mock_lookup:
+            mock_lookup.return_value = {1: self.mock_book}
+
+            response = self.app.post('/books/batch', json={'ids': [1, 99, 1]})
+            self.assertEqual(response.status_code, 200)
+            data = json.loads(response.data)
+            mock_lookup.assert_called_once_with([1, 99])
+            self.assertEqual(data['books']['1']['title'], 'Sample Book')
+            self.assertEqual(data['missing'], [99])
+
+    def test_batch_lookup_invalid_body(self):
+        """Test batch lookup rejects bodies that are not lists of integer IDs"""
+        for body in ({'ids': ['1']}, {'ids': [True]}, 'not json', [1] * (models.BATCH_MAX_IDS + 1)):
+            if isinstance(body, str):
+                response = self.app.post('/books/batch', data=body)
+            else:
+                response = self.app.post('/books/batch', json=body)
+            self.assertEqual(response.status_code, 400)
+
+    def test_invalid_cursor(self):
+        """Test a malformed cursor is rejected"""
+        response = self.app.get('/get_books?cursor=not-a-cursor')
+        self.assertEqual(response.status_code, 400)
+
     def test_filter_by_mime_type(self):
         """Test filtering by mime type"""
         with patch('models.get_books_from_db') as mock_db:
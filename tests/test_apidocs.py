@@ -0,0 +1,66 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from flask import Flask
+
+import apidocs
+from models import app
+
+
+class TestApiSpec(unittest.TestCase):
+    def setUp(self):
+        self.client = app.test_client()
+
+    def test_spec_is_cached_with_etag(self):
+        """Test /apispec.json is built once and revalidates with its ETag"""
+        response = self.client.get('/apispec.json')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('/get_books', response.get_json()['paths'])
+        etag = response.headers['ETag']
+
+        with patch('flasgger.Swagger.get_apispecs') as mock_build:
+            again = self.client.get('/apispec.json')
+            revalidated = self.client.get('/apispec.json', headers={'If-None-Match': etag})
+        mock_build.assert_not_called()
+        self.assertEqual(again.data, response.data)
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.headers['ETag'], etag)
+
+    def test_get_books_documented_once(self):
+        """Test the /get_books spec is attached without flasgger"""
+        spec = self.client.get('/apispec.json').get_json()
+        self.assertEqual(spec['paths']['/get_books']['get']['summary'],
+                         'Get books from Project Gutenberg')
+
+        @apidocs.swag_from({'summary': 'x'})
+        def view():
+            return 'ok'
+        self.assertEqual(view.specs_dict, {'summary': 'x'})
+        self.assertEqual(view(), 'ok')
+
+
+class TestDocsOff(unittest.TestCase):
+    def test_serves_spec_file_without_docs_ui(self):
+        """Test API_DOCS=off serves a prebuilt spec and no /docs/"""
+        with tempfile.NamedTemporaryFile('wb', suffix='.json', delete=False) as spec_file:
+            spec_file.write(b'{"swagger": "2.0"}')
+        self.addCleanup(os.unlink, spec_file.name)
+
+        off_app = Flask(__name__)
+        with patch.object(apidocs, 'API_DOCS', 'off'), \
+                patch.object(apidocs, 'API_SPEC_FILE', spec_file.name):
+            apidocs.init_app(off_app)
+        client = off_app.test_client()
+        response = client.get('/apispec.json')
+        self.assertEqual(response.get_json(), {'swagger': '2.0'})
+        self.assertTrue(response.headers['ETag'])
+        self.assertEqual(client.get('/docs/').status_code, 404)
+
+        with patch.object(apidocs, 'API_DOCS', 'off'), patch.object(apidocs, 'API_SPEC_FILE', None):
+            self.assertIsNone(apidocs.init_app(Flask(__name__)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import asyncio
+import importlib.util
+import json
+import unittest
+from unittest.mock import patch, AsyncMock
+
+import models
+
+# The async entry point has its own optional dependencies (requirements-asgi.txt)
+HAS_ASGI_DEPS = all(importlib.util.find_spec(name) for name in
+                    ('starlette', 'psycopg', 'psycopg_pool', 'a2wsgi', 'httpx'))
+
+
+@unittest.skipUnless(HAS_ASGI_DEPS, 'async dependencies not installed')
+class TestAsgiApp(unittest.TestCase):
+    def setUp(self):
+        from starlette.testclient import TestClient
+        import asgi
+
+        self.asgi = asgi
+        # No lifespan: the async pool is never opened in these tests
+        self.client = TestClient(asgi.app)
+        self.flask = models.app.test_client()
+        self.mock_book = {
+            'title': 'Sample Book',
+            'gutenberg_id': 1,
+            'download_count': 1000,
+            'author_info': {'name': 'Test Author', 'birth_year': 1800, 'death_year': 1880, 'id': 1},
+            'authors': [{'name': 'Test Author', 'birth_year': 1800, 'death_year': 1880, 'id': 1}],
+            'language': 'en',
+            'languages': ['en'],
+            'subjects': ['Fiction', 'Drama'],
+            'bookshelves': ['Classic Literature'],
+            'download_links': [{'mime_type': 'text/plain', 'url': 'http://example.com/book.txt'}]
+        }
+
+    def test_same_response_as_flask(self):
+        """Test the async handler returns the exact Flask response body"""
+        with patch('catalog.current_version', return_value=None), \
+                patch('asgi.get_books_from_db', new=AsyncMock(return_value=(30, [self.mock_book]))), \
+                patch('models.get_books_from_db', return_value=(30, [self.mock_book])):
+            async_response = self.client.get('/get_books?language=en&per_page=10')
+            flask_response = self.flask.get('/get_books?language=en&per_page=10')
+        self.assertEqual(async_response.status_code, 200)
+        self.assertEqual(async_response.content, flask_response.data)
+
+    def test_lagging_snapshot_is_not_cached(self):
+        """Test a page from the previous memory snapshot gets no ETag or cache entry"""
+        from test_memory_catalog import sample_snapshot
+        models.response_cache.clear()
+        with patch.object(models, 'QUERY_STRATEGY', 'memory'), \
+                patch('catalog.current_version', return_value=2), \
+                patch.object(models.memory_store, 'get', return_value=sample_snapshot(version=1)):
+            response = self.client.get('/get_books?title=war')
+        self.assertEqual(len(json.loads(response.content)['books']), 2)
+        self.assertNotIn('ETag', response.headers)
+        self.assertEqual(models.response_cache.stats()['size'], 0)
+
+    def test_not_modified_keeps_vary(self):
+        """Test a 304 carries the same Vary header as the 200 it revalidates"""
+        models.response_cache.clear()
+        with patch('catalog.current_version', return_value=7), \
+                patch('asgi.get_books_from_db', new=AsyncMock(return_value=(1, [self.mock_book]))):
+            response = self.client.get('/get_books?title=vary')
+            revalidated = self.client.get('/get_books?title=vary',
+                                          headers={'If-None-Match': response.headers['ETag']})
+        self.assertEqual(revalidated.status_code, 304)
+        self.assertEqual(revalidated.headers['Vary'], response.headers['Vary'])
+        models.response_cache.clear()
+
+    def test_validation_errors(self):
+        """Test invalid parameters are rejected like in the Flask app"""
+        response = self.client.get('/get_books?count=maybe')
+        self.assertEqual(response.status_code, 400)
+
+    def test_database_error(self):
+        """Test database errors return the empty result set"""
+        with patch('catalog.current_version', return_value=None), \
+                patch('asgi.get_books_from_db', new=AsyncMock(side_effect=Exception("Database error"))):
+            response = self.client.get('/get_books')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content)['total_books'], 0)
+
+    def test_count_and_page_run_concurrently(self):
+        """Test both statements are dispatched together"""
+        models.invalidate_count_cache()
+        fetch = AsyncMock(side_effect=[{'count': 2}, [self.mock_book]])
+        with patch('asgi._fetch', new=fetch), patch('asgi.asyncio.gather', wraps=self.asgi.asyncio.gather) as gather:
+            total, books = asyncio.run(self.asgi.get_books_from_db(languages=['en']))
+        self.assertEqual((total, books), (2, [self.mock_book]))
+        self.assertEqual(gather.call_count, 1)
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_flask_routes_are_mounted(self):
+        """Test docs and the other endpoints are served by the Flask app"""
+        self.assertEqual(self.client.get('/apispec.json').status_code, 200)
+        self.assertEqual(self.client.get('/pool_stats').status_code, 200)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+
+import catalog_load
+from bench import run, seed
+
+
+class TestSeed(unittest.TestCase):
+    def test_catalog_is_deterministic(self):
+        """Test the same seed always generates the same catalog"""
+        first = seed.generate_catalog(books=200, seed=3)
+        self.assertEqual(first, seed.generate_catalog(books=200, seed=3))
+        self.assertNotEqual(first['books_book'], seed.generate_catalog(books=200, seed=4)['books_book'])
+
+    def test_catalog_shape(self):
+        """Test every table is generated and link rows point at real books"""
+        catalog = seed.generate_catalog(books=500, seed=1)
+        self.assertEqual(set(catalog), set(catalog_load.COLUMNS))
+        self.assertEqual(len(catalog['books_book']), 500)
+        for table, columns in catalog_load.COLUMNS.items():
+            self.assertTrue(all(len(row) == len(columns) for row in catalog[table]), table)
+        book_ids = {row[1] for row in catalog['books_book']}
+        self.assertTrue(all(row[0] in book_ids for row in catalog['books_format']))
+        self.assertGreater(len(catalog['books_format']), len(catalog['books_book']))
+
+
+class TestRun(unittest.TestCase):
+    terms = {
+        'languages': ['en', 'fr'],
+        'topics': ['War'],
+        'authors': ['Austen'],
+        'titles': ['Emma'],
+        'mime_types': ['text/html'],
+        'book_ids': list(range(1, 100)),
+        'last_page': 40,
+    }
+
+    def test_plan_covers_every_shape(self):
+        """Test the plan is deterministic and has the requested mix"""
+        plan = run.build_plan(self.terms, list(run.SHAPES), 3, seed=1)
+        self.assertEqual(plan, run.build_plan(self.terms, list(run.SHAPES), 3, seed=1))
+        self.assertEqual(len(plan), 3 * len(run.SHAPES))
+        params = dict((shape, dict(p)) for shape, p in plan)
+        self.assertEqual(params['combined'], {'language': 'en', 'topic': 'War'})
+        self.assertTrue(20 <= params['deep_page']['page'] <= 40)
+
+    def test_percentile(self):
+        """Test nearest-rank percentiles"""
+        values = list(range(1, 101))
+        self.assertEqual(run.percentile(values, 50), 50)
+        self.assertEqual(run.percentile(values, 99), 99)
+        self.assertEqual(run.percentile([7], 95), 7)
+        self.assertIsNone(run.percentile([], 50))
+
+    def test_replay_and_compare(self):
+        """Test replay records timings and errors and flags p95 regressions"""
+        plan = run.build_plan(self.terms, ['unfiltered', 'title'], 5, seed=1)
+        send = lambda query_string: 500 if 'title' in query_string else 200
+        timings, errors, wall = run.replay(send, plan, concurrency=2, warmup=2)
+        self.assertEqual(sum(len(values) for values in timings.values()), 8)
+        self.assertEqual(errors.get('title'), len(timings['title']))
+
+        summary = run.summarize(timings, errors, wall)
+        self.assertEqual(summary['all']['requests'], 8)
+        self.assertEqual(run.compare(summary, summary), [])
+        current = {'unfiltered': {'p95_ms': 13.0}, 'title': {'p95_ms': 12.0}}
+        baseline = {'unfiltered': {'p95_ms': 10.0}, 'title': {'p95_ms': 10.0}}
+        self.assertEqual(run.compare(current, baseline, max_regression=1.25),
+                         [('unfiltered', 10.0, 13.0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
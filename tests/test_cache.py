@@ -0,0 +1,49 @@
+import unittest
+from unittest.mock import patch
+
+from cache import TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+    def test_hit_and_miss(self):
+        """Test cached values are returned and counted"""
+        cache = TTLCache(max_size=2, ttl=60)
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_expiry(self):
+        """Test entries expire after their TTL"""
+        cache = TTLCache(ttl=10)
+        with patch('time.monotonic', return_value=100):
+            cache.set('a', 1)
+        with patch('time.monotonic', return_value=111):
+            self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats()['expirations'], 1)
+
+    def test_lru_eviction(self):
+        """Test the least recently used entry is evicted when full"""
+        cache = TTLCache(max_size=2, ttl=60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_invalidate_and_clear(self):
+        """Test explicit invalidation"""
+        cache = TTLCache()
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.invalidate('a')
+        self.assertIsNone(cache.get('a'))
+        cache.clear()
+        self.assertEqual(cache.stats()['size'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+from contextlib import contextmanager
+from unittest.mock import patch, MagicMock
+
+import psycopg2
+
+import catalog
+
+
+class TestCatalogVersion(unittest.TestCase):
+    def setUp(self):
+        catalog.reset()
+        self.addCleanup(catalog.reset)
+        self.cursor = MagicMock()
+        connection = MagicMock()
+        connection.cursor.return_value = self.cursor
+
+        @contextmanager
+        def fake_connection():
+            yield connection
+
+        patcher = patch.object(catalog.pool, 'connection', fake_connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_version_is_cached(self):
+        """Test the version is read once per TTL"""
+        self.cursor.fetchone.return_value = (3,)
+        self.assertEqual(catalog.current_version(), 3)
+        self.assertEqual(catalog.current_version(), 3)
+        self.assertEqual(self.cursor.execute.call_count, 1)
+
+    def test_unavailable_version(self):
+        """Test a missing catalog_version table yields None"""
+        self.cursor.execute.side_effect = psycopg2.ProgrammingError("relation does not exist")
+        self.assertIsNone(catalog.current_version())
+
+    def test_change_listeners(self):
+        """Test listeners are told when the version moves"""
+        changes = []
+        catalog._listeners.append(lambda old, new: changes.append((old, new)))
+        self.addCleanup(catalog._listeners.pop)
+
+        self.cursor.fetchone.return_value = (3,)
+        catalog.current_version()
+        self.cursor.fetchone.return_value = (4,)
+        with patch('time.monotonic', return_value=10 ** 9):
+            self.assertEqual(catalog.current_version(), 4)
+        self.assertEqual(changes, [(3, 4)])
+
+    def test_change_across_failed_read(self):
+        """Test a version change is reported even when a read in between failed"""
+        changes = []
+        catalog._listeners.append(lambda old, new: changes.append((old, new)))
+        self.addCleanup(catalog._listeners.pop)
+
+        self.cursor.fetchone.return_value = (3,)
+        catalog.current_version()
+        self.cursor.execute.side_effect = psycopg2.OperationalError("server closed the connection")
+        with patch('time.monotonic', return_value=10 ** 9):
+            self.assertIsNone(catalog.current_version())
+        self.cursor.execute.side_effect = None
+        self.cursor.fetchone.return_value = (4,)
+        with patch('time.monotonic', return_value=2 * 10 ** 9):
+            self.assertEqual(catalog.current_version(), 4)
+        self.assertEqual(changes, [(3, 4)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+from unittest.mock import MagicMock
+
+import catalog_load
+
+
+class TestCatalogLoad(unittest.TestCase):
+    def test_copy_value(self):
+        """Test values are escaped for COPY text format"""
+        self.assertEqual(catalog_load._copy_value(None), '\\N')
+        self.assertEqual(catalog_load._copy_value(True), 't')
+        self.assertEqual(catalog_load._copy_value('a\tb\\c'), 'a\\tb\\\\c')
+
+    def test_row_reader(self):
+        """Test rows are streamed as COPY text in reads of any size"""
+        rows = [(1, 'a\tb', None), (2, 'c', True)]
+        expected = '1\ta\\tb\t\\N\n2\tc\tt\n'
+        self.assertEqual(catalog_load._RowReader(rows).read(), expected)
+        reader = catalog_load._RowReader(rows)
+        chunks = iter(lambda: reader.read(5), '')
+        self.assertEqual(''.join(chunks), expected)
+
+    def test_schema_statements(self):
+        """Test keys and indexes are split from the table definitions"""
+        create, constrain = catalog_load.schema_statements()
+        self.assertEqual(create[0], 'DROP VIEW IF EXISTS book_document_source')
+        self.assertTrue(create[1].startswith('DROP TABLE'))
+        self.assertNotIn('CASCADE', create[1])
+        self.assertTrue(all(statement.startswith('CREATE TABLE') for statement in create[2:]))
+        self.assertEqual(len(create) - 2, len(catalog_load.COLUMNS))
+        self.assertTrue(all(statement.startswith(('ALTER TABLE', 'CREATE INDEX')) for statement in constrain))
+
+    def test_check_dependents(self):
+        """Test a load refuses to drop triggers and views that only the migrations re-create"""
+        connection = MagicMock()
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.fetchall.return_value = []
+        self.assertEqual(catalog_load.check_dependents(connection, migrations=[]), [])
+        cursor.fetchall.return_value = [('trigger books_book_catalog_version on books_book',)]
+        with self.assertRaisesRegex(RuntimeError, 'books_book_catalog_version'):
+            catalog_load.check_dependents(connection, migrations=[])
+        self.assertEqual(catalog_load.check_dependents(connection),
+                         ['trigger books_book_catalog_version on books_book'])
+
+    def test_finish_load_checks_dependents(self):
+        """Test finish_load fails when the migrations did not re-create a dropped trigger"""
+        connection = MagicMock()
+        cursor = connection.cursor.return_value.__enter__.return_value
+        cursor.fetchone.return_value = (False,)
+        cursor.fetchall.return_value = [('view book_document_source',)]
+        catalog_load.finish_load(connection, [], log=lambda message: None,
+                         dependents=['view book_document_source'])
+        with self.assertRaisesRegex(RuntimeError, 'my_audit'):
+            catalog_load.finish_load(connection, [], log=lambda message: None,
+                             dependents=['trigger my_audit on books_book', 'view book_document_source'])
+
+    def test_split_statements(self):
+        """Test scripts split on top-level semicolons only"""
+        sql = """
+            -- a comment; not a statement
+            CREATE INDEX a ON t (x);
+            INSERT INTO t VALUES ('x;y', 'it''s');
+            CREATE FUNCTION f() RETURNS void AS $$ BEGIN PERFORM 1; END $$ LANGUAGE plpgsql;
+            DO $body$ BEGIN NULL; END $body$
+        """
+        statements = catalog_load.split_statements(sql)
+        self.assertEqual(len(statements), 4)
+        self.assertEqual(statements[1], "INSERT INTO t VALUES ('x;y', 'it''s')")
+        self.assertTrue(statements[2].endswith('LANGUAGE plpgsql'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import gzip
+import unittest
+
+from flask import Flask
+
+import compression
+from compression import CompressedBody, Compressor, etag_variants
+
+
+BODY = b'{"books": [' + b','.join(b'{"title": "Sample Book %d"}' % i for i in range(200)) + b']}'
+
+
+class TestCompressor(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+
+    def response(self, body=BODY, mimetype='application/json', status=200):
+        return self.app.response_class(body, mimetype=mimetype, status=status)
+
+    def test_select(self):
+        """Test encodings are negotiated from Accept-Encoding and size"""
+        compressor = Compressor(min_size=100)
+        self.assertEqual(compressor.select(1000, 'gzip'), 'gzip')
+        self.assertEqual(compressor.select(1000, 'gzip;q=0.5, identity'), 'gzip')
+        self.assertEqual(compressor.select(1000, 'gzip;q=0, deflate'), None)
+        self.assertEqual(compressor.select(1000, 'deflate'), None)
+        self.assertEqual(compressor.select(1000, None), None)
+        self.assertEqual(compressor.select(99, 'gzip'), None)
+        self.assertEqual(Compressor(enabled=False).select(1000, 'gzip'), None)
+        if 'br' in compression.ENCODINGS:
+            self.assertEqual(compressor.select(1000, 'gzip, deflate, br'), 'br')
+            self.assertEqual(compressor.select(1000, 'gzip, br;q=0.5'), 'gzip')
+
+    def test_apply(self):
+        """Test qualifying responses are compressed with a suffixed ETag"""
+        compressor = Compressor()
+        response = self.response()
+        response.set_etag('abc')
+        compressor.apply(response, 'gzip')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(response.get_etag(), ('abc-gzip', False))
+        self.assertIn('Accept-Encoding', response.vary)
+        self.assertEqual(gzip.decompress(response.get_data()), BODY)
+        self.assertEqual(response.content_length, len(response.get_data()))
+
+        stats = compressor.stats()
+        self.assertEqual((stats['compressed'], stats['bytes_in']), (1, len(BODY)))
+        self.assertLess(stats['bytes_out'], stats['bytes_in'])
+
+    def test_apply_skips(self):
+        """Test small, non-JSON and non-200 responses are left as they are"""
+        compressor = Compressor()
+        for response in (self.response(b'{}'), self.response(mimetype='text/html'),
+                         self.response(status=404)):
+            compressor.apply(response, 'gzip')
+            self.assertNotIn('Content-Encoding', response.headers)
+        response = self.response()
+        compressor.apply(response, 'identity')
+        self.assertNotIn('Content-Encoding', response.headers)
+        self.assertIn('Accept-Encoding', response.vary)
+
+    def test_compressed_body_is_compressed_once(self):
+        """Test a cached body keeps its compressed variants"""
+        compressor = Compressor()
+        body = CompressedBody(BODY)
+        first = compressor.apply(self.response(), 'gzip', body)
+        second = compressor.apply(self.response(), 'gzip', body)
+        self.assertEqual(first.get_data(), second.get_data())
+        self.assertEqual(body.get(compressor, None), BODY)
+        stats = compressor.stats()
+        self.assertEqual((stats['compressed'], stats['reused']), (1, 1))
+
+    def test_etag_variants(self):
+        """Test the plain ETag is listed first, then one per encoding"""
+        variants = etag_variants('abc')
+        self.assertEqual(variants[0], 'abc')
+        self.assertIn('abc-gzip', variants)
+        self.assertEqual(len(variants), 1 + len(compression.ENCODINGS))
+
+
+if __name__ == '__main__':
+    unittest.main()
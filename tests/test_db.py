@@ -0,0 +1,141 @@
+import unittest
+from unittest.mock import patch, MagicMock
+
+import psycopg2
+import psycopg2.extensions as _ext
+
+from conftest import make_connection
+from db import ConnectionPool, PoolTimeout
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        patcher = patch('psycopg2.connect', side_effect=lambda **kw: make_connection())
+        self.mock_connect = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = ConnectionPool({'dbname': 'test'}, min_size=1, max_size=2, timeout=0.05)
+
+    def test_connection_is_reused(self):
+        """Test a returned connection is handed out again"""
+        with self.pool.connection() as first:
+            pass
+        with self.pool.connection() as second:
+            pass
+        self.assertIs(first, second)
+        self.assertEqual(self.mock_connect.call_count, 1)
+
+    def test_connect_timeout(self):
+        """Test new connections give up connecting after the checkout timeout, at least libpq's 2s"""
+        self.pool.getconn()
+        self.assertEqual(self.mock_connect.call_args.kwargs, {'dbname': 'test', 'connect_timeout': 2})
+        pool = ConnectionPool({'dbname': 'test'}, timeout=7.5)
+        pool.getconn()
+        self.assertEqual(self.mock_connect.call_args.kwargs['connect_timeout'], 8)
+        pool = ConnectionPool({'dbname': 'test', 'connect_timeout': 1}, connect_timeout=30)
+        pool.getconn()
+        self.assertEqual(self.mock_connect.call_args.kwargs['connect_timeout'], 1)
+
+    def test_checkout_timeout(self):
+        """Test checkout fails after the timeout when the pool is exhausted"""
+        self.pool.getconn()
+        self.pool.getconn()
+        with self.assertRaises(PoolTimeout):
+            self.pool.getconn()
+        self.assertEqual(self.pool.stats()['timeouts'], 1)
+        with self.assertRaisesRegex(PoolTimeout, 'within 0s'):
+            self.pool.getconn(timeout=0)
+
+    def test_try_getconn(self):
+        """Test try_getconn hands out a free connection but never waits for one"""
+        first = self.pool.try_getconn()
+        second = self.pool.try_getconn()
+        self.assertIsNotNone(first)
+        self.assertIsNotNone(second)
+        self.assertIsNone(self.pool.try_getconn())
+        self.assertEqual((self.pool.stats()['in_use'], self.pool.stats()['timeouts']), (2, 0))
+        self.pool.putconn(first)
+        self.assertIs(self.pool.try_getconn(), first)
+
+    def test_broken_connection_is_discarded(self):
+        """Test connections that failed with an operational error are not reused"""
+        with self.assertRaises(psycopg2.OperationalError):
+            with self.pool.connection() as conn:
+                raise psycopg2.OperationalError("server closed the connection")
+        self.assertTrue(conn.close.called)
+        with self.pool.connection() as other:
+            self.assertIsNot(conn, other)
+        self.assertEqual(self.pool.stats()['connections_discarded'], 1)
+
+    def test_cancelled_statement_keeps_connection(self):
+        """Test a statement timeout or recovery conflict does not discard the connection"""
+        for error in (_ext.QueryCanceledError, _ext.TransactionRollbackError):
+            with self.assertRaises(error):
+                with self.pool.connection() as conn:
+                    raise error("canceling statement")
+            self.assertFalse(conn.close.called)
+            with self.pool.connection() as other:
+                self.assertIs(conn, other)
+        self.assertEqual(self.pool.stats()['connections_discarded'], 0)
+
+    def test_expired_connection_is_recycled(self):
+        """Test connections older than max_lifetime are replaced"""
+        self.pool.max_lifetime = 0.001
+        with self.pool.connection() as first:
+            pass
+        with patch('time.monotonic', return_value=10 ** 9):
+            with self.pool.connection() as second:
+                pass
+        self.assertIsNot(first, second)
+
+    def test_transaction_rolled_back_on_return(self):
+        """Test connections are returned to an idle transaction state"""
+        with self.pool.connection() as conn:
+            conn.info.transaction_status = _ext.TRANSACTION_STATUS_INTRANS
+        self.assertTrue(conn.rollback.called)
+
+    def test_fork_resets_pool(self):
+        """Test a pool used from a new process does not reuse inherited connections"""
+        with self.pool.connection() as parent_conn:
+            pass
+        with patch('os.getpid', return_value=-1):
+            with self.pool.connection() as child_conn:
+                pass
+            self.assertEqual(self.pool.stats()['pid'], -1)
+        self.assertIsNot(parent_conn, child_conn)
+        self.assertFalse(parent_conn.close.called)
+
+    def test_connection_returned_after_fork(self):
+        """Test returning a connection checked out before a fork leaves the counts consistent"""
+        parent_conn = self.pool.getconn()
+        with patch('os.getpid', return_value=-1):
+            self.pool.putconn(parent_conn)
+            stats = self.pool.stats()
+            self.assertEqual((stats['pid'], stats['size'], stats['in_use']), (-1, 0, 0))
+            child_conn = self.pool.getconn()
+            other_parent_conn = MagicMock()
+            self.pool._inherited.append(other_parent_conn)
+            self.pool.putconn(other_parent_conn)
+            self.assertEqual((self.pool.stats()['size'], self.pool.stats()['in_use']), (1, 1))
+            self.pool.putconn(child_conn)
+            self.assertEqual((self.pool.stats()['size'], self.pool.stats()['in_use']), (1, 0))
+            self.pool.getconn()
+            self.pool.getconn()
+        self.assertFalse(parent_conn.close.called)
+        self.assertFalse(other_parent_conn.close.called)
+
+    def test_stats(self):
+        """Test pool statistics reflect checkouts"""
+        conn = self.pool.getconn()
+        stats = self.pool.stats()
+        self.assertEqual(stats['in_use'], 1)
+        self.assertEqual(stats['size'], 1)
+        self.assertEqual(stats['saturation'], 0.5)
+        self.pool.putconn(conn)
+        stats = self.pool.stats()
+        self.assertEqual(stats['in_use'], 0)
+        self.assertEqual(stats['idle'], 1)
+        self.assertEqual(stats['checkouts'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
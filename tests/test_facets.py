@@ -0,0 +1,83 @@
+import threading
+import time
+import unittest
+from unittest.mock import patch, MagicMock
+
+from facets import FacetIndex, FacetStore
+
+
+def sample_index(version=1):
+    return FacetIndex(
+        book_ids=[1, 2, 3, 4],
+        facets={
+            'languages': {'en': [1, 2, 3], 'fr': [4]},
+            'mime_types': {'text/plain': [1, 2, 4], 'text/html': [1]},
+            'bookshelves': {'Classics': [1, 4]},
+            'subjects': {'Tragedy': [1], 'Drama': [1, 2]},
+            'authors': {'Austen, Jane': [2, 3]},
+        },
+        version=version)
+
+
+class TestFacetIndex(unittest.TestCase):
+    def test_bitmaps(self):
+        """Test id lists become bitmaps and unknown ids are ignored"""
+        index = sample_index()
+        self.assertEqual(index.count(index.all), 4)
+        self.assertEqual(index.count(index.bitmap([2, 3, 99])), 2)
+        self.assertEqual(index.count(index.union('languages', ['en', 'fr', 'de'])), 4)
+        self.assertEqual(index.union('languages', ['de']), 0)
+
+    def test_counts(self):
+        """Test facet counts are restricted to the matching books, largest first"""
+        index = sample_index()
+        counts = index.counts(index.union('languages', ['en']))
+        self.assertEqual(counts['languages'], [{'value': 'en', 'count': 3}])
+        self.assertEqual(counts['mime_types'], [{'value': 'text/plain', 'count': 2},
+                                                {'value': 'text/html', 'count': 1}])
+        self.assertEqual(counts['subjects'][0], {'value': 'Drama', 'count': 2})
+        self.assertEqual(index.counts(index.all, limit=1)['languages'], [{'value': 'en', 'count': 3}])
+        self.assertEqual(index.counts(0)['authors'], [])
+
+    def test_load(self):
+        """Test the index loads ids and every facet from the database"""
+        cursor = MagicMock()
+        cursor.fetchall.side_effect = [
+            [{'gutenberg_id': 1}, {'gutenberg_id': 2}],
+            [{'value': 'en', 'book_ids': [1, 2]}], [], [], [], [],
+        ]
+        connection = MagicMock()
+        connection.cursor.return_value = cursor
+        index = FacetIndex.load(connection, version=5, top_subjects=10)
+        self.assertEqual(index.version, 5)
+        self.assertEqual(index.count(index.union('languages', ['en'])), 2)
+        self.assertIn('LIMIT 10', cursor.execute.call_args_list[4].args[0])
+
+
+class TestFacetStore(unittest.TestCase):
+    def test_builds_once_then_refreshes_in_background(self):
+        """Test a new catalog version is rebuilt while the old index is served"""
+        store = FacetStore(pool=MagicMock())
+        built = threading.Event()
+
+        def build(version):
+            built.set()
+            return sample_index(version)
+
+        with patch.object(store, '_build', side_effect=build) as mock_build:
+            first = store.get(1)
+            self.assertIs(store.get(1), first)
+            self.assertEqual(mock_build.call_count, 1)
+
+            built.clear()
+            self.assertIs(store.get(2), first)
+            self.assertTrue(built.wait(1))
+            for _ in range(100):
+                if store.get(2).version == 2:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(store.get(2).version, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import threading
+import unittest
+from unittest.mock import patch
+
+import psycopg2
+
+from conftest import make_connection
+from db import ConnectionPool
+from health import ReadinessProbe
+
+
+class TestReadinessProbe(unittest.TestCase):
+    def setUp(self):
+        patcher = patch('psycopg2.connect', side_effect=lambda **kw: make_connection())
+        self.mock_connect = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pool = ConnectionPool({'dbname': 'test'}, max_size=2, timeout=5)
+
+    def test_ready(self):
+        """Test a probe reports latency and pool saturation from a pooled connection"""
+        probe = ReadinessProbe(self.pool, interval=60, timeout=1)
+        ready, report = probe.check()
+        self.assertTrue(ready)
+        self.assertEqual((report['status'], report['cached']), ('ready', False))
+        self.assertIsNotNone(report['latency_ms'])
+        self.assertEqual((report['pool']['in_use'], report['pool']['max_size']), (0, 2))
+        self.assertEqual(self.pool.stats()['checkouts'], 1)
+
+    def test_result_is_cached(self):
+        """Test probes within the interval reuse the last result"""
+        probe = ReadinessProbe(self.pool, interval=60, timeout=1)
+        probe.check()
+        ready, report = probe.check()
+        self.assertTrue(ready and report['cached'])
+        self.assertEqual(self.pool.stats()['checkouts'], 1)
+        self.assertEqual((probe.stats()['probes'], probe.stats()['cached']), (1, 1))
+
+        probe.interval = 0
+        probe.check()
+        self.assertEqual(self.pool.stats()['checkouts'], 2)
+
+    def test_failure(self):
+        """Test a database error makes the probe unavailable"""
+        self.mock_connect.side_effect = psycopg2.OperationalError("could not connect to server")
+        probe = ReadinessProbe(self.pool, interval=60, timeout=1)
+        ready, report = probe.check()
+        self.assertFalse(ready)
+        self.assertEqual(report['status'], 'unavailable')
+        self.assertIn('could not connect', report['error'])
+        self.assertEqual(probe.stats()['failures'], 1)
+
+    def test_exhausted_pool(self):
+        """Test a saturated pool fails the probe after its timeout, not the pool's"""
+        held = [self.pool.getconn() for _ in range(2)]
+        probe = ReadinessProbe(self.pool, interval=60, timeout=0.05)
+        ready, report = probe.check()
+        self.assertFalse(ready)
+        self.assertEqual(report['pool']['saturation'], 1.0)
+        self.assertIn('PoolTimeout', report['error'])
+        for connection in held:
+            self.pool.putconn(connection)
+
+    def test_slow_database(self):
+        """Test callers give up after the timeout while one probe stays in flight"""
+        release = threading.Event()
+        connection = make_connection()
+        connection.cursor.return_value.execute.side_effect = lambda sql: release.wait(5)
+        self.mock_connect.side_effect = lambda **kw: connection
+        probe = ReadinessProbe(self.pool, interval=60, timeout=0.05)
+
+        for _ in range(3):
+            ready, report = probe.check()
+            self.assertFalse(ready)
+            self.assertIn('no answer within', report['error'])
+        self.assertEqual(connection.cursor.return_value.execute.call_count, 1)
+        self.assertEqual(probe.stats()['timeouts'], 3)
+
+        release.set()
+        for _ in range(100):
+            if probe.stats()['probes']:
+                break
+            threading.Event().wait(0.01)
+        self.assertTrue(probe.check()[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
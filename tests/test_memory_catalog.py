@@ -0,0 +1,163 @@
+import unittest
+from unittest.mock import patch, MagicMock
+
+import memory_catalog
+from memory_catalog import CatalogSnapshot
+
+
+def book(gutenberg_id, download_count, title):
+    return {'title': title, 'gutenberg_id': gutenberg_id, 'download_count': download_count,
+            'author_info': {'name': 'Author', 'birth_year': None, 'death_year': None, 'id': 1},
+            'authors': [{'name': 'Author', 'birth_year': None, 'death_year': None, 'id': 1}],
+            'language': 'en', 'languages': ['en'], 'subjects': [], 'bookshelves': [], 'download_links': []}
+
+
+def sample_snapshot(version=1):
+    return CatalogSnapshot(
+        books=[book(1, 100, 'Pride and Prejudice'), book(2, 300, 'War and Peace'),
+               book(3, None, 'The Art of War'), book(4, 100, 'Les Misérables'),
+               book(5, None, 'Hamlet')],
+        postings={
+            'languages': {'en': [1, 2, 3, 5], 'fr': [4]},
+            'mime_types': {'text/plain': [1, 2, 4], 'text/html': [3]},
+            'subjects': {'War -- Fiction': [2], 'Military art and science': [3]},
+            'bookshelves': {'Best Books Ever Listings': [1, 2]},
+            'authors': {'Tolstoy, Leo': [2], 'Sunzi': [3]},
+        },
+        version=version)
+
+
+def ids(result):
+    return [row['gutenberg_id'] for row in result[1]]
+
+
+class TestCatalogSnapshot(unittest.TestCase):
+    def test_order_and_pagination(self):
+        """Test books come in download order, NULLs last, and pages are slices"""
+        snapshot = sample_snapshot()
+        self.assertEqual(ids(snapshot.search({}, per_page=10)), [2, 4, 1, 5, 3])
+        total, books = snapshot.search({}, page=2, per_page=2)
+        self.assertEqual(total, 5)
+        self.assertEqual([b['gutenberg_id'] for b in books], [1, 5])
+        self.assertEqual(books[0], book(1, 100, 'Pride and Prejudice'))
+        self.assertIsNone(snapshot.search({}, count='none')[0])
+
+    def test_filters(self):
+        """Test each filter and their intersection"""
+        snapshot = sample_snapshot()
+        self.assertEqual(ids(snapshot.search({'languages': ['fr', 'de']})), [4])
+        self.assertEqual(ids(snapshot.search({'mime_types': ['text/plain']})), [2, 4, 1])
+        self.assertEqual(ids(snapshot.search({'topics': ['WAR']})), [2])
+        self.assertEqual(ids(snapshot.search({'topics': ['best', 'military']})), [2, 1, 3])
+        self.assertEqual(ids(snapshot.search({'authors': ['tolstoy', 'sun']})), [2, 3])
+        self.assertEqual(ids(snapshot.search({'titles': ['war']})), [2, 3])
+        self.assertEqual(ids(snapshot.search({'book_ids': [5, 1, 99]})), [1, 5])
+        self.assertEqual(snapshot.search({'titles': ['war'], 'languages': ['en'],
+                                          'mime_types': ['text/plain']})[0], 1)
+        self.assertEqual(snapshot.search({'titles': ['nothing']}), (0, []))
+
+    def test_keyset_cursor(self):
+        """Test a cursor continues after its book, even one that no longer exists"""
+        snapshot = sample_snapshot()
+        self.assertEqual(ids(snapshot.search({}, after=(100, 4))), [1, 5, 3])
+        self.assertEqual(ids(snapshot.search({}, after=(200, 99))), [4, 1, 5, 3])
+        self.assertEqual(ids(snapshot.search({}, after=(None, 5))), [3])
+        self.assertEqual(ids(snapshot.search({'languages': ['en']}, after=(300, 2))), [1, 5, 3])
+
+    def test_supports(self):
+        """Test full-text search, relevance and LIKE wildcards go to Postgres"""
+        self.assertTrue(memory_catalog.supports(titles=['war']))
+        self.assertFalse(memory_catalog.supports(search='fulltext'))
+        self.assertFalse(memory_catalog.supports(sort='relevance'))
+        self.assertFalse(memory_catalog.supports(titles=['100%']))
+
+    def test_load(self):
+        """Test a snapshot loads hydrated rows and every posting list"""
+        cursor = MagicMock()
+        cursor.fetchall.side_effect = [
+            [book(1, 5, 'A'), book(2, 7, 'B')],
+            [{'value': 'en', 'book_ids': [1, 2]}], [], [], [], [],
+        ]
+        connection = MagicMock()
+        connection.cursor.return_value = cursor
+        snapshot = CatalogSnapshot.load(connection, version=3)
+        self.assertEqual(snapshot.version, 3)
+        self.assertEqual(ids(snapshot.search({'languages': ['en']})), [2, 1])
+        self.assertEqual(cursor.execute.call_count, 6)
+
+
+class TestMemoryStrategy(unittest.TestCase):
+    def test_serves_from_snapshot_or_falls_back(self):
+        """Test the memory strategy answers in-process once a snapshot is loaded"""
+        import models
+        snapshot = sample_snapshot()
+        with patch.object(models, 'QUERY_STRATEGY', 'memory'), \
+                patch('models.catalog.current_version', return_value=1), \
+                patch.object(models.memory_store, 'get', return_value=snapshot) as mock_get:
+            total, books = models.get_books_from_memory({'titles': ['war']}, 1, 25)
+            self.assertEqual((total, [b['gutenberg_id'] for b in books]), (2, [2, 3]))
+            mock_get.assert_called_once_with(1, wait=False)
+
+            self.assertIsNone(models.get_books_from_memory({}, 1, 25, search='fulltext'))
+            mock_get.return_value = None
+            self.assertIsNone(models.get_books_from_memory({}, 1, 25))
+
+        self.assertIsNone(models.get_books_from_memory({}, 1, 25))
+
+    def test_lookahead_pages_do_not_skip_books(self):
+        """Test walking count=none pages returns every book exactly once"""
+        import models
+        client = models.app.test_client()
+        with patch.object(models, 'QUERY_STRATEGY', 'memory'), \
+                patch('models.catalog.current_version', return_value=None), \
+                patch.object(models.memory_store, 'get', return_value=sample_snapshot()):
+            seen = []
+            for page in (1, 2, 3):
+                data = client.get(f'/get_books?per_page=2&count=none&page={page}').get_json()
+                seen += [b['gutenberg_id'] for b in data['books']]
+                self.assertEqual(data['pagination']['has_next'], page < 3)
+        self.assertEqual(seen, [2, 4, 1, 5, 3])
+
+    def test_every_author_and_language(self):
+        """Test a book with two authors and languages lists both, the first as author and language"""
+        import models
+        client = models.app.test_client()
+        two_authors = book(6, 50, 'Good Omens')
+        two_authors.update({
+            'author_info': {'name': 'Gaiman, Neil', 'birth_year': 1960, 'death_year': None, 'id': 2},
+            'authors': [{'name': 'Gaiman, Neil', 'birth_year': 1960, 'death_year': None, 'id': 2},
+                        {'name': 'Pratchett, Terry', 'birth_year': 1948, 'death_year': 2015, 'id': 3}],
+            'language': 'de', 'languages': ['de', 'en']})
+        snapshot = CatalogSnapshot(books=[two_authors], postings={'languages': {'de': [6], 'en': [6]}})
+        with patch.object(models, 'QUERY_STRATEGY', 'memory'), \
+                patch('models.catalog.current_version', return_value=None), \
+                patch.object(models.memory_store, 'get', return_value=snapshot):
+            found = client.get('/get_books?language=en').get_json()['books']
+        self.assertEqual([a['id'] for a in found[0]['authors']], [2, 3])
+        self.assertEqual(found[0]['author']['id'], 2)
+        self.assertEqual((found[0]['languages'], found[0]['language']), (['de', 'en'], 'de'))
+
+    def test_lagging_snapshot_is_not_cached(self):
+        """Test a page from the previous snapshot gets no ETag and no cache entry under the new version"""
+        import models
+        client = models.app.test_client()
+        models.response_cache.clear()
+        with patch.object(models, 'QUERY_STRATEGY', 'memory'), \
+                patch('models.catalog.current_version', return_value=2), \
+                patch.object(models.memory_store, 'get', return_value=sample_snapshot(version=1)):
+            response = client.get('/get_books?title=war')
+            self.assertEqual(len(response.get_json()['books']), 2)
+            self.assertNotIn('ETag', response.headers)
+            self.assertEqual(models.response_cache.stats()['size'], 0)
+
+        with patch.object(models, 'QUERY_STRATEGY', 'memory'), \
+                patch('models.catalog.current_version', return_value=2), \
+                patch.object(models.memory_store, 'get', return_value=sample_snapshot(version=2)):
+            response = client.get('/get_books?title=war')
+            self.assertIn('ETag', response.headers)
+            self.assertEqual(models.response_cache.stats()['size'], 1)
+        models.response_cache.clear()
+
+
+if __name__ == '__main__':
+    unittest.main()
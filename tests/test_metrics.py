@@ -0,0 +1,51 @@
+import unittest
+
+import metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.histogram = metrics.Histogram('test_seconds', 'Test latency', ('shape',), buckets=(0.1, 1.0))
+        self.addCleanup(metrics.REGISTRY.remove, self.histogram)
+
+    def test_histogram_render(self):
+        """Test buckets are cumulative and series are kept per label set"""
+        for value in (0.05, 0.5, 5.0):
+            self.histogram.observe(value, shape='languages')
+        self.histogram.observe(0.05, shape='unfiltered')
+        lines = self.histogram.render()
+        self.assertEqual(lines[:2], ['# HELP test_seconds Test latency', '# TYPE test_seconds histogram'])
+        self.assertIn('test_seconds_bucket{shape="languages",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{shape="languages",le="1.0"} 2', lines)
+        self.assertIn('test_seconds_bucket{shape="languages",le="+Inf"} 3', lines)
+        self.assertIn('test_seconds_sum{shape="languages"} 5.55', lines)
+        self.assertIn('test_seconds_count{shape="unfiltered"} 1', lines)
+        self.assertIn('test_seconds_count{shape="unfiltered"} 1', metrics.render().splitlines())
+
+    def test_render_stats(self):
+        """Test stats dicts become gauges and counters, skipping non-numbers"""
+        lines = metrics.render_stats(
+            'pool', [({'cache': 'a"b'}, {'size': 2, 'checkouts': 7, 'pid': None, 'ok': True})],
+            'Pool', counters=('checkouts',))
+        self.assertIn('# TYPE pool_size gauge', lines)
+        self.assertIn('pool_size{cache="a\\"b"} 2', lines)
+        self.assertIn('# TYPE pool_checkouts_total counter', lines)
+        self.assertFalse(any('pid' in line or 'pool_ok' in line for line in lines))
+
+    def test_phases(self):
+        """Test phases accumulate only while a request is being timed"""
+        with metrics.phase('count'):
+            pass
+        token = metrics.start()
+        with metrics.phase('count'):
+            pass
+        with metrics.phase('count'):
+            pass
+        phases = metrics.finish(token)
+        self.assertEqual(list(phases), ['count'])
+        self.assertRegex(metrics.server_timing({'count': 0.0123, 'total': 0.02}),
+                         r'^count;dur=12\.30, total;dur=20\.00$')
+
+
+if __name__ == '__main__':
+    unittest.main()
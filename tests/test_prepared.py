@@ -0,0 +1,88 @@
+import unittest
+from unittest.mock import MagicMock
+
+import psycopg2
+
+from prepared import PreparedStatements, statement_name, to_server_placeholders
+
+
+class FakeConnection:
+    pass
+
+
+def make_cursor(connection=None):
+    cursor = MagicMock()
+    cursor.connection = connection or FakeConnection()
+    return cursor
+
+
+def executed(cursor):
+    return [c.args[0] for c in cursor.execute.call_args_list]
+
+
+class TestPreparedStatements(unittest.TestCase):
+    def test_placeholders(self):
+        """Test %s placeholders are numbered and %% unescaped"""
+        self.assertEqual(to_server_placeholders("SELECT %s, '100%%' LIMIT %s OFFSET %s"),
+                         ("SELECT $1, '100%' LIMIT $2 OFFSET $3", 3))
+        self.assertEqual(statement_name('SELECT 1'), statement_name('SELECT 1'))
+        self.assertNotEqual(statement_name('SELECT 1'), statement_name('SELECT 2'))
+
+    def test_prepares_once_per_connection(self):
+        """Test a shape is prepared on first use and executed afterwards"""
+        statements = PreparedStatements()
+        cursor = make_cursor()
+        statements.execute(cursor, "SELECT * FROM t WHERE x = ANY(%s) LIMIT %s", [['en'], 5])
+        statements.execute(cursor, "SELECT * FROM t WHERE x = ANY(%s) LIMIT %s", [['fr'], 5])
+        name = statement_name("SELECT * FROM t WHERE x = ANY(%s) LIMIT %s")
+        self.assertEqual(executed(cursor), [
+            f"PREPARE {name} AS SELECT * FROM t WHERE x = ANY($1) LIMIT $2",
+            f"EXECUTE {name} (%s, %s)",
+            f"EXECUTE {name} (%s, %s)",
+        ])
+        self.assertEqual(cursor.execute.call_args.args[1], [['fr'], 5])
+
+        other = make_cursor()
+        statements.execute(other, "SELECT * FROM t WHERE x = ANY(%s) LIMIT %s", [['en'], 5])
+        self.assertTrue(executed(other)[0].startswith('PREPARE'))
+        stats = statements.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['prepared']), (1, 2, 2))
+        self.assertEqual(stats['hit_ratio'], 0.3333)
+
+    def test_evicts_least_recently_used(self):
+        """Test the per-connection limit deallocates the oldest statement"""
+        statements = PreparedStatements(max_per_connection=2)
+        cursor = make_cursor()
+        for query in ('SELECT 1', 'SELECT 2', 'SELECT 1', 'SELECT 3'):
+            statements.execute(cursor, query)
+        self.assertIn(f"DEALLOCATE {statement_name('SELECT 2')}", executed(cursor))
+        self.assertEqual(statements.stats()['evictions'], 1)
+        cursor.reset_mock()
+        statements.execute(cursor, 'SELECT 1')
+        self.assertEqual(executed(cursor), [f"EXECUTE {statement_name('SELECT 1')}"])
+
+    def test_passthrough(self):
+        """Test EXPLAIN and disabled caches run the statement as is"""
+        statements = PreparedStatements()
+        cursor = make_cursor()
+        statements.execute(cursor, 'EXPLAIN (FORMAT JSON) SELECT 1 WHERE x = %s', [1])
+        statements.enabled = False
+        statements.execute(cursor, 'SELECT %s', [1])
+        self.assertEqual(executed(cursor), ['EXPLAIN (FORMAT JSON) SELECT 1 WHERE x = %s', 'SELECT %s'])
+
+    def test_forgets_deallocated_statements(self):
+        """Test a statement missing on the server is prepared again next time"""
+        statements = PreparedStatements()
+        cursor = make_cursor()
+        statements.execute(cursor, 'SELECT 1')
+        cursor.execute.side_effect = psycopg2.errors.InvalidSqlStatementName()
+        with self.assertRaises(psycopg2.errors.InvalidSqlStatementName):
+            statements.execute(cursor, 'SELECT 1')
+        cursor.execute.side_effect = None
+        cursor.reset_mock()
+        statements.execute(cursor, 'SELECT 1')
+        self.assertTrue(executed(cursor)[0].startswith('PREPARE'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,412 @@
+import concurrent.futures
+import os
+import threading
+import unittest
+from contextlib import contextmanager
+from unittest.mock import patch, MagicMock
+
+import psycopg2
+
+import models
+import queries
+
+
+class TestTwoPhaseQueries(unittest.TestCase):
+    def test_no_filters(self):
+        """Test an unfiltered count has no joins or WHERE clause"""
+        conditions, params = queries.build_filter_conditions()
+        self.assertEqual(conditions, [])
+        self.assertEqual(params, [])
+        self.assertEqual(queries.build_count_query(conditions),
+                         "SELECT COUNT(*) AS count FROM books_book AS bb")
+
+    def test_filters_are_semi_joins(self):
+        """Test relation filters become EXISTS subqueries with one param each"""
+        conditions, params = queries.build_filter_conditions(
+            languages=['en'], mime_types=['text/plain'], authors=['Shake'])
+        self.assertEqual(len(conditions), 3)
+        self.assertTrue(all('EXISTS' in c for c in conditions))
+        self.assertEqual(params, [['en'], ['text/plain'], ['%shake%']])
+        self.assertNotIn('JOIN', queries.build_count_query([]))
+
+    def test_topic_matches_subjects_or_bookshelves(self):
+        """Test a topic filter binds its patterns for subjects and bookshelves"""
+        conditions, params = queries.build_filter_conditions(topics=['Child', 'war'])
+        self.assertEqual(len(conditions), 1)
+        self.assertEqual(params, [['%child%', '%war%'], ['%child%', '%war%']])
+
+    def test_page_query_limits_before_hydrating(self):
+        """Test the page of ids is limited inside the hydration query"""
+        sql = queries.build_two_phase_page_query(["bb.gutenberg_id = ANY(%s)"])
+        inner = sql[sql.index('FROM (') : sql.index(') AS page')]
+        self.assertIn('LIMIT %s OFFSET %s', inner)
+        self.assertEqual(sql.count('%s'), 3)
+
+    def test_cursor_round_trip(self):
+        """Test cursors encode the sort key of the last book"""
+        self.assertEqual(queries.decode_cursor(queries.encode_cursor(120, 5)), (120, 5))
+        self.assertEqual(queries.decode_cursor(queries.encode_cursor(None, 5)), (None, 5))
+        for bad in ('', 'abc', queries.encode_cursor('x', 5)):
+            with self.assertRaises(ValueError):
+                queries.decode_cursor(bad)
+
+    def test_keyset_condition(self):
+        """Test the keyset predicate follows the NULLS LAST ordering"""
+        condition, params = queries.build_keyset_condition((120, 5))
+        self.assertIn('IS NULL', condition)
+        self.assertEqual(params, [120, 5])
+        condition, params = queries.build_keyset_condition((None, 5))
+        self.assertEqual(params, [5])
+
+    def test_fulltext_search_uses_tsvector(self):
+        """Test full-text mode matches the search_tsv columns with one tsquery per term"""
+        conditions, params = queries.build_filter_conditions(
+            titles=['Pride and Prejudice', 'Emma'], search='fulltext')
+        self.assertEqual(conditions, [
+            "bb.search_tsv @@ (plainto_tsquery('simple', %s) || plainto_tsquery('simple', %s))"])
+        self.assertEqual(params, ['Pride and Prejudice', 'Emma'])
+
+    def test_fulltext_terms_are_literal(self):
+        """Test search operators in a term are passed as data, never as query syntax"""
+        terms = ['-foo', '"a b"', 'or']
+        conditions, params = queries.build_filter_conditions(authors=terms, search='fulltext')
+        self.assertNotIn('websearch_to_tsquery', conditions[0])
+        self.assertEqual(conditions[0].count('plainto_tsquery'), 3)
+        self.assertEqual(params, terms)
+
+    def test_rank_expression(self):
+        """Test relevance ranking covers every text filter that is present"""
+        self.assertEqual(queries.build_rank_expression(languages=['en']), (None, []))
+        rank, params = queries.build_rank_expression(titles=['Emma'], authors=['Austen'])
+        self.assertEqual(rank.count('word_similarity'), 2)
+        self.assertEqual(params, [['emma'], ['austen']])
+        rank, params = queries.build_rank_expression(topics=['war'], search='fulltext')
+        self.assertEqual(rank.count('ts_rank'), 2)
+        self.assertEqual(params, ['war', 'war'])
+
+    def test_relevance_page_query(self):
+        """Test a rank expression orders the page ahead of downloads"""
+        sql = queries.build_two_phase_page_query([], rank='1.0')
+        self.assertIn('1.0 AS rank', sql)
+        self.assertTrue(sql.endswith(f"ORDER BY page.rank DESC, {queries.ORDER_BY}"))
+
+    def test_document_conditions_are_single_table(self):
+        """Test document filters only reference book_documents columns"""
+        conditions, params = queries.build_document_conditions(
+            languages=['en'], mime_types=['text/plain'], topics=['War'], titles=['Peace'])
+        self.assertTrue(all(c.startswith('bd.') for c in conditions))
+        self.assertEqual(params, [['en'], ['text/plain'], ['%war%'], ['%peace%']])
+        sql = queries.build_document_page_query(conditions)
+        self.assertNotIn('JOIN', sql)
+        self.assertIn(queries.order_by('bd'), sql)
+
+    def test_filter_key_is_canonical(self):
+        """Test filter keys ignore order, duplicates and search-term case"""
+        self.assertEqual(
+            queries.filter_key({'languages': ['fr', 'en', 'en'], 'titles': ['Emma'], 'topics': None}),
+            queries.filter_key({'titles': ['emma'], 'languages': ['en', 'fr']}))
+        self.assertNotEqual(queries.filter_key({'languages': ['en']}),
+                            queries.filter_key({'languages': ['fr']}))
+
+
+class TestGetBooksFromDb(unittest.TestCase):
+    def setUp(self):
+        self.cursor = MagicMock()
+        self.cursor.fetchone.return_value = {'count': 42}
+        self.cursor.fetchall.return_value = [{'gutenberg_id': 1}]
+        self.connection = connection = MagicMock()
+        connection.cursor.return_value = self.cursor
+
+        @contextmanager
+        def fake_connection():
+            yield connection
+
+        patcher = patch.object(models.pool, 'connection', fake_connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # read_pool hands out primary connections when no replica is set
+        for name, value in (('getconn', connection), ('try_getconn', connection), ('putconn', None)):
+            patcher = patch.object(models.pool, name, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # Count cache keys carry the catalog version
+        patcher = patch('catalog.current_version', return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Inspect the statements themselves rather than PREPARE/EXECUTE
+        patcher = patch.object(models.prepared_statements, 'enabled', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        models.invalidate_count_cache()
+
+    def test_two_phase_strategy(self):
+        """Test count and page queries run with shared filter params"""
+        total, books = models.get_books_from_db(page=3, per_page=10, languages=['fr'])
+        self.assertEqual(total, 42)
+        self.assertEqual(books, [{'gutenberg_id': 1}])
+        (count_sql, count_params), (page_sql, page_params) = [
+            c.args for c in self.cursor.execute.call_args_list]
+        self.assertEqual(count_params, [['fr']])
+        self.assertEqual(page_params, [['fr'], 10, 20])
+        self.assertIn('AS page', page_sql)
+
+    def test_keyset_page_skips_offset(self):
+        """Test a cursor narrows the page query but not the count"""
+        models.get_books_from_db(page=50, per_page=10, after=(120, 5))
+        (_, count_params), (_, page_params) = [
+            c.args for c in self.cursor.execute.call_args_list]
+        self.assertEqual(count_params, [])
+        self.assertEqual(page_params, [120, 5, 10, 0])
+
+    def test_count_cache_is_keyed_on_catalog_version(self):
+        """Test a cached total is not reused once the catalog version moves"""
+        with patch('catalog.current_version', return_value=3):
+            models.get_books_from_db(languages=['en'])
+            models.get_books_from_db(languages=['en'])
+        with patch('catalog.current_version', return_value=4):
+            models.get_books_from_db(languages=['en'])
+        count_calls = [c for c in self.cursor.execute.call_args_list if 'COUNT' in c.args[0]]
+        self.assertEqual(len(count_calls), 2)
+
+    def test_count_is_cached_per_filter_set(self):
+        """Test equivalent filter sets share one cached count"""
+        models.get_books_from_db(languages=['en', 'fr'], topics=['War'])
+        models.get_books_from_db(page=2, languages=['fr', 'en'], topics=['war'])
+        count_calls = [c for c in self.cursor.execute.call_args_list if 'COUNT' in c.args[0]]
+        self.assertEqual(len(count_calls), 1)
+
+        models.invalidate_count_cache()
+        models.get_books_from_db(languages=['en', 'fr'], topics=['War'])
+        count_calls = [c for c in self.cursor.execute.call_args_list if 'COUNT' in c.args[0]]
+        self.assertEqual(len(count_calls), 2)
+
+    def test_stale_replica_counts_are_not_cached(self):
+        """Test totals read from a lagging replica stay out of the count cache"""
+        token = models._stale_read.set(True)
+        try:
+            models.get_books_from_db(languages=['fr'])
+            models.get_books_from_db(languages=['fr'])
+        finally:
+            models._stale_read.reset(token)
+        count_calls = [c for c in self.cursor.execute.call_args_list if 'COUNT' in c.args[0]]
+        self.assertEqual(len(count_calls), 2)
+
+    def test_statements_are_watched_on_their_server(self):
+        """Test slow-query watches name the pool the statements ran on"""
+        with patch.object(models.slow_queries, 'watch') as watch:
+            models.get_books_from_db(languages=['fr'])
+        self.assertEqual([c.args[0] for c in watch.call_args_list], ['count', 'page'])
+        self.assertTrue(all(c.kwargs['pool'] is models.read_pool.primary for c in watch.call_args_list))
+
+    def test_count_estimate(self):
+        """Test estimate mode reads the planner row estimate"""
+        self.cursor.fetchone.return_value = {'QUERY PLAN': [{'Plan': {'Plan Rows': 1234}}]}
+        total, _ = models.get_books_from_db(count='estimate')
+        self.assertEqual(total, 1234)
+        self.assertTrue(self.cursor.execute.call_args_list[0].args[0].startswith('EXPLAIN'))
+
+    def test_count_none(self):
+        """Test counting can be skipped entirely"""
+        total, _ = models.get_books_from_db(count='none')
+        self.assertIsNone(total)
+        self.assertEqual(self.cursor.execute.call_count, 1)
+
+    def test_lookahead_keeps_page_offset(self):
+        """Test the lookahead row widens the limit but not the offset"""
+        self.cursor.fetchall.return_value = []
+        for strategy in ('two_phase', 'documents', 'join'):
+            with patch.object(models, 'QUERY_STRATEGY', strategy):
+                self.cursor.execute.reset_mock()
+                models.get_books_from_db(page=2, per_page=25, count='none', lookahead=True)
+                self.assertEqual(self.cursor.execute.call_args.args[1][-2:], [26, 25], strategy)
+
+    def test_window_count(self):
+        """Test window mode reads the total from the page rows"""
+        self.cursor.fetchall.return_value = [{'gutenberg_id': 1, 'total_count': 42}]
+        with patch.object(models, 'COUNT_EXECUTION', 'window'):
+            total, books = models.get_books_from_db(languages=['fr'])
+            self.assertEqual((total, books), (42, [{'gutenberg_id': 1}]))
+            self.assertEqual(self.cursor.execute.call_count, 1)
+            self.assertIn('COUNT(*) OVER ()', self.cursor.execute.call_args.args[0])
+
+            # A keyset page keeps the separate count
+            models.invalidate_count_cache()
+            self.cursor.reset_mock()
+            models.get_books_from_db(languages=['fr'], after=(120, 5))
+            self.assertEqual(self.cursor.execute.call_count, 2)
+
+    def test_window_count_past_last_page(self):
+        """Test an empty page past the end still counts, an empty first page does not"""
+        self.cursor.fetchall.return_value = []
+        with patch.object(models, 'COUNT_EXECUTION', 'window'):
+            total, _ = models.get_books_from_db(page=9, languages=['fr'])
+            self.assertEqual(total, 42)
+            self.assertTrue(self.cursor.execute.call_args.args[0].startswith('SELECT COUNT(*)'))
+
+            self.cursor.reset_mock()
+            total, _ = models.get_books_from_db(titles=['nothing'])
+            self.assertEqual(total, 0)
+            self.assertEqual(self.cursor.execute.call_count, 1)
+
+    def test_concurrent_count(self):
+        """Test concurrent mode runs the count on a second pooled connection"""
+        with patch.object(models, 'COUNT_EXECUTION', 'concurrent'):
+            total, books = models.get_books_from_db(languages=['fr'])
+        self.assertEqual((total, books), (42, [{'gutenberg_id': 1}]))
+        statements = [c.args[0] for c in self.cursor.execute.call_args_list]
+        self.assertEqual(len(statements), 2)
+        self.assertTrue(any(sql.startswith('SELECT COUNT(*)') for sql in statements))
+        self.assertEqual(self.connection.cursor.call_count, 2)
+        self.assertEqual(models.pool.putconn.call_count, 2)
+
+    def test_concurrent_count_without_spare_connection(self):
+        """Test concurrent mode runs sequentially when no second connection is free"""
+        models.pool.try_getconn.return_value = None
+        with patch.object(models, 'COUNT_EXECUTION', 'concurrent'), \
+                patch('models._submit_count') as submit:
+            total, _ = models.get_books_from_db(languages=['fr'])
+        self.assertEqual(total, 42)
+        submit.assert_not_called()
+        self.assertEqual(self.cursor.execute.call_count, 2)
+        self.assertEqual(models.pool.putconn.call_count, 1)
+
+    def test_concurrent_count_page_error(self):
+        """Test a failing page query cancels the count before releasing its connection"""
+        count_cursor = MagicMock()
+        count_cursor.fetchone.return_value = {'count': 42}
+        count_connection = MagicMock()
+        count_connection.cursor.return_value = count_cursor
+        models.pool.try_getconn.return_value = count_connection
+        # The page query fails once the count is running
+        count_started = threading.Event()
+        count_cursor.execute.side_effect = lambda *args: count_started.set()
+
+        def fail_page(*args):
+            count_started.wait(1)
+            raise psycopg2.errors.QueryCanceled('canceling statement')
+        self.cursor.execute.side_effect = fail_page
+        with patch.object(models, 'COUNT_EXECUTION', 'concurrent'):
+            with self.assertRaises(psycopg2.errors.QueryCanceled):
+                models.get_books_from_db(languages=['fr'])
+        count_connection.cancel.assert_called()
+        # The count ran to its end before both connections went back
+        self.assertEqual(count_cursor.execute.call_count, 1)
+        self.assertEqual([c.args[0] for c in models.pool.putconn.call_args_list],
+                         [self.connection, count_connection])
+
+    def test_concurrent_count_page_error_before_count_starts(self):
+        """Test a page error while the count is still queued keeps the count from running"""
+        count_connection = MagicMock()
+        count_cursor = MagicMock()
+        count_connection.cursor.return_value = count_cursor
+        models.pool.try_getconn.return_value = count_connection
+        self.cursor.execute.side_effect = psycopg2.errors.QueryCanceled('canceling statement')
+        # Every count worker is busy, so this count waits in the queue
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(executor.shutdown)
+        busy = threading.Event()
+        executor.submit(busy.wait)
+        self.addCleanup(busy.set)
+        with patch.object(models, 'COUNT_EXECUTION', 'concurrent'), \
+                patch.dict(models._count_executor, {'pid': os.getpid(), 'executor': executor}):
+            with self.assertRaises(psycopg2.errors.QueryCanceled):
+                models.get_books_from_db(languages=['fr'])
+        busy.set()
+        executor.shutdown()
+        self.assertEqual(count_cursor.execute.call_count, 0)
+        self.assertEqual([c.args[0] for c in models.pool.putconn.call_args_list],
+                         [self.connection, count_connection])
+
+    def test_relevance_sort_params(self):
+        """Test rank params are bound ahead of filter and paging params"""
+        models.get_books_from_db(titles=['Emma'], sort='relevance', count='none')
+        page_params = self.cursor.execute.call_args.args[1]
+        self.assertEqual(page_params, [['emma'], ['%emma%'], 25, 0])
+
+    def test_export_uses_server_side_cursor(self):
+        """Test the export streams through a named cursor in batches"""
+        named_cursor = MagicMock()
+        named_cursor.__iter__.return_value = iter([{'gutenberg_id': 1}, {'gutenberg_id': 2}])
+        self.connection.cursor.return_value = named_cursor
+
+        books = list(models.export_books_from_db(languages=['en']))
+        self.assertEqual(books, [{'gutenberg_id': 1}, {'gutenberg_id': 2}])
+        self.assertEqual(self.connection.cursor.call_args.kwargs['name'], 'export_books')
+        self.assertEqual(named_cursor.itersize, models.EXPORT_ITERSIZE)
+        export_sql, export_params = named_cursor.execute.call_args.args
+        self.assertIn('ORDER BY bb.gutenberg_id', export_sql)
+        self.assertEqual(export_params, [['en']])
+        self.assertTrue(named_cursor.close.called)
+
+    def test_lookup_by_ids(self):
+        """Test batch lookup hydrates all ids in one query"""
+        self.cursor.fetchall.return_value = [{'gutenberg_id': 5}, {'gutenberg_id': 2}]
+        books = models.get_books_by_ids([2, 5, 8])
+        self.assertEqual(set(books), {2, 5})
+        lookup_sql, lookup_params = self.cursor.execute.call_args.args
+        self.assertEqual(self.cursor.execute.call_count, 1)
+        self.assertIn('= ANY(%s)', lookup_sql)
+        self.assertEqual(lookup_params, [[2, 5, 8]])
+
+    def test_join_strategy(self):
+        """Test the original wide-join strategy is still selectable"""
+        with patch.object(models, 'QUERY_STRATEGY', 'join'):
+            total, _ = models.get_books_from_db(languages=['fr'])
+        self.assertEqual(total, 42)
+        page_sql = self.cursor.execute.call_args_list[1].args[0]
+        self.assertIn('GROUP BY', page_sql)
+
+    def test_join_strategy_is_one_row_per_book(self):
+        """Test the wide join hydrates every author and language of a book in its one row"""
+        with patch.object(models, 'QUERY_STRATEGY', 'join'):
+            models.get_books_from_db(authors=['austen'])
+        page_sql = self.cursor.execute.call_args_list[1].args[0]
+        group_by = page_sql[page_sql.index('GROUP BY'):page_sql.index('ORDER BY')]
+        self.assertNotIn('ba.', group_by)
+        self.assertNotIn('bl.', group_by)
+        for column in ('author_info', 'authors', 'language', 'languages'):
+            self.assertIn(queries.HYDRATE_EXPRESSIONS[column], page_sql)
+
+    def test_documents_strategy(self):
+        """Test the documents strategy returns the stored documents"""
+        self.cursor.fetchall.return_value = [{'document': {'gutenberg_id': 7}}]
+        with patch.object(models, 'QUERY_STRATEGY', 'documents'):
+            total, books = models.get_books_from_db(languages=['fr'], after=(3, 9))
+        self.assertEqual(books, [{'gutenberg_id': 7}])
+        page_sql, page_params = self.cursor.execute.call_args.args
+        self.assertIn('FROM book_documents AS bd', page_sql)
+        self.assertEqual(page_params, [['fr'], 3, 9, 25, 0])
+
+    def test_fields_prune_hydration(self):
+        """Test a projection drops the aggregates of fields not requested"""
+        models.get_books_from_db(topics=['war'], fields=('title', 'author'))
+        page_sql = self.cursor.execute.call_args.args[0]
+        self.assertIn('AS author_info', page_sql)
+        self.assertIn('AS download_count', page_sql)
+        self.assertNotIn('AS download_links', page_sql)
+        self.assertNotIn('AS bookshelves', page_sql)
+        # The topic filter still reads subjects and bookshelves
+        self.assertIn('books_book_bookshelves', page_sql)
+
+    def test_join_strategy_prunes_joins(self):
+        """Test the wide join only joins what fields and filters need"""
+        with patch.object(models, 'QUERY_STRATEGY', 'join'):
+            models.get_books_from_db(mime_types=['text/plain'], fields=('title',))
+        (count_sql, _), (page_sql, _) = [c.args for c in self.cursor.execute.call_args_list]
+        for sql in (count_sql, page_sql):
+            self.assertIn('books_format', sql)
+            self.assertNotIn('books_book_subjects', sql)
+            self.assertNotIn('books_book_authors', sql)
+        self.assertNotIn('json_agg', page_sql)
+
+    def test_join_strategy_defers_to_two_phase_for_search(self):
+        """Test full-text search runs on the two-phase plan even in join mode"""
+        with patch.object(models, 'QUERY_STRATEGY', 'join'):
+            models.get_books_from_db(titles=['Emma'], search='fulltext')
+        page_sql = self.cursor.execute.call_args_list[1].args[0]
+        self.assertIn('search_tsv', page_sql)
+        self.assertNotIn('GROUP BY', page_sql)
+
+
+if __name__ == '__main__':
+    unittest.main()
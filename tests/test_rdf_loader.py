@@ -0,0 +1,146 @@
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+
+import catalog_load
+import rdf_loader
+
+
+def make_rdf(gutenberg_id, title, agents=(), subjects=(), shelves=(), languages=('en',),
+             downloads=100, rights='Public domain in the USA.'):
+    creators = ''.join(f"""
+        <dcterms:creator>
+          <pgterms:agent rdf:about="2009/agents/{agent_id}">
+            <pgterms:name>{name}</pgterms:name>
+            <pgterms:birthdate rdf:datatype="http://www.w3.org/2001/XMLSchema#integer">{birth}</pgterms:birthdate>
+          </pgterms:agent>
+        </dcterms:creator>""" for agent_id, name, birth in agents)
+    subject_nodes = ''.join(f"""
+        <dcterms:subject>
+          <rdf:Description rdf:nodeID="s{index}">
+            <dcam:memberOf rdf:resource="http://purl.org/dc/terms/{scheme}"/>
+            <rdf:value>{value}</rdf:value>
+          </rdf:Description>
+        </dcterms:subject>""" for index, (scheme, value) in enumerate(subjects))
+    shelf_nodes = ''.join(f"""
+        <pgterms:bookshelf>
+          <rdf:Description rdf:nodeID="b{index}"><rdf:value>{value}</rdf:value></rdf:Description>
+        </pgterms:bookshelf>""" for index, value in enumerate(shelves))
+    language_nodes = ''.join(f"""
+        <dcterms:language>
+          <rdf:Description rdf:nodeID="l{index}">
+            <rdf:value rdf:datatype="http://purl.org/dc/terms/RFC4646">{code}</rdf:value>
+          </rdf:Description>
+        </dcterms:language>""" for index, code in enumerate(languages))
+    return f"""<?xml version="1.0" encoding="utf-8"?>
+<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"
+         xmlns:dcterms="http://purl.org/dc/terms/"
+         xmlns:dcam="http://purl.org/dc/dcam/"
+         xmlns:pgterms="http://www.gutenberg.org/2009/pgterms/">
+  <pgterms:ebook rdf:about="ebooks/{gutenberg_id}">
+    <dcterms:title>{title}</dcterms:title>{creators}{subject_nodes}{shelf_nodes}{language_nodes}
+    <dcterms:rights>{rights}</dcterms:rights>
+    <pgterms:downloads rdf:datatype="http://www.w3.org/2001/XMLSchema#integer">{downloads}</pgterms:downloads>
+    <dcterms:type>
+      <rdf:Description rdf:nodeID="t"><rdf:value>Text</rdf:value></rdf:Description>
+    </dcterms:type>
+    <dcterms:hasFormat>
+      <pgterms:file rdf:about="https://www.gutenberg.org/ebooks/{gutenberg_id}.txt.utf-8">
+        <dcterms:format>
+          <rdf:Description rdf:nodeID="f1"><rdf:value>text/plain; charset=utf-8</rdf:value></rdf:Description>
+        </dcterms:format>
+      </pgterms:file>
+    </dcterms:hasFormat>
+    <dcterms:hasFormat>
+      <pgterms:file rdf:about="https://www.gutenberg.org/cache/epub/{gutenberg_id}/pg{gutenberg_id}-h.zip">
+        <dcterms:format>
+          <rdf:Description rdf:nodeID="f2"><rdf:value>application/zip</rdf:value></rdf:Description>
+        </dcterms:format>
+        <dcterms:format>
+          <rdf:Description rdf:nodeID="f3"><rdf:value>text/html</rdf:value></rdf:Description>
+        </dcterms:format>
+      </pgterms:file>
+    </dcterms:hasFormat>
+  </pgterms:ebook>
+</rdf:RDF>""".encode()
+
+
+PRIDE = make_rdf(1342, 'Pride and Prejudice', agents=[(68, 'Austen, Jane', 1775)],
+                 subjects=[('LCSH', 'England -- Fiction'), ('LCC', 'PR')],
+                 shelves=['Best Books Ever Listings'])
+EMMA = make_rdf(158, 'Emma', agents=[(68, 'Austen, Jane', 1775)],
+                subjects=[('LCSH', 'England -- Fiction'), ('LCSH', 'Matchmaking -- Fiction')],
+                languages=('en', 'fr'), rights='Copyrighted. Read the copyright notice.')
+
+
+class TestParseRdf(unittest.TestCase):
+    def test_parse(self):
+        """Test an ebook's fields, agents, LCSH subjects and formats are read"""
+        book = rdf_loader.parse_rdf(PRIDE)
+        self.assertEqual(book['gutenberg_id'], 1342)
+        self.assertEqual(book['title'], 'Pride and Prejudice')
+        self.assertEqual((book['download_count'], book['media_type'], book['copyright']), (100, 'Text', False))
+        self.assertEqual(book['authors'], [(68, 'Austen, Jane', 1775, None)])
+        self.assertEqual(book['subjects'], ['England -- Fiction'])
+        self.assertEqual(book['bookshelves'], ['Best Books Ever Listings'])
+        self.assertEqual(book['languages'], ['en'])
+        self.assertEqual(book['formats'], [
+            ('text/plain; charset=utf-8', 'https://www.gutenberg.org/ebooks/1342.txt.utf-8'),
+            ('text/html', 'https://www.gutenberg.org/cache/epub/1342/pg1342-h.zip'),
+        ])
+        self.assertTrue(rdf_loader.parse_rdf(EMMA)['copyright'])
+
+    def test_no_ebook(self):
+        """Test files without an ebook are skipped"""
+        rdf = b'<rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#"/>'
+        self.assertIsNone(rdf_loader.parse_rdf(rdf))
+
+
+class TestBuildTables(unittest.TestCase):
+    def test_deduplicates(self):
+        """Test shared authors, subjects and languages become one row each"""
+        books = [rdf_loader.parse_rdf(rdf) for rdf in (PRIDE, EMMA, PRIDE)]
+        tables = rdf_loader.build_tables(books)
+        self.assertEqual(set(tables), set(catalog_load.COLUMNS))
+        self.assertEqual([row[0] for row in tables['books_book']], [1342, 158])
+        self.assertEqual(tables['books_author'], [(68, 'Austen, Jane', 1775, None, 68)])
+        self.assertEqual(tables['books_subject'], [(1, 'England -- Fiction'), (2, 'Matchmaking -- Fiction')])
+        self.assertEqual(tables['books_language'], [(1, 'en'), (2, 'fr')])
+        self.assertEqual(tables['books_book_authors'], [(1342, 68), (158, 68)])
+        self.assertEqual(tables['books_book_subjects'], [(1342, 1), (158, 1), (158, 2)])
+        self.assertEqual(len(tables['books_format']), 4)
+        for table, columns in catalog_load.COLUMNS.items():
+            self.assertTrue(all(len(row) == len(columns) for row in tables[table]), table)
+
+    def test_agent_without_id(self):
+        """Test agents without an id get ids after the Gutenberg ones"""
+        book = dict(rdf_loader.parse_rdf(PRIDE), authors=[(None, 'Anonymous', None, None)])
+        tables = rdf_loader.build_tables([rdf_loader.parse_rdf(EMMA), book])
+        self.assertEqual(tables['books_author'][-1], (69, 'Anonymous', None, None, None))
+        self.assertIn((1342, 69), tables['books_book_authors'])
+
+
+class TestReadCatalog(unittest.TestCase):
+    def test_archive_and_directory(self):
+        """Test an archive and an extracted directory parse the same books"""
+        with tempfile.TemporaryDirectory() as directory:
+            archive_path = os.path.join(directory, 'rdf-files.tar.bz2')
+            with tarfile.open(archive_path, 'w:bz2') as archive:
+                for gutenberg_id, rdf in ((1342, PRIDE), (158, EMMA)):
+                    info = tarfile.TarInfo(f"cache/epub/{gutenberg_id}/pg{gutenberg_id}.rdf")
+                    info.size = len(rdf)
+                    archive.addfile(info, io.BytesIO(rdf))
+            with tarfile.open(archive_path) as archive:
+                archive.extractall(os.path.join(directory, 'extracted'))
+
+            from_archive = list(rdf_loader.parse_catalog(archive_path, workers=2))
+            from_directory = list(rdf_loader.parse_catalog(os.path.join(directory, 'extracted'), workers=2))
+        self.assertEqual(sorted(book['gutenberg_id'] for book in from_archive), [158, 1342])
+        self.assertEqual(sorted(from_archive, key=lambda book: book['gutenberg_id']),
+                         sorted(from_directory, key=lambda book: book['gutenberg_id']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import unittest
+from unittest.mock import MagicMock
+
+import rdf_loader
+import rdf_sync
+from test_rdf_loader import EMMA, PRIDE
+
+
+def stored(book):
+    # What stored_hashes() reads back for a loaded book
+    return rdf_sync.content_hash(dict(book, authors=[(None, *author[1:]) for author in book['authors']]))
+
+
+class TestDiff(unittest.TestCase):
+    def setUp(self):
+        self.pride = rdf_loader.parse_rdf(PRIDE)
+        self.emma = rdf_loader.parse_rdf(EMMA)
+
+    def test_content_hash(self):
+        """Test the hash ignores order, duplicates, author ids and downloads"""
+        book = self.pride
+        reordered = dict(book, formats=book['formats'][::-1] + book['formats'][:1],
+                         authors=[(None, *book['authors'][0][1:])], download_count=5)
+        self.assertEqual(rdf_sync.content_hash(book), rdf_sync.content_hash(reordered))
+        self.assertNotEqual(rdf_sync.content_hash(book),
+                            rdf_sync.content_hash(dict(book, subjects=['Other -- Fiction'])))
+        self.assertNotEqual(rdf_sync.content_hash(book), rdf_sync.content_hash(dict(book, title='Emma')))
+
+    def test_diff_catalog(self):
+        """Test books are sorted into added, changed, downloads and unchanged"""
+        renamed = dict(self.emma, title='Emma (revised)')
+        new = dict(self.emma, gutenberg_id=1)
+        downloads = dict(self.pride, gutenberg_id=2, download_count=999)
+        stored_books = {
+            1342: (stored(self.pride), 100),
+            158: (stored(self.emma), 100),
+            2: (stored(self.pride), 100),
+            3: ('gone', 1),
+        }
+        diff = rdf_sync.diff_catalog([self.pride, renamed, new, downloads, self.pride], stored_books)
+        self.assertEqual([book['gutenberg_id'] for book in diff['added']], [1])
+        self.assertEqual([book['gutenberg_id'] for book in diff['changed']], [158])
+        self.assertEqual(diff['downloads'], [(2, 999)])
+        self.assertEqual((diff['unchanged'], diff['deleted']), (1, []))
+        diff = rdf_sync.diff_catalog([self.pride], stored_books, delete_missing=True)
+        self.assertEqual(diff['deleted'], [2, 3, 158])
+
+
+class TestApply(unittest.TestCase):
+    def test_apply_books(self):
+        """Test dimensions are resolved and each relation table is diffed"""
+        cursor = MagicMock()
+        cursor.fetchall.side_effect = [
+            [(5,)],  # the stored author of agent 68 was renamed
+            [(68, 5)],  # agent ids -> books_author ids
+            [('en', 1)], [('England -- Fiction', 7)], [], [('Best Books Ever Listings', 3)],
+            [(158,), (1342,)],  # that author's books
+        ]
+        touched = rdf_sync.apply_books(cursor, [rdf_loader.parse_rdf(PRIDE)])
+        self.assertEqual(touched, [158, 1342])
+        statements = [' '.join(c.args[0].split()) for c in cursor.execute.call_args_list]
+
+        self.assertTrue(statements[0].startswith('UPDATE books_author'))
+        self.assertIn('WHERE ba.agent_id = a.agent_id', statements[0])
+        self.assertEqual(cursor.execute.call_args_list[0].args[1][0], [68])
+        book_insert = next(i for i, s in enumerate(statements) if s.startswith('INSERT INTO books_book '))
+        links = statements[book_insert + 1:-1]
+        self.assertEqual(len(links), 2 * len(rdf_sync.LINKS))
+        self.assertTrue(links[0].startswith('DELETE FROM books_book_authors'))
+        self.assertTrue(links[1].startswith('INSERT INTO books_book_authors'))
+        self.assertTrue(statements[-1].startswith('SELECT DISTINCT book_id FROM books_book_authors'))
+        self.assertEqual(cursor.execute.call_args.args[1], [[5]])
+        args = {s.split()[2]: c.args[1] for s, c in zip(statements, cursor.execute.call_args_list)
+                if s.startswith('INSERT INTO books_book_')}
+        self.assertEqual(args['books_book_authors'], [[1342], [5]])
+        self.assertEqual(args['books_book_subjects'], [[1342], [7]])
+        self.assertEqual(args['books_book_bookshelves'], [[1342], [3]])
+
+    def test_authors_with_serial_ids(self):
+        """Test a new agent claims the stored author by name, never books_author.id"""
+        # A gutendex database: "Austen, Jane" is books_author 12 and id 68
+        # belongs to someone else; no author has an agent_id yet
+        cursor = MagicMock()
+        cursor.fetchall.side_effect = [[], [], [('en', 1)], [('England -- Fiction', 7)],
+                                       [('Best Books Ever Listings', 3)]]
+        cursor.fetchone.return_value = (12,)
+        touched = rdf_sync.apply_books(cursor, [rdf_loader.parse_rdf(PRIDE)])
+        self.assertEqual(touched, [1342])
+        calls = cursor.execute.call_args_list
+        statements = [' '.join(c.args[0].split()) for c in calls]
+
+        claim = next(i for i, s in enumerate(statements) if s.startswith('UPDATE books_author SET agent_id'))
+        self.assertIn('WHERE agent_id IS NULL AND name = %s', statements[claim])
+        self.assertEqual(calls[claim].args[1], [68, 'Austen, Jane', 1775, None])
+        self.assertFalse(any(s.startswith('INSERT INTO books_author') for s in statements))
+        self.assertFalse(any('ON CONFLICT (id)' in s for s in statements))
+        links = {s.split()[2]: c.args[1] for s, c in zip(statements, calls)
+                 if s.startswith('INSERT INTO books_book_')}
+        self.assertEqual(links['books_book_authors'], [[1342], [12]])
+
+        # No stored author matches: the agent is inserted with its agent_id
+        cursor = MagicMock()
+        cursor.fetchall.side_effect = [[], [], [('en', 1)], [('England -- Fiction', 7)],
+                                       [('Best Books Ever Listings', 3)]]
+        cursor.fetchone.side_effect = [None, (90001,)]
+        rdf_sync.apply_books(cursor, [rdf_loader.parse_rdf(PRIDE)])
+        calls = cursor.execute.call_args_list
+        insert = next(c for c in calls if ' '.join(c.args[0].split()).startswith('INSERT INTO books_author'))
+        self.assertEqual(insert.args[1], ['Austen, Jane', 1775, None, 68])
+
+    def test_apply_downloads(self):
+        """Test download counts are set in one statement"""
+        cursor = MagicMock()
+        self.assertEqual(rdf_sync.apply_downloads(cursor, [(1, 10), (2, None)]), [1, 2])
+        self.assertEqual(cursor.execute.call_count, 1)
+        self.assertEqual(cursor.execute.call_args.args[1], [[1, 2], [10, None]])
+
+
+if __name__ == '__main__':
+    unittest.main()
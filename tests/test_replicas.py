@@ -0,0 +1,170 @@
+import time
+import unittest
+from unittest.mock import patch
+
+import psycopg2
+import psycopg2.extensions as _ext
+
+from conftest import make_connection
+from db import ConnectionPool, PoolTimeout
+from replicas import Replica, ReplicaRouter
+
+
+class TestReplicaRouter(unittest.TestCase):
+    def setUp(self):
+        patcher = patch('psycopg2.connect', side_effect=lambda **kw: make_connection(kw['dbname']))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.lag = {'a': 0.0, 'b': 0.0}
+        patcher = patch('replicas.read_lag', side_effect=lambda conn: self.lag[conn._mock_name])
+        self.read_lag = patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.primary = ConnectionPool({'dbname': 'primary'}, max_size=2, timeout=0.01)
+        self.replicas = [Replica(ConnectionPool({'dbname': name}, max_size=2, timeout=0.01), name)
+                         for name in ('a', 'b')]
+
+    def router(self, **kwargs):
+        return ReplicaRouter(self.primary, self.replicas, **kwargs)
+
+    def serving(self, router, requests=4):
+        served = []
+        for _ in range(requests):
+            with router.connection() as connection:
+                served.append(connection._mock_name)
+        return served
+
+    def test_without_replicas(self):
+        """Test reads use the primary when no replica is configured"""
+        router = ReplicaRouter(self.primary)
+        self.assertEqual(self.serving(router, 2), ['primary', 'primary'])
+        self.assertEqual(router.stats()['primary_checkouts'], 0)
+
+    def test_round_robin(self):
+        """Test reads alternate between replicas"""
+        router = self.router()
+        self.assertEqual(self.serving(router), ['a', 'b', 'a', 'b'])
+        # Lag is read once per replica within lag_interval
+        self.assertEqual(self.read_lag.call_count, 2)
+
+    def test_least_latency(self):
+        """Test reads go to the replica with the lowest observed latency"""
+        router = self.router(policy='least_latency')
+        self.replicas[0].latency = 0.050
+        self.replicas[1].latency = 0.002
+        self.assertEqual(self.serving(router, 2), ['b', 'b'])
+        with self.assertRaises(ValueError):
+            self.router(policy='random')
+
+    def test_latency_is_probe_round_trip(self):
+        """Test latency comes from the probe query, not from how long a caller held the connection"""
+        delays = {'a': 0.02, 'b': 0.0}
+
+        def slow_probe(connection):
+            time.sleep(delays[connection._mock_name])
+            return 0.0
+        self.read_lag.side_effect = slow_probe
+        router = self.router(policy='least_latency', max_lag=None, lag_interval=0)
+        self.assertEqual(self.serving(router, 2), ['b', 'b'])
+        self.assertGreaterEqual(self.replicas[0].latency, 0.02)
+
+        # A long export on b leaves its latency alone
+        with router.connection():
+            time.sleep(0.05)
+        self.assertLess(self.replicas[1].latency, 0.02)
+        self.assertEqual(self.serving(router, 2), ['b', 'b'])
+
+    def test_lagging_replica_is_ejected(self):
+        """Test a replica behind by more than max_lag is skipped until it catches up"""
+        self.lag['a'] = 30.0
+        router = self.router(lag_interval=0)
+        self.assertEqual(self.serving(router), ['b', 'b', 'b', 'b'])
+        stats = router.stats()['replicas'][0]
+        self.assertEqual((stats['healthy'], stats['ejected_for'], stats['lag_ejections']),
+                         (False, 'lag', 1))
+
+        self.lag['a'] = 0.5
+        self.assertIn('a', self.serving(router))
+        self.assertTrue(router.stats()['replicas'][0]['healthy'])
+
+    def test_failing_replica_is_ejected(self):
+        """Test repeated connection errors eject a replica for eject_seconds"""
+        router = self.router(max_errors=2, eject_seconds=60)
+        for _ in range(2):
+            with self.assertRaises(psycopg2.OperationalError):
+                with patch.object(router, '_candidates', return_value=[self.replicas[0]]):
+                    with router.connection():
+                        raise psycopg2.OperationalError("server closed the connection")
+        stats = router.stats()['replicas'][0]
+        self.assertEqual((stats['healthy'], stats['ejected_for'], stats['error_ejections']),
+                         (False, 'errors', 1))
+        self.assertEqual(self.serving(router), ['b', 'b', 'b', 'b'])
+
+        with patch('time.monotonic', return_value=10 ** 9):
+            self.assertIn('a', self.serving(router))
+
+    def test_statement_errors_do_not_count(self):
+        """Test errors from the statement itself leave the replica in rotation"""
+        router = self.router(max_errors=1)
+        with self.assertRaises(psycopg2.ProgrammingError):
+            with router.connection():
+                raise psycopg2.ProgrammingError("syntax error")
+        self.assertTrue(all(replica['healthy'] for replica in router.stats()['replicas']))
+
+    def test_cancelled_statements_do_not_count(self):
+        """Test statement timeouts and recovery conflicts neither count nor discard the connection"""
+        router = self.router(max_errors=1)
+        for error in (_ext.QueryCanceledError("canceling statement due to statement timeout"),
+                      _ext.TransactionRollbackError("canceling statement due to conflict with recovery")):
+            with patch.object(router, '_candidates', return_value=[self.replicas[0]]):
+                with self.assertRaises(type(error)):
+                    with router.connection() as connection:
+                        raise error
+            self.assertFalse(connection.close.called)
+        self.assertTrue(all(replica['healthy'] for replica in router.stats()['replicas']))
+        self.assertEqual(router.stats()['replicas'][0]['errors'], 0)
+        self.assertEqual(self.replicas[0].pool.stats()['connections_discarded'], 0)
+
+        with self.assertRaises(_ext.QueryCanceledError):
+            with ReplicaRouter(self.primary).connection():
+                raise _ext.QueryCanceledError("canceling statement due to user request")
+        self.assertEqual(self.primary.stats()['connections_discarded'], 0)
+
+    def test_falls_back_to_primary(self):
+        """Test the primary serves reads when every replica is unusable"""
+        self.lag['a'] = self.lag['b'] = 30.0
+        router = self.router()
+        self.assertEqual(self.serving(router, 2), ['primary', 'primary'])
+        self.assertEqual(router.stats()['primary_checkouts'], 2)
+
+    def test_connections_share_a_server(self):
+        """Test extra connections come from the same pool, and only when free"""
+        router = self.router()
+        with router.connections(2) as (pool, connections):
+            self.assertIs(pool, self.replicas[0].pool)
+            self.assertEqual([c._mock_name for c in connections], ['a', 'a'])
+
+        held = self.replicas[1].pool.getconn()
+        with patch.object(router, '_candidates', return_value=[self.replicas[1]]):
+            with router.connections(2) as (pool, connections):
+                self.assertIs(pool, self.replicas[1].pool)
+                self.assertEqual(len(connections), 1)
+        self.replicas[1].pool.putconn(held)
+        self.assertEqual(self.replicas[1].pool.stats()['in_use'], 0)
+        self.assertEqual(self.replicas[1].pool.stats()['timeouts'], 0)
+
+    def test_exhausted_replica_is_skipped(self):
+        """Test a replica pool timeout moves the read to the next replica"""
+        router = self.router()
+        self.serving(router, 2)
+        held = [self.replicas[0].pool.getconn() for _ in range(2)]
+        with self.assertRaises(PoolTimeout):
+            self.replicas[0].pool.getconn()
+        self.assertEqual(self.serving(router, 2), ['b', 'b'])
+        self.assertEqual(router.stats()['replicas'][0]['errors'], 1)
+        for connection in held:
+            self.replicas[0].pool.putconn(connection)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import json
+import queue
+import unittest
+from contextlib import contextmanager
+from unittest.mock import patch, MagicMock
+
+from slow_query import SlowQueryLog, redact
+
+
+class TestSlowQueryLog(unittest.TestCase):
+    def setUp(self):
+        self.cursor = MagicMock()
+        self.cursor.fetchone.return_value = [[{'Plan': {'Node Type': 'Seq Scan'}}]]
+        connection = MagicMock()
+        connection.cursor.return_value = self.cursor
+
+        @contextmanager
+        def fake_connection():
+            yield connection
+
+        self.pool = MagicMock()
+        self.pool.connection = fake_connection
+        self.entries = queue.Queue()
+
+    def make_log(self, **kwargs):
+        log = SlowQueryLog(self.pool, **kwargs)
+        patcher = patch.object(log, '_worker_queue', return_value=self.entries)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return log
+
+    def test_threshold_and_sampling(self):
+        """Test only statements over the threshold are queued, after sampling"""
+        log = self.make_log(threshold_ms=100)
+        log.observe('count', 'SELECT 1', [], 0.05)
+        self.assertTrue(self.entries.empty())
+        log.observe('count', 'SELECT 1', [], 0.2)
+        self.assertEqual(self.entries.get_nowait()['duration_ms'], 200)
+
+        log = self.make_log(threshold_ms=100, sample_rate=0.0)
+        log.observe('count', 'SELECT 1', [], 0.2)
+        self.assertTrue(self.entries.empty())
+        self.assertEqual(log.stats()['sampled_out'], 1)
+
+        log = self.make_log(threshold_ms=None)
+        log.observe('count', 'SELECT 1', [], 10.0)
+        self.assertTrue(self.entries.empty())
+
+    def test_watch_reports_failed_statements(self):
+        """Test a statement that raised is still reported"""
+        log = self.make_log(threshold_ms=0)
+        with self.assertRaises(RuntimeError):
+            with log.watch('page', 'SELECT 1', []):
+                raise RuntimeError('canceling statement due to statement timeout')
+        self.assertEqual(self.entries.get_nowait()['phase'], 'page')
+
+    def test_write_logs_json_with_cached_plan(self):
+        """Test records are JSON with redacted params and a per-SQL cached plan"""
+        log = self.make_log(threshold_ms=0)
+        entry = {'phase': 'count', 'query': 'SELECT  COUNT(*)\n FROM t WHERE x = ANY(%s)',
+                 'params': [['%war%'], 5], 'duration_ms': 812.345, 'logged_at': 1.0}
+        with self.assertLogs('gutenberg.slow_queries', level='WARNING') as logs:
+            log.write(entry)
+            log.write(entry)
+        first, second = [json.loads(record.getMessage()) for record in logs.records]
+        self.assertEqual(first['sql'], 'SELECT COUNT(*) FROM t WHERE x = ANY(%s)')
+        self.assertEqual(first['params'], [['<5 chars>'], 5])
+        self.assertEqual(first['duration_ms'], 812.35)
+        self.assertEqual((first['plan_source'], second['plan_source']), ('explain', 'cached'))
+        self.assertEqual(first['plan'], [{'Plan': {'Node Type': 'Seq Scan'}}])
+        explain_sql = self.cursor.execute.call_args.args[0]
+        self.assertTrue(explain_sql.startswith('EXPLAIN (FORMAT JSON) SELECT'))
+
+    def test_plan_comes_from_the_server_that_ran_it(self):
+        """Test a statement run on a replica is EXPLAINed there and cached per server"""
+        log = self.make_log(threshold_ms=0)
+        replica_cursor = MagicMock()
+        replica_cursor.fetchone.return_value = [[{'Plan': {'Node Type': 'Index Scan'}}]]
+        replica_connection = MagicMock()
+        replica_connection.cursor.return_value = replica_cursor
+
+        @contextmanager
+        def replica_connection_context():
+            yield replica_connection
+
+        replica = MagicMock(config={'host': 'replica-1', 'port': 5433})
+        replica.connection = replica_connection_context
+        self.pool.config = {'host': 'primary', 'port': 5432}
+
+        with log.watch('page', 'SELECT 1', [], pool=replica):
+            pass
+        with self.assertLogs('gutenberg.slow_queries', level='WARNING') as logs:
+            log.write(self.entries.get_nowait())
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['server'], 'replica-1:5433')
+        self.assertEqual(record['plan'], [{'Plan': {'Node Type': 'Index Scan'}}])
+        self.cursor.execute.assert_not_called()
+
+        # The primary's plan for the same SQL is captured separately
+        self.assertEqual(log.capture_plan('SELECT 1', [])[1], 'explain')
+        self.assertEqual(log.capture_plan('SELECT 1', [], replica)[1], 'cached')
+
+    def test_analyze_mode(self):
+        """Test analyze mode re-runs EXPLAIN ANALYZE under a statement timeout"""
+        log = self.make_log(threshold_ms=0, explain='analyze', explain_timeout_ms=250)
+        plan, source = log.capture_plan('SELECT 1', [])
+        self.assertEqual(source, 'explain_analyze')
+        (timeout_sql, timeout_params), (explain_sql, _) = [
+            c.args for c in self.cursor.execute.call_args_list]
+        self.assertIn('statement_timeout', timeout_sql)
+        self.assertEqual(timeout_params, [250])
+        self.assertTrue(explain_sql.startswith('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)'))
+        self.assertEqual(log.capture_plan('EXPLAIN (FORMAT JSON) SELECT 1', []),
+                         (None, 'not_explainable'))
+
+    def test_redact(self):
+        """Test redaction keeps numbers and the shape of lists"""
+        self.assertEqual(redact([['en', 'fr'], 25, None]), [['<2 chars>', '<2 chars>'], 25, None])
+        with self.assertRaises(ValueError):
+            SlowQueryLog(self.pool, explain='verbose')
+
+
+if __name__ == '__main__':
+    unittest.main()